@@ -23,6 +23,7 @@ import webob.exc
 
 from searchlight.api import policy
 from searchlight.common import exception
+from searchlight.common import result_cache
 from searchlight.common import utils
 from searchlight.common import wsgi
 import searchlight.elasticsearch
@@ -34,6 +35,7 @@ _ = i18n._
 _LE = i18n._LE
 
 CONF = cfg.CONF
+CONF.import_opt('rbac_filter_cache_size', 'searchlight.common.config')
 
 
 class SearchController(object):
@@ -55,6 +57,23 @@ class SearchController(object):
         """
         try:
             search_repo = self.gateway.get_catalog_search_repo(req.context)
+            cache = result_cache.get_result_cache()
+            cache_key = None
+            if cache:
+                # A cached result is returned without searching, so the
+                # policy the search repo would enforce is checked here
+                self.policy.enforce(req.context, 'catalog_search', {})
+                doc_types = doc_type or list(self.plugins)
+                if isinstance(doc_types, six.string_types):
+                    doc_types = [doc_types]
+                cache_key = cache.get_key(
+                    req.context, doc_types,
+                    {'index': index, 'doc_type': doc_type, 'query': query,
+                     'offset': offset, 'limit': limit, 'kwargs': kwargs})
+                result = cache_key and cache.get(cache_key)
+                if result is not None:
+                    return result
+
             result = search_repo.search(index,
                                         doc_type,
                                         query,
@@ -73,6 +92,8 @@ class SearchController(object):
                     plugin.filter_result(hit, req.context)
             except KeyError as e:
                 raise Exception("No registered plugin for type %s" % e.message)
+            if cache_key:
+                cache.set(cache_key, result)
             return result
         except exception.Forbidden as e:
             raise webob.exc.HTTPForbidden(explanation=e.msg)
@@ -103,6 +124,11 @@ class SearchController(object):
                 default_index,
                 default_type,
                 actions)
+            doc_types = set(action.get('_type') or default_type
+                            for action in actions)
+            if None in doc_types:
+                doc_types = self.plugins.keys()
+            result_cache.invalidate(doc_types)
             return {
                 'success': success,
                 'failed': len(errors),
@@ -141,6 +167,9 @@ class RequestDeserializer(wsgi.JSONRequestDeserializer):
     def __init__(self, plugins, schema=None):
         super(RequestDeserializer, self).__init__()
         self.plugins = plugins
+        self.rbac_filters = None
+        if CONF.rbac_filter_cache_size:
+            self.rbac_filters = utils.LRUCache(CONF.rbac_filter_cache_size)
 
     def _get_request_body(self, request):
         output = super(RequestDeserializer, self).default(request)
@@ -289,40 +318,59 @@ class RequestDeserializer(wsgi.JSONRequestDeserializer):
                 }
             }
         else:
-            filtered_query_list = []
-            for resource_type, plugin in six.iteritems(self.plugins):
-                try:
-                    rbac_filter = plugin.obj.get_rbac_filter(context)
-                except Exception as e:
-                    msg = _("Error processing %s RBAC filter") % resource_type
-                    LOG.error(_LE("Failed to retrieve RBAC filters "
-                                  "from search plugin "
-                                  "%(ext)s: %(e)s") %
-                              {'ext': plugin.name, 'e': e})
-                    raise webob.exc.HTTPInternalServerError(explanation=msg)
-
-                if resource_type in resource_types:
-                    filter_query = {
-                        "query": query,
-                        "filter": rbac_filter
-                    }
-                    filtered_query = {
-                        'filtered': filter_query
-                    }
-                    filtered_query_list.append(filtered_query)
-
+            # The query is evaluated once, against documents of any of the
+            # requested types that pass that type's RBAC filter
             query_params = {
                 'query': {
                     'query': {
-                        "bool": {
-                            "should": filtered_query_list
-                        },
+                        'filtered': {
+                            'query': query,
+                            'filter': {
+                                'or': self._get_rbac_filters(context,
+                                                             resource_types)
+                            }
+                        }
                     }
                 }
             }
 
         return query_params
 
+    def _get_rbac_filters(self, context, resource_types):
+        """Return the RBAC filters of the requested resource types. They
+        only depend on who is searching, so they're cached; callers mustn't
+        modify them.
+        """
+        key = (context.owner, context.tenant, tuple(sorted(context.roles)),
+               context.is_admin, frozenset(resource_types))
+        if self.rbac_filters is not None and key in self.rbac_filters:
+            return self.rbac_filters.get(key)
+
+        rbac_filters = []
+        for resource_type, plugin in six.iteritems(self.plugins):
+            if resource_type not in resource_types:
+                continue
+            try:
+                rbac_filter = plugin.obj.get_rbac_filter(context)
+            except Exception as e:
+                msg = _("Error processing %s RBAC filter") % resource_type
+                LOG.error(_LE("Failed to retrieve RBAC filters "
+                              "from search plugin "
+                              "%(ext)s: %(e)s") %
+                          {'ext': plugin.name, 'e': e})
+                raise webob.exc.HTTPInternalServerError(explanation=msg)
+
+            if isinstance(rbac_filter, list):
+                if len(rbac_filter) == 1:
+                    rbac_filter = rbac_filter[0]
+                else:
+                    rbac_filter = {'and': rbac_filter}
+            rbac_filters.append(rbac_filter)
+
+        if self.rbac_filters is not None:
+            self.rbac_filters[key] = rbac_filters
+        return rbac_filters
+
     def _get_sort_order(self, sort_order):
         if isinstance(sort_order, (six.text_type, dict)):
             # Elasticsearch expects a list
@@ -497,7 +545,7 @@ class ResponseSerializer(wsgi.JSONResponseSerializer):
 
 def create_resource():
     """Search resource factory method"""
-    plugins = utils.get_search_plugins()
+    plugins = utils.get_search_plugin_registry()
     deserializer = RequestDeserializer(plugins)
     serializer = ResponseSerializer()
     controller = SearchController(plugins)
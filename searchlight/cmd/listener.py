@@ -13,6 +13,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import eventlet
+
+# Notifications may be processed concurrently in green threads; monkey
+# patch socket, time, select, threads so that they can run concurrently
+eventlet.patcher.monkey_patch(socket=True, time=True, select=True,
+                              thread=True, os=True)
+
 from oslo_config import cfg
 from oslo_service import service as os_service
 
@@ -13,23 +13,36 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import eventlet
+
+# Bulk indexing sends requests from green threads; monkey patch socket,
+# time, select, threads so that they can run concurrently
+eventlet.patcher.monkey_patch(socket=True, time=True, select=True,
+                              thread=True, os=True)
+
+import collections
+import functools
 import six
 import sys
+import time
 
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import encodeutils
+from oslo_utils import timeutils
 
 from searchlight.common import config
 from searchlight.common import utils
+import searchlight.elasticsearch
+from searchlight.elasticsearch.plugins import utils as plugin_utils
 from searchlight import i18n
 
-
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
 _ = i18n._
 _LE = i18n._LE
 _LI = i18n._LI
+_LW = i18n._LW
 
 
 # Decorators for actions
@@ -52,7 +65,39 @@ class IndexCommands(object):
           help="Don't prompt (answer 'y')")
     @args('--no-delete', dest='clear', action='store_false',
           help="Don't delete existing data")
-    def sync(self, index=None, _type=None, force=False, clear=False):
+    @args('--since', metavar='<timestamp|last>', dest='since',
+          help="Only index resources changed since an ISO 8601 UTC "
+               "timestamp, or since each type was last synced successfully "
+               "('last'). Implies --no-delete")
+    @args('--parallel', metavar='<n>', dest='parallel', type=int, default=1,
+          help='Index up to this many resource types concurrently')
+    @args('--resume', dest='resume', action='store_true',
+          help="Continue each type's last interrupted sync from where it "
+               "stopped. Implies --no-delete")
+    @args('--reconcile', dest='reconcile', action='store_true',
+          help="Only write documents that have changed and delete those "
+               "for resources that no longer exist, instead of rebuilding "
+               "the index")
+    def sync(self, index=None, _type=None, force=False, clear=False,
+             since=None, parallel=1, resume=False, reconcile=False):
+        if parallel < 1:
+            print("--parallel must be at least 1")
+            sys.exit(1)
+        if reconcile and (since or resume):
+            print("--reconcile can't be used with --since or --resume")
+            sys.exit(1)
+
+        if since or resume or reconcile:
+            clear = False
+        if since:
+            if since != 'last':
+                try:
+                    since = timeutils.normalize_time(
+                        timeutils.parse_isotime(since))
+                except ValueError as e:
+                    print("Invalid --since value: %s" % e)
+                    sys.exit(1)
+
         # Verify all indices and types have registered plugins.
         # index and _type are lists because of nargs='*'
         index = index.split(',') if index else []
@@ -91,9 +136,28 @@ class IndexCommands(object):
 
             if clear:
                 ans = raw_input(
-                    "Indexing will delete existing data and mapping(s) before "
-                    "reindexing.\nUse '--force' to suppress this "
+                    "Indexing will rebuild the selected resource types into "
+                    "a new index, replacing the existing data and mapping(s) "
+                    "once it completes.\nUse '--force' to suppress this "
                     "message.\nOK to continue? [y/n]: ")
+            elif reconcile:
+                ans = raw_input(
+                    "Indexing will update changed resources and delete "
+                    "those that no longer exist in the existing index(es). "
+                    "\nUse '--force' to suppress this message."
+                    "\nOK to continue? [y/n]: ")
+            elif since:
+                ans = raw_input(
+                    "Indexing will NOT delete existing data or mapping(s). It "
+                    "will reindex resources changed since the last sync or "
+                    "given time. \nUse '--force' to suppress this message."
+                    "\nOK to continue? [y/n]: ")
+            elif resume:
+                ans = raw_input(
+                    "Indexing will NOT delete existing data or mapping(s). It "
+                    "will continue any interrupted sync, or reindex all "
+                    "resources. \nUse '--force' to suppress this message."
+                    "\nOK to continue? [y/n]: ")
             else:
                 ans = raw_input(
                     "Indexing will NOT delete existing data or mapping(s). It "
@@ -103,14 +167,281 @@ class IndexCommands(object):
                 print("Aborting.")
                 sys.exit(0)
 
-        for resource_type, ext in plugins_to_index:
-            plugin_obj = ext.obj
+        # Only '--since last' and '--resume' need to know about earlier
+        # syncs, so other syncs neither read nor write the state file
+        sync_state = None
+        if since == 'last' or resume:
+            sync_state = plugin_utils.SyncState(
+                plugin_utils.get_sync_state_path())
+        pool = eventlet.GreenPool(parallel)
+
+        if clear:
+            plugins_by_index = collections.OrderedDict()
+            for resource_type, ext in plugins_to_index:
+                plugins_by_index.setdefault(ext.obj.get_index_name(),
+                                            []).append(ext.obj)
+            results = self._rebuild_indices(plugins_by_index, pool)
+        else:
+            results = self._sync_in_place(
+                [ext.obj for resource_type, ext in plugins_to_index],
+                since, resume, reconcile, sync_state, pool)
+
+        print("\nSync summary:")
+        for plugin_obj, error, elapsed in results:
+            print("  %(type)s (%(index)s): %(result)s in %(elapsed).1fs" %
+                  {'type': plugin_obj.get_document_type(),
+                   'index': plugin_obj.get_index_name(),
+                   'result': 'FAILED (%s)' % error if error else 'done',
+                   'elapsed': elapsed})
+
+        if any(error for plugin_obj, error, elapsed in results):
+            sys.exit(1)
+
+    def _sync_in_place(self, plugin_objs, since, resume, reconcile,
+                       sync_state, pool):
+        """Index each plugin's data into its existing index, returning a
+        (plugin, error, elapsed) tuple for each plugin. If sync_state is
+        given, progress is saved so that an interrupted sync can be resumed.
+        """
+        results = []
+        # Indices and mappings are set up one plugin at a time; plugins
+        # that share an index would otherwise race to create it
+        ready = []
+        for plugin_obj in plugin_objs:
+            try:
+                plugin_obj.prepare_indexing(clear=False)
+            except Exception as e:
+                LOG.error(_LE("Failed to set up index for %(type)s: %(e)s") %
+                          {'type': plugin_obj.get_document_type(), 'e': e})
+                results.append((plugin_obj, e, 0))
+            else:
+                ready.append(plugin_obj)
+
+        def load(plugin_obj):
+            started = timeutils.utcnow()
+            start = time.time()
+            doc_type = plugin_obj.get_document_type()
+            marker = None
+            if resume:
+                marker = sync_state.get(doc_type, 'resume_marker')
+            if marker:
+                LOG.info(_LI("Resuming indexing %(type)s after %(marker)s") %
+                         {'type': doc_type, 'marker': marker})
+            else:
+                LOG.info(_LI("Indexing %s") % doc_type)
+
+            def checkpoint(marker):
+                self._save_state(sync_state, plugin_obj, 'resume_marker',
+                                 marker)
+
+            try:
+                if reconcile:
+                    plugin_obj.reconcile_data()
+                else:
+                    plugin_obj.setup_data(
+                        since=self._get_since(since, sync_state, plugin_obj),
+                        marker=marker,
+                        checkpoint=checkpoint if sync_state else None)
+            except Exception as e:
+                LOG.error(_LE("Failed to index %(type)s: %(e)s") %
+                          {'type': plugin_obj.get_document_type(), 'e': e})
+                return plugin_obj, e, time.time() - start
+
+            LOG.info(_LI("Finished indexing %s") %
+                     plugin_obj.get_document_type())
+            self._record_sync(sync_state, plugin_obj, started)
+            return plugin_obj, None, time.time() - start
+
+        results.extend(pool.imap(load, ready))
+        return results
+
+    def _get_since(self, since, sync_state, plugin_obj):
+        if since != 'last':
+            return since
+
+        last_sync = sync_state.get(plugin_obj.get_document_type(),
+                                   'last_sync')
+        if not last_sync:
+            LOG.warning(_LW("No previous sync recorded for %s; indexing all "
+                            "resources") % plugin_obj.get_document_type())
+            return None
+        return timeutils.normalize_time(timeutils.parse_isotime(last_sync))
+
+    def _record_sync(self, sync_state, plugin_obj, started):
+        """Record the time a successful sync started, which is the point
+        from which the next '--since last' sync must look for changes.
+        """
+        self._save_state(sync_state, plugin_obj, 'last_sync',
+                         timeutils.isotime(started))
+        self._save_state(sync_state, plugin_obj, 'resume_marker', None)
+
+    def _save_state(self, sync_state, plugin_obj, key, value):
+        if not sync_state:
+            return
+        try:
+            sync_state.set(plugin_obj.get_document_type(), key, value)
+        except (IOError, OSError) as e:
+            LOG.warning(_LW("Failed to record %(key)s for %(type)s: "
+                            "%(e)s") % {'key': key,
+                                        'type': plugin_obj.get_document_type(),
+                                        'e': e})
+
+    def _rebuild_indices(self, plugins_by_index, pool):
+        """Rebuild each alias in plugins_by_index into a new physical index,
+        returning a (plugin, error, elapsed) tuple for each plugin.
+
+        New indices and their mappings are created one at a time, then data
+        for every plugin is loaded using the pool. An alias is switched to
+        its new index only if all of its plugins succeeded; otherwise the
+        new index is deleted and the alias keeps pointing at the old one.
+        """
+        es_engine = searchlight.elasticsearch.get_api()
+        failed = {}
+        rebuilds = []
+        for alias_name, plugin_objs in six.iteritems(plugins_by_index):
+            rebuild = _IndexRebuild(es_engine, alias_name, plugin_objs)
+            try:
+                rebuild.prepare()
+            except Exception as e:
+                LOG.error(_LE("Failed to create new index for %(index)s: "
+                              "%(e)s") % {'index': alias_name, 'e': e})
+                rebuild.abandon()
+                failed[alias_name] = e
+            else:
+                rebuilds.append(rebuild)
+
+        def load(task):
+            rebuild, plugin_obj, load_fn = task
+            name = plugin_obj.get_document_type() if plugin_obj else None
+            start = time.time()
+            try:
+                load_fn()
+            except Exception as e:
+                LOG.error(_LE("Failed to load %(name)s into %(index)s: "
+                              "%(e)s") % {'name': name or 'copied documents',
+                                          'index': rebuild.new_index,
+                                          'e': e})
+                return task, e, time.time() - start
+            return task, None, time.time() - start
+
+        tasks = [task for rebuild in rebuilds for task in rebuild.get_tasks()]
+        elapsed_by_plugin = {}
+        for (rebuild, plugin_obj, load_fn), error, elapsed in pool.imap(
+                load, tasks):
+            if error and rebuild.alias_name not in failed:
+                failed[rebuild.alias_name] = error
+            if plugin_obj:
+                elapsed_by_plugin[plugin_obj] = elapsed
+
+        for rebuild in rebuilds:
+            if rebuild.alias_name in failed:
+                rebuild.abandon()
+                continue
+            try:
+                rebuild.finish()
+            except Exception as e:
+                LOG.error(_LE("Failed to switch %(index)s to its new index: "
+                              "%(e)s") % {'index': rebuild.alias_name,
+                                          'e': e})
+                rebuild.abandon()
+                failed[rebuild.alias_name] = e
+
+        return [(plugin_obj, failed.get(alias_name),
+                 elapsed_by_plugin.get(plugin_obj, 0))
+                for alias_name, plugin_objs in six.iteritems(plugins_by_index)
+                for plugin_obj in plugin_objs]
+
+
+class _IndexRebuild(object):
+    """Builds a new physical index for some plugins, copying across any
+    other document types from the current one, and then atomically points
+    the alias (which is what plugins call their index) at it. Searches use
+    the old index until the new one is complete.
+    """
+    def __init__(self, es_engine, alias_name, plugin_objs):
+        self.es_engine = es_engine
+        self.alias_name = alias_name
+        self.plugin_objs = plugin_objs
+        self.old_indices = []
+        self.new_index = None
+        self.copied_types = []
+        self.restore_settings = None
+
+    def prepare(self):
+        """Create the new index with mappings for all of the plugins and
+        any document types that will be copied.
+        """
+        for plugin_obj in self.plugin_objs:
+            plugin_obj.check_mapping_sort_fields()
+
+        settings = {}
+        for plugin_obj in self.plugin_objs:
+            settings.update(plugin_obj.get_settings())
+
+        self.old_indices = plugin_utils.get_alias_indices(self.es_engine,
+                                                          self.alias_name)
+        self.new_index = plugin_utils.create_versioned_index(self.es_engine,
+                                                             self.alias_name,
+                                                             settings)
+        LOG.info(_LI("Rebuilding %(alias)s in new index %(index)s") %
+                 {'alias': self.alias_name, 'index': self.new_index})
+
+        for plugin_obj in self.plugin_objs:
+            plugin_obj.setup_mapping(index_name=self.new_index)
+
+        # Types belonging to plugins that aren't being reindexed (or
+        # aren't enabled) are carried over from the existing index
+        synced_types = set(p.get_document_type() for p in self.plugin_objs)
+        for old_index in self.old_indices:
+            mappings = self.es_engine.indices.get_mapping(index=old_index)
+            for doc_type, mapping in six.iteritems(
+                    mappings[old_index]['mappings']):
+                if doc_type in synced_types or doc_type == '_default_':
+                    continue
+                self.es_engine.indices.put_mapping(index=self.new_index,
+                                                   doc_type=doc_type,
+                                                   body=mapping)
+                self.copied_types.append((old_index, doc_type))
+
+        self.restore_settings = plugin_utils.get_build_settings_to_restore(
+            self.es_engine, self.new_index)
+        self.es_engine.indices.put_settings(index=self.new_index,
+                                            body=plugin_utils.BUILD_SETTINGS)
+
+    def get_tasks(self):
+        """Return (rebuild, plugin, function) tuples that load data into
+        the new index; they may be run concurrently. plugin is None for
+        document types copied from the old index.
+        """
+        tasks = [(self, plugin_obj,
+                  functools.partial(plugin_obj.setup_data,
+                                    index_name=self.new_index))
+                 for plugin_obj in self.plugin_objs]
+        tasks.extend((self, None,
+                      functools.partial(plugin_utils.copy_documents,
+                                        self.es_engine, old_index,
+                                        self.new_index, doc_type))
+                     for old_index, doc_type in self.copied_types)
+        return tasks
+
+    def finish(self):
+        self.es_engine.indices.put_settings(index=self.new_index,
+                                            body=self.restore_settings)
+        self.es_engine.indices.refresh(index=self.new_index)
+        plugin_utils.switch_alias(self.es_engine, self.alias_name,
+                                  self.new_index)
+
+        for old_index in self.old_indices:
+            if old_index != self.alias_name:
+                self.es_engine.indices.delete(index=old_index)
+
+    def abandon(self):
+        if self.new_index:
             try:
-                plugin_obj.initial_indexing(clear=clear)
+                self.es_engine.indices.delete(index=self.new_index)
             except Exception as e:
-                LOG.error(_LE("Failed to setup index extension "
-                              "%(ext)s: %(e)s") % {'ext': ext.name,
-                                                   'e': e})
+                LOG.warning(_LW("Failed to delete index %(index)s: %(e)s") %
+                            {'index': self.new_index, 'e': e})
 
 
 def add_command_parsers(subparsers):
@@ -74,6 +74,11 @@ common_opts = [
                       'available algorithms supported by the version of '
                       'OpenSSL on the platform. Examples are "sha1", '
                       '"sha256", "sha512", etc.')),
+    cfg.IntOpt('rbac_filter_cache_size', default=1000,
+               help=_('Number of combinations of user, project, roles and '
+                      'resource types whose RBAC filters are kept by each '
+                      'API worker, so that they needn\'t be built for '
+                      'every search. 0 disables the cache.')),
 ]
 
 CONF = cfg.CONF
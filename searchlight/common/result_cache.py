@@ -0,0 +1,232 @@
+# Copyright (c) 2015 Hewlett-Packard Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache of search results, shared by requests with the same body and RBAC
+scope.
+
+Each document type has a generation counter which is incremented whenever
+the listener or the index API writes documents of that type. The
+generations of the searched types are part of each cache key, so a write
+makes earlier results for its types unreachable; they're evicted by their
+TTL or to make room for new entries.
+"""
+
+import abc
+import eventlet
+import hashlib
+import os
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+import six
+from stevedore import driver
+import time
+
+from searchlight.common import utils
+from searchlight import i18n
+
+LOG = logging.getLogger(__name__)
+_LE = i18n._LE
+
+result_cache_opts = [
+    cfg.BoolOpt('enabled', default=False,
+                help='Cache search results.'),
+    cfg.StrOpt('backend', default='memory',
+               help='Where results are cached: "memory" keeps them in '
+                    'each API worker, "memcached" shares them between '
+                    'workers and with the listener, which then invalidates '
+                    'them as soon as documents change. Other backends may '
+                    'be installed in the searchlight.result_cache '
+                    'namespace.'),
+    cfg.IntOpt('ttl', default=30,
+               help='Seconds for which a result is cached. With the memory '
+                    'backend, changes made by the listener may not be '
+                    'seen until a cached result expires.'),
+    cfg.IntOpt('max_entries', default=1000,
+               help='Maximum number of results kept by each API worker '
+                    'with the memory backend.'),
+    cfg.FloatOpt('refresh_delay', default=1.0,
+                 help='Seconds after a write at which results for its '
+                      'document types are invalidated again, in case they '
+                      'were cached before Elasticsearch made the write '
+                      'visible. This should match the index refresh '
+                      'interval.'),
+    cfg.ListOpt('memcached_servers', default=['127.0.0.1:11211'],
+                help='Memcached servers used by the memcached backend.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(result_cache_opts, group='result_cache')
+
+NAMESPACE = 'searchlight.result_cache'
+
+# The process id and result cache of the process that created it
+_result_cache = (None, None)
+
+
+def get_result_cache():
+    """Return the process's result cache, or None if caching is disabled."""
+    global _result_cache
+    if not CONF.result_cache.enabled:
+        return None
+    pid, cache = _result_cache
+    if pid != os.getpid():
+        backend = driver.DriverManager(
+            NAMESPACE, CONF.result_cache.backend, invoke_on_load=True).driver
+        cache = ResultCache(backend)
+        _result_cache = (os.getpid(), cache)
+    return cache
+
+
+def invalidate(doc_types):
+    """Invalidate cached results for doc_types, if caching is enabled."""
+    cache = get_result_cache()
+    if cache:
+        cache.invalidate(doc_types)
+
+
+class ResultCache(object):
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get_key(self, context, doc_types, request):
+        """Return the key under which to cache the result of request (a
+        dict of the search parameters) when searched for by context, or
+        None if the cache can't be used.
+        """
+        try:
+            generations = self.backend.get_generations(sorted(doc_types))
+        except Exception:
+            LOG.exception(_LE("Error reading search result generations"))
+            return None
+        key = {
+            'request': request,
+            'scope': [context.user, context.owner, context.tenant,
+                      sorted(context.roles), context.is_admin],
+            'generations': generations
+        }
+        serialized = jsonutils.dumps(key, sort_keys=True)
+        return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        try:
+            return self.backend.get(key)
+        except Exception:
+            LOG.exception(_LE("Error reading cached search result"))
+            return None
+
+    def set(self, key, result):
+        try:
+            self.backend.set(key, result, CONF.result_cache.ttl)
+        except Exception:
+            LOG.exception(_LE("Error caching search result"))
+
+    def invalidate(self, doc_types):
+        self._increment(doc_types)
+        # A search made before the write became visible may have been
+        # cached under the new generation
+        if CONF.result_cache.refresh_delay:
+            eventlet.spawn_after(CONF.result_cache.refresh_delay,
+                                 self._increment, doc_types)
+
+    def _increment(self, doc_types):
+        for doc_type in doc_types:
+            try:
+                self.backend.increment_generation(doc_type)
+            except Exception:
+                LOG.exception(_LE("Error invalidating cached search "
+                                  "results for %s"), doc_type)
+
+
+@six.add_metaclass(abc.ABCMeta)
+class CacheBackend(object):
+    """Stores cached results and the generation of each document type."""
+
+    @abc.abstractmethod
+    def get(self, key):
+        """Return the result cached under key, or None."""
+
+    @abc.abstractmethod
+    def set(self, key, result, ttl):
+        """Cache result under key for ttl seconds."""
+
+    @abc.abstractmethod
+    def get_generations(self, doc_types):
+        """Return a list of the current generation of each document type."""
+
+    @abc.abstractmethod
+    def increment_generation(self, doc_type):
+        """Increment the generation of a document type."""
+
+
+class MemoryBackend(CacheBackend):
+    """Caches results in the memory of a single process."""
+    def __init__(self):
+        self.results = utils.LRUCache(CONF.result_cache.max_entries)
+        self.generations = {}
+
+    def get(self, key):
+        entry = self.results.get(key)
+        if entry is None:
+            return None
+        expires, result = entry
+        if expires < time.time():
+            self.results.pop(key)
+            return None
+        return result
+
+    def set(self, key, result, ttl):
+        self.results[key] = (time.time() + ttl, result)
+
+    def get_generations(self, doc_types):
+        return [self.generations.get(doc_type, 0) for doc_type in doc_types]
+
+    def increment_generation(self, doc_type):
+        self.generations[doc_type] = self.generations.get(doc_type, 0) + 1
+
+
+class MemcachedBackend(CacheBackend):
+    """Caches results in memcached, shared by every process using the same
+    servers.
+    """
+    def __init__(self):
+        # python-memcached is only needed if this backend is used
+        import memcache
+        self.client = memcache.Client(CONF.result_cache.memcached_servers)
+
+    def get(self, key):
+        return self.client.get(self._result_key(key))
+
+    def set(self, key, result, ttl):
+        self.client.set(self._result_key(key), result, time=ttl)
+
+    def get_generations(self, doc_types):
+        keys = [self._generation_key(doc_type) for doc_type in doc_types]
+        generations = self.client.get_multi(keys)
+        return [generations.get(key, 0) for key in keys]
+
+    def increment_generation(self, doc_type):
+        key = self._generation_key(doc_type)
+        if self.client.incr(key) is None:
+            # add fails if another process created the counter first
+            if not self.client.add(key, 1):
+                self.client.incr(key)
+
+    def _result_key(self, key):
+        return 'searchlight-result-%s' % key
+
+    def _generation_key(self, doc_type):
+        return 'searchlight-generation-%s' % doc_type.replace(':', '_')
@@ -20,6 +20,7 @@
 System-level utilities and helper functions.
 """
 
+import collections
 import errno
 
 from eventlet.green import socket
@@ -45,6 +46,11 @@ from searchlight.common import exception
 from searchlight import i18n
 from searchlight import plugin
 
+try:
+    from collections import abc as collections_abc
+except ImportError:
+    collections_abc = collections
+
 CONF = cfg.CONF
 
 LOG = logging.getLogger(__name__)
@@ -54,6 +60,9 @@ _LE = i18n._LE
 FEATURE_BLACKLIST = ['content-length', 'content-type', 'x-image-meta-size']
 SEARCHLIGHT_TEST_SOCKET_FD_STR = 'SEARCHLIGHT_TEST_SOCKET_FD'
 
+# The process id and plugin registry of the process that loaded it
+_plugin_registry = (None, None)
+
 
 def safe_mkdirs(path):
     try:
@@ -407,6 +416,38 @@ def no_4byte_params(f):
     return wrapper
 
 
+class LRUCache(object):
+    """A dict-like cache holding at most maxsize entries; once full, the
+    least recently used entry is dropped to make room for a new one.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            return default
+        self._data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
 def stash_conf_values():
     """
     Make a copy of some of the current global CONF's settings.
@@ -434,3 +475,33 @@ def get_search_plugins():
         namespace, invoke_on_load=True)
     return {plugin.obj.get_document_type(): plugin
             for plugin in ext_manager.extensions if plugin.obj.enabled}
+
+
+class PluginRegistry(collections_abc.Mapping):
+    """A read-only mapping of document type to search plugin extension."""
+    def __init__(self, plugins):
+        self._plugins = dict(plugins)
+
+    def __getitem__(self, key):
+        return self._plugins[key]
+
+    def __iter__(self):
+        return iter(self._plugins)
+
+    def __len__(self):
+        return len(self._plugins)
+
+
+def get_search_plugin_registry():
+    """Return the enabled search plugins, loading them the first time this
+    is called in each process. Unlike get_search_plugins, the plugins are
+    shared by every caller, so they mustn't be modified.
+    """
+    global _plugin_registry
+    pid, registry = _plugin_registry
+    # A forked API worker loads its own plugins rather than sharing the
+    # parent's elasticsearch connections
+    if pid != os.getpid():
+        registry = PluginRegistry(get_search_plugins())
+        _plugin_registry = (os.getpid(), registry)
+    return registry
@@ -14,8 +14,10 @@
 #    under the License.
 
 import elasticsearch
+from elasticsearch import connection
 from elasticsearch import helpers
 import operator
+import os
 from oslo_config import cfg
 import six
 
@@ -32,25 +34,84 @@ search_opts = [
                 help='List of nodes where Elasticsearch instances are '
                      'running. A single node should be defined as an IP '
                      'address and port number.'),
+    cfg.IntOpt('timeout', default=10,
+               help='Seconds to wait for a response from Elasticsearch.'),
+    cfg.IntOpt('connections_per_host', default=10,
+               help='Maximum number of connections kept open to each '
+                    'Elasticsearch node. Connections are kept alive and '
+                    'shared by every request made by a process.'),
+    cfg.IntOpt('max_retries', default=3,
+               help='Number of times a request that fails because a node '
+                    'is unavailable is retried on another node.'),
+    cfg.BoolOpt('retry_on_timeout', default=False,
+                help='Whether requests that time out are retried.'),
+    cfg.BoolOpt('sniff_on_start', default=False,
+                help='Discover the nodes of the cluster from those in hosts '
+                     'when first connecting.'),
+    cfg.BoolOpt('sniff_on_connection_fail', default=False,
+                help='Discover the nodes of the cluster again when one of '
+                     'them fails.'),
+    cfg.IntOpt('sniffer_timeout',
+               help='Seconds between discovering the nodes of the cluster. '
+                    'By default nodes are only discovered as set by '
+                    'sniff_on_start and sniff_on_connection_fail.'),
+    cfg.BoolOpt('http_compress', default=False,
+                help='Ask Elasticsearch to gzip its responses. This only '
+                     'has an effect if http.compression is enabled in '
+                     'Elasticsearch.'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(search_opts, group='elasticsearch')
 
 
+# The process id and elasticsearch client of the process that created it
+_api = (None, None)
+
+
+class _CompressedConnection(connection.Urllib3HttpConnection):
+    def __init__(self, *args, **kwargs):
+        super(_CompressedConnection, self).__init__(*args, **kwargs)
+        self.headers['accept-encoding'] = 'gzip,deflate'
+
+
 def get_api():
-    es_hosts = CONF.elasticsearch.hosts
-    es_api = elasticsearch.Elasticsearch(hosts=es_hosts)
+    """Return the process's elasticsearch client, creating it the first
+    time this is called in each process so that its connections are
+    shared rather than opened for every caller.
+    """
+    global _api
+    pid, es_api = _api
+    # A forked API worker mustn't share its parent's sockets
+    if pid != os.getpid():
+        es_api = _create_api()
+        _api = (os.getpid(), es_api)
     return es_api
 
 
+def _create_api():
+    options = CONF.elasticsearch
+    kwargs = {}
+    if options.http_compress:
+        kwargs['connection_class'] = _CompressedConnection
+    return elasticsearch.Elasticsearch(
+        hosts=options.hosts,
+        timeout=options.timeout,
+        maxsize=options.connections_per_host,
+        max_retries=options.max_retries,
+        retry_on_timeout=options.retry_on_timeout,
+        sniff_on_start=options.sniff_on_start,
+        sniff_on_connection_fail=options.sniff_on_connection_fail,
+        sniffer_timeout=options.sniffer_timeout,
+        **kwargs)
+
+
 class CatalogSearchRepo(object):
 
     def __init__(self, context, es_api):
         self.context = context
         self.es_api = es_api
-        self.plugins = utils.get_search_plugins()
-        self.plugins_info_dict = self._get_plugin_info()
+        self.plugins = utils.get_search_plugin_registry()
 
     def search(self, index, doc_type, query, offset,
                limit, ignore_unavailable=True, **kwargs):
@@ -71,7 +132,7 @@ class CatalogSearchRepo(object):
             actions=actions)
 
     def plugins_info(self):
-        return self.plugins_info_dict
+        return self._get_plugin_info()
 
     def _get_plugin_info(self):
         plugin_list = []
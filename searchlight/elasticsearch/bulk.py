@@ -0,0 +1,501 @@
+# Copyright (c) 2015 Hewlett-Packard Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+from elasticsearch import exceptions as es_exceptions
+from elasticsearch import helpers
+from elasticsearch import serializer
+import eventlet
+from eventlet import semaphore
+import logging
+import os
+from oslo_config import cfg
+import random
+import six
+
+from searchlight import i18n
+
+
+LOG = logging.getLogger(__name__)
+_LE = i18n._LE
+_LI = i18n._LI
+_LW = i18n._LW
+
+CONF = cfg.CONF
+
+# Statuses with which elasticsearch rejects requests it's too busy to
+# handle (for instance when its bulk queue is full); they're worth retrying
+RETRY_STATUSES = (429, 503)
+MAX_BACKOFF = 60
+
+# Documents are indexed with external versions, so that a write carrying
+# older data than the index already has is rejected with a conflict
+VERSION_TYPE = 'external_gte'
+
+# Shared by every BulkWriter in the process so that several plugins
+# indexing at the same time can't overload the cluster between them
+_in_flight = None
+
+
+def _get_in_flight_semaphore():
+    global _in_flight
+    if _in_flight is None:
+        _in_flight = semaphore.Semaphore(
+            CONF.resource_plugin.bulk_max_in_flight)
+    return _in_flight
+
+
+def _make_action(op_type, index, doc_type, id, parent, body=None,
+                 version=None, version_type=None):
+    action = {'_op_type': op_type, '_index': index, '_type': doc_type}
+    if id is not None:
+        action['_id'] = id
+    if parent is not None:
+        action['_parent'] = parent
+    if version is not None:
+        action['_version'] = version
+        action['_version_type'] = version_type
+    if body is not None:
+        action['_source'] = body
+    return action
+
+
+def is_unavailable(error):
+    """Return whether a write failed because elasticsearch couldn't be
+    reached or was too busy to accept it, rather than because of the
+    request itself.
+    """
+    if isinstance(error, helpers.BulkIndexError):
+        return any(result.get('status') in RETRY_STATUSES
+                   for item in error.errors
+                   for result in six.itervalues(item))
+    return (isinstance(error, es_exceptions.ConnectionError) or
+            isinstance(error, es_exceptions.TransportError) and
+            error.status_code in RETRY_STATUSES)
+
+
+class BulkWriter(object):
+    """Sends bulk actions to elasticsearch in chunks limited both by
+    document count and by serialized size, with up to `workers` chunks
+    being sent concurrently.
+
+    Actions rejected because elasticsearch is overloaded are retried up to
+    max_retries times with exponential backoff. If dead_letter_file is set,
+    actions that still fail are appended to it as a bulk request body
+    rather than failing the write.
+    """
+    def __init__(self, engine, index, doc_type, workers=1,
+                 chunk_size=200, max_chunk_bytes=10 * 1024 * 1024,
+                 max_retries=3, retry_backoff=1.0, dead_letter_file=None):
+        self.engine = engine
+        self.index = index
+        self.doc_type = doc_type
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.dead_letter_file = dead_letter_file
+        self.serializer = engine.transport.serializer
+
+    def write(self, actions, on_chunk=None):
+        """Index an iterable of bulk actions, returning the number of
+        actions that succeeded. Raises BulkIndexError if any failed and
+        there's no dead letter file.
+
+        If given, on_chunk is called with the number of actions in each
+        chunk once it and every chunk before it have been indexed (or
+        written to the dead letter file).
+        """
+        count = 0
+        pool = eventlet.GreenPool(self.workers)
+        # imap only pulls a new chunk from the generator when a worker is
+        # free, so no more than workers + 1 chunks are held in memory. It
+        # also returns results in order, which on_chunk relies on
+        for chunk_size, succeeded in pool.imap(self._send_chunk,
+                                               self._chunk(actions)):
+            count += succeeded
+            if on_chunk:
+                on_chunk(chunk_size)
+        return count
+
+    def _chunk(self, actions):
+        chunk = []
+        size = 0
+        for action in actions:
+            op, data = helpers.expand_action(action)
+            lines = [self.serializer.dumps(op)]
+            if data is not None:
+                lines.append(self.serializer.dumps(data))
+            # Account for the trailing newline of each line
+            action_size = sum(len(line) + 1 for line in lines)
+
+            if chunk and (len(chunk) == self.chunk_size or
+                          size + action_size > self.max_chunk_bytes):
+                yield chunk
+                chunk = []
+                size = 0
+
+            chunk.append(lines)
+            size += action_size
+
+        if chunk:
+            yield chunk
+
+    def _send_chunk(self, chunk):
+        """Index a chunk, retrying actions that were rejected because
+        elasticsearch was busy. Returns the number of actions in the chunk
+        and the number that succeeded.
+        """
+        pending = chunk
+        errors = []
+        attempt = 0
+        while True:
+            try:
+                items = self._send(pending)
+            except es_exceptions.TransportError as e:
+                if attempt >= self.max_retries or not is_unavailable(e):
+                    raise
+                LOG.warning(_LW("Bulk request for %(doc_type)s failed, "
+                                "retrying: %(e)s") %
+                            {'doc_type': self.doc_type, 'e': e})
+                retry = pending
+            else:
+                retry = []
+                for lines, item in zip(pending, items):
+                    op_type, result = item.popitem()
+                    status = result.get('status', 500)
+                    # Deleting something that's already gone is fine, as is
+                    # failing to overwrite a newer version of a document
+                    if (200 <= status < 300 or
+                            op_type == 'delete' and status == 404 or
+                            op_type in ('index', 'delete') and status == 409):
+                        continue
+                    if (status in RETRY_STATUSES and
+                            attempt < self.max_retries):
+                        retry.append(lines)
+                    else:
+                        errors.append((lines, {op_type: result}))
+
+            if not retry:
+                break
+            attempt += 1
+            self._backoff(attempt)
+            pending = retry
+
+        if errors:
+            if not self.dead_letter_file:
+                raise helpers.BulkIndexError(
+                    '%i document(s) failed to index.' % len(errors),
+                    [error for lines, error in errors])
+            self._write_dead_letters(errors)
+
+        return len(chunk), len(chunk) - len(errors)
+
+    def _send(self, chunk):
+        body = '\n'.join('\n'.join(lines) for lines in chunk) + '\n'
+        with _get_in_flight_semaphore():
+            response = self.engine.bulk(body=body,
+                                        index=self.index,
+                                        doc_type=self.doc_type)
+        LOG.debug("Sent %(count)d %(doc_type)s actions (%(bytes)d bytes)",
+                  {'count': len(chunk), 'doc_type': self.doc_type,
+                   'bytes': len(body)})
+        return response['items']
+
+    def _backoff(self, attempt):
+        # Randomize the delay so that writers rejected at the same time
+        # don't all retry together
+        delay = min(self.retry_backoff * 2 ** (attempt - 1), MAX_BACKOFF)
+        eventlet.sleep(random.uniform(delay / 2, delay))
+
+    def _write_dead_letters(self, errors):
+        """Append failed actions to the dead letter file as a bulk request
+        body that names its index and type, so that it can be replayed by
+        sending it to the _bulk endpoint.
+        """
+        with open(self.dead_letter_file, 'a') as dead_letters:
+            for lines, error in errors:
+                op = self.serializer.loads(lines[0])
+                for metadata in six.itervalues(op):
+                    metadata.setdefault('_index', self.index)
+                    metadata.setdefault('_type', self.doc_type)
+                dead_letters.write(
+                    '\n'.join([self.serializer.dumps(op)] + lines[1:]) +
+                    '\n')
+
+        LOG.warning(_LW("%(count)d %(doc_type)s document(s) failed to index "
+                        "and were written to %(file)s. First error: "
+                        "%(error)s") %
+                    {'count': len(errors), 'doc_type': self.doc_type,
+                     'file': self.dead_letter_file, 'error': errors[0][1]})
+
+
+class BufferingEngine(object):
+    """Wraps an elasticsearch client so that index, create, update and
+    delete calls are held as bulk actions until flush() sends them all
+    together.
+
+    get() returns a document as buffered writes will leave it, so that
+    handlers which read a document before rewriting it (glance image
+    members, for instance) build on earlier notifications in the batch.
+    Where that isn't known (the document has a buffered partial update) the
+    buffer is flushed first. Any other use of the client (a search, a call
+    to the bulk API) goes straight to elasticsearch without flushing.
+
+    If a read, or a flush made for one, fails because elasticsearch is
+    unavailable, the error is kept in `unavailable` so that the caller can
+    retry everything rather than flush writes that may depend on it.
+
+    Extra keyword arguments are passed to the BulkWriter used to flush.
+    """
+    def __init__(self, engine, spool=None, **writer_kwargs):
+        self._engine = engine
+        self._spool = spool
+        self._writer_kwargs = writer_kwargs
+        self._actions = []
+        self.unavailable = None
+
+    def index(self, index, doc_type, body, id=None, parent=None,
+              version=None, version_type=None):
+        self._add('index', index, doc_type, id, parent, body,
+                  version=version, version_type=version_type)
+
+    def create(self, index, doc_type, body, id=None, parent=None):
+        self._add('create', index, doc_type, id, parent, body)
+
+    def update(self, index, doc_type, id, body, parent=None):
+        self._add('update', index, doc_type, id, parent, body)
+
+    def delete(self, index, doc_type, id, parent=None, version=None,
+               version_type=None):
+        self._add('delete', index, doc_type, id, parent,
+                  version=version, version_type=version_type)
+
+    def _add(self, op_type, index, doc_type, id, parent, body=None,
+             version=None, version_type=None):
+        self._actions.append(_make_action(op_type, index, doc_type, id,
+                                          parent, body, version,
+                                          version_type))
+
+    def get(self, index, doc_type, id, **kwargs):
+        for action in reversed(self._actions):
+            if (action['_index'], action['_type'], action.get('_id')) != (
+                    index, doc_type, id):
+                continue
+            if action['_op_type'] == 'index':
+                return {'_index': index, '_type': doc_type, '_id': id,
+                        'found': True,
+                        '_source': copy.deepcopy(action['_source'])}
+            if action['_op_type'] == 'delete':
+                raise es_exceptions.NotFoundError(
+                    404, 'not_found', {'_index': index, '_type': doc_type,
+                                       '_id': id, 'found': False})
+            # The result of an update, or of a create that may conflict, is
+            # only known once it's been applied
+            try:
+                self.flush()
+            except (es_exceptions.TransportError,
+                    helpers.BulkIndexError) as e:
+                if is_unavailable(e):
+                    self.unavailable = e
+                raise
+            break
+        return self.__getattr__('get')(index=index, doc_type=doc_type, id=id,
+                                       **kwargs)
+
+    def flush(self):
+        """Send buffered actions to the bulk API, returning the number that
+        succeeded. Raises BulkIndexError if any of them failed.
+
+        If a spool was given, the actions are appended to it instead when
+        elasticsearch is unavailable or the spool is waiting to be
+        replayed.
+        """
+        actions, self._actions = self._actions, []
+        if not actions:
+            return 0
+        if self._spool and self._spool.pending:
+            self._spool.append(actions)
+            return 0
+        # Every action names its own index and type
+        writer = BulkWriter(self._engine, None, None,
+                            chunk_size=len(actions), **self._writer_kwargs)
+        try:
+            return writer.write(actions)
+        except (es_exceptions.TransportError, helpers.BulkIndexError) as e:
+            if not self._spool or not is_unavailable(e):
+                raise
+            # Actions that did succeed are sent again on replay, which is
+            # harmless since they're versioned or idempotent
+            self._spool.append(actions)
+            return 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._engine, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            try:
+                return attr(*args, **kwargs)
+            except es_exceptions.TransportError as e:
+                if is_unavailable(e):
+                    self.unavailable = e
+                raise
+        return call
+
+
+class Spool(object):
+    """An append-only journal of bulk actions that couldn't be sent to
+    elasticsearch, kept until they can be replayed.
+
+    The journal is written as a bulk request body in which every action
+    names its index and type, like the BulkWriter's dead letter file.
+    While it's being replayed it is moved aside to a file with a '.replay'
+    suffix, so that actions spooled in the meantime are kept in order
+    behind it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.replay_path = path + '.replay'
+        self.serializer = serializer.JSONSerializer()
+        self._replaying = False
+        self._pending = (os.path.exists(self.replay_path) or
+                         os.path.exists(self.path) and
+                         os.path.getsize(self.path) > 0)
+
+    @property
+    def pending(self):
+        """Whether there are spooled actions that haven't been replayed.
+        Later writes must be spooled too so they aren't overtaken.
+        """
+        return self._pending
+
+    def append(self, actions):
+        lines = []
+        for action in actions:
+            op, data = helpers.expand_action(action)
+            lines.append(self.serializer.dumps(op))
+            if data is not None:
+                lines.append(self.serializer.dumps(data))
+        with open(self.path, 'a') as journal:
+            journal.write('\n'.join(lines) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+        if not self._pending:
+            LOG.warning(_LW("Elasticsearch is unavailable; spooling index "
+                            "updates to %s") % self.path)
+        self._pending = True
+
+    def replay(self, engine, **writer_kwargs):
+        """Send spooled actions to elasticsearch, returning the number
+        sent. Extra keyword arguments are passed to the BulkWriter used.
+
+        If elasticsearch is still unavailable the error is raised and the
+        journal is kept to be replayed later. Actions that fail for any
+        other reason would fail again, so they're logged and dropped.
+        """
+        if self._replaying or not self._pending:
+            return 0
+        self._replaying = True
+        count = 0
+        try:
+            while True:
+                if not os.path.exists(self.replay_path):
+                    if (not os.path.exists(self.path) or
+                            not os.path.getsize(self.path)):
+                        break
+                    os.rename(self.path, self.replay_path)
+                count += self._replay_file(engine, writer_kwargs)
+                os.remove(self.replay_path)
+            # Nothing can have been spooled since the check above, since
+            # there's been no chance for another green thread to run
+            self._pending = False
+        finally:
+            self._replaying = False
+        if count:
+            LOG.info(_LI("Replayed %(count)d spooled index update(s) from "
+                         "%(file)s") % {'count': count, 'file': self.path})
+        return count
+
+    def _replay_file(self, engine, writer_kwargs):
+        writer = BulkWriter(engine, None, None, **writer_kwargs)
+        try:
+            return writer.write(self._read_actions())
+        except helpers.BulkIndexError as e:
+            if is_unavailable(e):
+                raise
+            LOG.error(_LE("Failed to replay %(count)d spooled index "
+                          "update(s): %(errors)s") %
+                      {'count': len(e.errors), 'errors': e.errors})
+            return 0
+
+    def _read_actions(self):
+        with open(self.replay_path) as journal:
+            lines = (line for line in journal if line.strip())
+            for line in lines:
+                op_type, metadata = self.serializer.loads(line).popitem()
+                action = dict(metadata, _op_type=op_type)
+                if op_type != 'delete':
+                    action['_source'] = self.serializer.loads(next(lines))
+                yield action
+
+
+class SpoolingEngine(object):
+    """Wraps an elasticsearch client so that index, create, update and
+    delete calls are appended to a Spool instead of failing when
+    elasticsearch is unavailable, and for as long as the spool is waiting
+    to be replayed. Anything else is passed straight to the client.
+    """
+    def __init__(self, engine, spool):
+        self._engine = engine
+        self._spool = spool
+
+    def index(self, index, doc_type, body, id=None, parent=None, **kwargs):
+        return self._write('index', index, doc_type, id, parent, body,
+                           **kwargs)
+
+    def create(self, index, doc_type, body, id=None, parent=None):
+        return self._write('create', index, doc_type, id, parent, body)
+
+    def update(self, index, doc_type, id, body, parent=None):
+        return self._write('update', index, doc_type, id, parent, body)
+
+    def delete(self, index, doc_type, id, parent=None, **kwargs):
+        return self._write('delete', index, doc_type, id, parent, **kwargs)
+
+    def _write(self, op_type, index, doc_type, id, parent, body=None,
+               version=None, version_type=None):
+        if not self._spool.pending:
+            kwargs = {}
+            if body is not None:
+                kwargs['body'] = body
+            if parent is not None:
+                kwargs['parent'] = parent
+            if version is not None:
+                kwargs.update(version=version, version_type=version_type)
+            try:
+                return getattr(self._engine, op_type)(
+                    index=index, doc_type=doc_type, id=id, **kwargs)
+            except es_exceptions.TransportError as e:
+                if not is_unavailable(e):
+                    raise
+        self._spool.append([_make_action(op_type, index, doc_type, id,
+                                         parent, body, version,
+                                         version_type)])
+
+    def __getattr__(self, name):
+        return getattr(self._engine, name)
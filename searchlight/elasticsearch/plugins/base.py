@@ -14,34 +14,90 @@
 #    under the License.
 
 import abc
+import collections
+from elasticsearch import exceptions as es_exceptions
 from elasticsearch import helpers
 import fnmatch
 import logging
+import os
 from oslo_config import cfg
 from oslo_config import types
+import resource
 import six
+import time
 
 import searchlight.elasticsearch
+from searchlight.elasticsearch import bulk
+from searchlight.elasticsearch.plugins import utils
 from searchlight import i18n
 from searchlight import plugin
 
 
 LOG = logging.getLogger(__name__)
+_LI = i18n._LI
 _LW = i18n._LW
 
+# Documents written by a sync store a hash of their content in this field,
+# so that reconcile_data can tell which of them have changed
+CONTENT_HASH_FIELD = 'searchlight_content_hash'
+
 
 indexer_opts = [
-    cfg.StrOpt('index_name', default="searchlight")
+    cfg.StrOpt('index_name', default="searchlight"),
+    cfg.IntOpt('bulk_workers', default=1,
+               help='Number of bulk requests each plugin may have in '
+                    'progress at the same time during initial indexing.'),
+    cfg.IntOpt('bulk_chunk_size', default=200,
+               help='Maximum number of documents sent in a single bulk '
+                    'request during initial indexing.'),
+    cfg.IntOpt('bulk_max_chunk_bytes', default=10 * 1024 * 1024,
+               help='Maximum size in bytes of a single bulk request during '
+                    'initial indexing. A document larger than this is sent '
+                    'on its own.'),
+    cfg.IntOpt('bulk_max_retries', default=3,
+               help='Number of times a bulk action rejected because '
+                    'elasticsearch is busy is retried.'),
+    cfg.FloatOpt('bulk_retry_backoff', default=1.0,
+                 help='Seconds to wait before the first retry of a bulk '
+                      'action. The wait doubles with each retry.'),
+    cfg.StrOpt('bulk_dead_letter_file',
+               help='File to which bulk actions that fail (after any '
+                    'retries) are appended, rather than aborting indexing. '
+                    'The file may later be sent to the elasticsearch _bulk '
+                    'API to replay them.'),
+    cfg.IntOpt('read_ahead_pages', default=1,
+               help='Number of pages of resources requested from a service '
+                    'ahead of the page being indexed during initial '
+                    'indexing. 0 requests each page once the previous one '
+                    'has been indexed.'),
+    cfg.IntOpt('bulk_max_in_flight', default=4,
+               help='Maximum number of bulk requests in progress at the '
+                    'same time across all plugins in a process.'),
+    cfg.StrOpt('sync_state_file',
+               help='File in which searchlight-manage records when each '
+                    'resource type was last synced, for --since last and '
+                    '--resume. Defaults to searchlight_sync_state.json in '
+                    'the [oslo_concurrency] lock_path.'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(indexer_opts, group='resource_plugin')
 
 
+def _get_rss():
+    """Return the process's current resident set size in bytes, or None
+    where /proc isn't available.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
 @six.add_metaclass(abc.ABCMeta)
 class IndexBase(plugin.Plugin):
-    chunk_size = 200
-
     def __init__(self):
         self.options = cfg.CONF[self.get_config_group_name()]
 
@@ -52,8 +108,17 @@ class IndexBase(plugin.Plugin):
 
         self.name = "%s-%s" % (self.index_name, self.document_type)
 
-    def initial_indexing(self, clear=True):
-        """Comprehensively install search engine index and put data into it."""
+    def initial_indexing(self, clear=True, since=None):
+        """Comprehensively install search engine index and put data into it.
+        If since is given, only objects changed after it are indexed.
+        """
+        self.prepare_indexing(clear=clear)
+        self.setup_data(since=since)
+
+    def prepare_indexing(self, clear=True):
+        """Create the index and mapping ahead of setup_data. Plugins that
+        share an index must not be prepared concurrently.
+        """
         self.check_mapping_sort_fields()
 
         if clear:
@@ -62,7 +127,6 @@ class IndexBase(plugin.Plugin):
 
         self.setup_index()
         self.setup_mapping()
-        self.setup_data()
 
     def clear_data(self):
         type_exists = (self.engine.indices.exists(self.index_name) and
@@ -73,10 +137,15 @@ class IndexBase(plugin.Plugin):
                                                self.document_type)
 
     def setup_index(self):
-        """Create the index if it doesn't exist and update its settings."""
+        """Create the index if it doesn't exist and update its settings.
+        New indices are created with a versioned name behind an alias so
+        that they can later be rebuilt without downtime.
+        """
         index_exists = self.engine.indices.exists(self.index_name)
         if not index_exists:
-            self.engine.indices.create(index=self.index_name)
+            index_name = utils.create_versioned_index(self.engine,
+                                                      self.index_name)
+            utils.switch_alias(self.engine, self.index_name, index_name)
 
         index_settings = self.get_settings()
         if index_settings:
@@ -85,8 +154,10 @@ class IndexBase(plugin.Plugin):
 
         return index_exists
 
-    def setup_mapping(self):
-        """Update index document mapping."""
+    def setup_mapping(self, index_name=None):
+        """Update index document mapping. By default the mapping is put
+        into the plugin's index.
+        """
         index_mapping = self.get_mapping()
         dynamic_templates = index_mapping.setdefault("dynamic_templates", [])
         for unsearchable_field in self.unsearchable_fields:
@@ -99,42 +170,188 @@ class IndexBase(plugin.Plugin):
                     }
                 }
             })
+        index_mapping.setdefault('properties', {})[CONTENT_HASH_FIELD] = {
+            'type': 'string',
+            'index': 'no',
+            'store': True,
+            'include_in_all': False
+        }
 
         if index_mapping:
-            self.engine.indices.put_mapping(index=self.index_name,
-                                            doc_type=self.document_type,
-                                            body=index_mapping)
-
-    def setup_data(self):
-        """Insert all objects from database into search engine."""
-        object_list = self.get_objects()
-        documents = []
-        for obj in object_list:
-            document = self.serialize(obj)
-            documents.append(document)
-
-        self.save_documents(documents)
-
-    def save_documents(self, documents):
-        """Send list of serialized documents into search engine."""
-        actions = []
+            self.engine.indices.put_mapping(
+                index=index_name or self.index_name,
+                doc_type=self.document_type,
+                body=index_mapping)
+
+    def setup_data(self, index_name=None, since=None, marker=None,
+                   checkpoint=None):
+        """Insert all objects from database into search engine, or only
+        those that have changed since a given time.
+
+        Objects are serialized and sent to the search engine as they are
+        retrieved so that at most one bulk chunk of documents is held in
+        memory at any time.
+
+        If the plugin supports resuming (see get_resume_marker), checkpoint
+        is called with a marker each time a chunk has been indexed, and a
+        marker given here continues listing objects from that point.
+        """
+        start = time.time()
+        start_rss = _get_rss()
+        documents = self.serialize_objects(
+            self.get_objects(since=since, marker=marker))
+        count = self.save_documents(documents, index_name=index_name,
+                                    checkpoint=checkpoint)
+        self._log_indexing_stats(count, time.time() - start, start_rss)
+
+    def reconcile_data(self):
+        """Bring the index into line with the source service while writing
+        as little as possible. Documents whose content hash matches the one
+        stored in the index are skipped, and documents for objects that no
+        longer exist are deleted.
+
+        The ids and hashes of all indexed documents are held in memory while
+        objects are listed. Returns the number of documents written and
+        deleted.
+        """
+        start = time.time()
+        indexed = self._get_indexed_hashes()
+        total = len(indexed)
+
+        def changed_documents():
+            for document in self.serialize_objects(self.get_objects()):
+                content_hash, parent = indexed.pop(
+                    document.get(self.document_id_field), (None, None))
+                if content_hash != utils.get_content_hash(document):
+                    yield document
+
+        written = self.save_documents(changed_documents())
+
+        # Anything left wasn't listed by the service
+        deletes = []
+        for doc_id, (content_hash, parent) in six.iteritems(indexed):
+            action = {'_op_type': 'delete', '_id': doc_id}
+            if parent:
+                action['_parent'] = parent
+            deletes.append(action)
+        deleted = self._get_bulk_writer().write(deletes)
+
+        LOG.info(_LI("Reconciled %(total)d indexed %(type)s documents in "
+                     "%(elapsed).2fs: %(written)d written, %(deleted)d "
+                     "deleted") %
+                 {'total': total, 'type': self.document_type,
+                  'elapsed': time.time() - start, 'written': written,
+                  'deleted': deleted})
+        return written, deleted
+
+    def _get_indexed_hashes(self):
+        """Return a dict of {id: (content_hash, parent)} for every document
+        of this type in the index, without retrieving their sources.
+        """
+        hits = helpers.scan(client=self.engine,
+                            index=self.index_name,
+                            doc_type=self.document_type,
+                            query={'query': {'match_all': {}},
+                                   '_source': False,
+                                   'fields': [CONTENT_HASH_FIELD, '_parent']})
+        indexed = {}
+        for hit in hits:
+            fields = hit.get('fields', {})
+            content_hash = fields.get(CONTENT_HASH_FIELD)
+            # Stored fields are returned as lists
+            if isinstance(content_hash, list):
+                content_hash = content_hash[0]
+            indexed[hit['_id']] = (content_hash, fields.get('_parent'))
+        return indexed
+
+    def _get_bulk_writer(self, index_name=None):
+        return bulk.BulkWriter(
+            self.engine,
+            index_name or self.index_name,
+            self.document_type,
+            workers=self.get_option('bulk_workers'),
+            chunk_size=self.get_option('bulk_chunk_size'),
+            max_chunk_bytes=self.get_option('bulk_max_chunk_bytes'),
+            max_retries=self.get_option('bulk_max_retries'),
+            retry_backoff=self.get_option('bulk_retry_backoff'),
+            dead_letter_file=self.get_option('bulk_dead_letter_file'))
+
+    def save_documents(self, documents, index_name=None, checkpoint=None):
+        """Send an iterable of serialized documents into search engine.
+        Returns the number of documents indexed.
+        """
+        writer = self._get_bulk_writer(index_name)
+
+        if not checkpoint:
+            return writer.write(self._get_index_actions(documents))
+
+        # Markers for documents that have been read but not yet indexed
+        markers = collections.deque()
+
+        def track_markers(documents):
+            for document in documents:
+                markers.append(self.get_resume_marker(document))
+                yield document
+
+        def on_chunk(count):
+            for i in range(count - 1):
+                markers.popleft()
+            marker = markers.popleft()
+            if marker is not None:
+                checkpoint(marker)
+
+        return writer.write(self._get_index_actions(track_markers(documents)),
+                            on_chunk=on_chunk)
+
+    def _get_index_actions(self, documents):
+        """Generator turning serialized documents into bulk index actions,
+        or delete actions for documents describing deleted resources.
+        """
+        parent_field = self.get_parent_id_field()
         for document in documents:
-            parent_field = self.get_parent_id_field()
             action = {
                 '_id': document.get(self.document_id_field),
-                '_source': document,
             }
+            if self.is_deleted(document):
+                action['_op_type'] = 'delete'
+            else:
+                action['_source'] = dict(
+                    document,
+                    **{CONTENT_HASH_FIELD: utils.get_content_hash(document)})
             if parent_field:
                 action['_parent'] = document[parent_field]
-
-            actions.append(action)
-
-        helpers.bulk(
-            client=self.engine,
-            index=self.index_name,
-            doc_type=self.document_type,
-            chunk_size=self.chunk_size,
-            actions=actions)
+            version = self.get_document_version(document)
+            if version is not None:
+                action['_version'] = version
+                action['_version_type'] = bulk.VERSION_TYPE
+
+            yield action
+
+    def _log_indexing_stats(self, count, elapsed, start_rss=None):
+        """Log the indexing rate and memory use. The process's peak RSS
+        covers everything it has done so far, so the change in RSS while
+        indexing is logged as well; when resource types are indexed in
+        parallel that includes the others being indexed at the same time.
+        """
+        stats = {'count': count,
+                 'type': self.document_type,
+                 'elapsed': elapsed,
+                 'rate': count / elapsed if elapsed else 0.0,
+                 # ru_maxrss is reported in kilobytes on Linux
+                 'peak_rss': resource.getrusage(
+                     resource.RUSAGE_SELF).ru_maxrss / 1024.0}
+        rss = _get_rss()
+        if rss is None or start_rss is None:
+            LOG.info(_LI("Indexed %(count)d %(type)s documents in "
+                         "%(elapsed).2fs (%(rate).1f docs/s, process peak "
+                         "RSS %(peak_rss).1f MiB)") % stats)
+            return
+        stats.update(rss=rss / 1048576.0,
+                     rss_change=(rss - start_rss) / 1048576.0)
+        LOG.info(_LI("Indexed %(count)d %(type)s documents in %(elapsed).2fs "
+                     "(%(rate).1f docs/s, RSS %(rss).1f MiB, "
+                     "%(rss_change)+.1f MiB while indexing, process peak "
+                     "RSS %(peak_rss).1f MiB)") % stats)
 
     def get_facets(self, request_context, all_projects=False, limit_terms=0):
         """Get facets available for searching, in the form of a list of
@@ -289,13 +506,47 @@ class IndexBase(plugin.Plugin):
                     raise Exception(message)
 
     @abc.abstractmethod
-    def get_objects(self):
-        """Get list of all objects which will be indexed into search engine."""
+    def get_objects(self, since=None, marker=None):
+        """Get list of all objects which will be indexed into search engine.
+        If since (a naive UTC datetime) is given, objects that haven't
+        changed after it may be left out. marker is a value returned by
+        get_resume_marker, from which listing should continue.
+        """
 
     @abc.abstractmethod
     def serialize(self, obj):
         """Serialize database object into valid search engine document."""
 
+    def serialize_objects(self, objects):
+        """Generator serializing an iterable of objects for indexing.
+        Plugins may override this to retrieve related data for several
+        objects at once.
+        """
+        for obj in objects:
+            yield self.serialize(obj)
+
+    def is_deleted(self, document):
+        """Whether a serialized document describes a deleted resource that
+        should be removed from the index. Only services that list deleted
+        resources (for instance when asked for changes) will return them.
+        """
+        return False
+
+    def get_resume_marker(self, document):
+        """Return the marker from which get_objects can continue listing
+        once document and all of those before it have been indexed, or None
+        if this plugin can't resume an interrupted sync.
+        """
+        return None
+
+    def get_document_version(self, document):
+        """Return the external version to index document with, or None to
+        index it without one. Writes with an older version than the indexed
+        document's are ignored, so that stale data can't overwrite newer
+        data; by default the version comes from updated_at.
+        """
+        return utils.get_version(document)
+
     def get_document_id_field(self):
         """Whatever document field should be treated as the id. This field
         should also be mapped to _id in the elasticsearch mapping
@@ -310,10 +561,16 @@ class IndexBase(plugin.Plugin):
         return None
 
     def get_index_name(self):
-        if self.options.index_name is not None:
-            return self.options.index_name
-        else:
-            return cfg.CONF.resource_plugin.index_name
+        return self.get_option('index_name')
+
+    def get_option(self, name):
+        """Return an inheritable option, falling back to the value in
+        [resource_plugin] when it isn't set for this plugin.
+        """
+        value = getattr(self.options, name)
+        if value is not None:
+            return value
+        return getattr(cfg.CONF.resource_plugin, name)
 
     @property
     def enabled(self):
@@ -354,6 +611,7 @@ class IndexBase(plugin.Plugin):
 
     def filter_result(self, hit, request_context):
         """Filter each outgoing search result; document in hit['_source']"""
+        hit.get('_source', {}).pop(CONTENT_HASH_FIELD, None)
         if self.admin_only_fields and not request_context.is_admin:
             admin_only_fields = self.admin_only_fields
             source = hit['_source']
@@ -383,6 +641,13 @@ class IndexBase(plugin.Plugin):
         """Get the list of suppported event types."""
         return []
 
+    def flush_deferred_updates(self):
+        """Apply any updates that notification handlers have deferred.
+        Called when the listener stops, since the notifications they came
+        from have already been acknowledged.
+        """
+        pass
+
     @classmethod
     def get_topic_exchanges(cls):
         return []
@@ -421,7 +686,18 @@ class IndexBase(plugin.Plugin):
         opts = [
             cfg.StrOpt("index_name"),
             cfg.BoolOpt("enabled", default=True),
-            cfg.StrOpt("unsearchable_fields")
+            cfg.StrOpt("unsearchable_fields"),
+            cfg.IntOpt("bulk_workers"),
+            cfg.IntOpt("bulk_chunk_size"),
+            cfg.IntOpt("bulk_max_chunk_bytes"),
+            cfg.IntOpt("bulk_max_retries"),
+            cfg.FloatOpt("bulk_retry_backoff"),
+            cfg.StrOpt("bulk_dead_letter_file"),
+            cfg.IntOpt("read_ahead_pages"),
+            cfg.BoolOpt("enable_push", default=False,
+                        help="Publish documents updated by the listener to "
+                             "the queue configured in the [publisher] "
+                             "section."),
         ]
         # TODO(sjmc7): Make this more flexible
         topic_exchanges = ["searchlight_indexer,%s" % i for i in
@@ -445,11 +721,58 @@ class IndexBase(plugin.Plugin):
 @six.add_metaclass(abc.ABCMeta)
 class NotificationBase(object):
 
-    def __init__(self, engine, index_name, document_type):
+    def __init__(self, engine, index_name, document_type, push=False):
         self.engine = engine
         self.index_name = index_name
         self.document_type = document_type
+        self.push = push
 
     @abc.abstractmethod
     def process(self, ctxt, publisher_id, event_type, payload, metadata):
         """Process the incoming notification message."""
+
+    def index_document(self, id, document, doc_type=None, **kwargs):
+        """Index a document with its update time as an external version,
+        doing nothing if the index already has a newer version of it.
+        """
+        version = utils.get_version(document)
+        if version is not None:
+            kwargs.update(version=version, version_type=bulk.VERSION_TYPE)
+        try:
+            self.engine.index(
+                index=self.index_name,
+                doc_type=doc_type or self.document_type,
+                body=document,
+                id=id,
+                **kwargs)
+        except es_exceptions.ConflictError:
+            LOG.debug("Not overwriting newer %s %s",
+                      doc_type or self.document_type, id)
+
+    def delete_document(self, id, updated_at=None, **kwargs):
+        """Delete a document, unless updated_at (the time the resource
+        was deleted) is given and the index has a newer version of it.
+        """
+        version = utils.get_version({'updated_at': updated_at})
+        if version is not None:
+            kwargs.update(version=version, version_type=bulk.VERSION_TYPE)
+        try:
+            self.engine.delete(
+                index=self.index_name,
+                doc_type=self.document_type,
+                id=id,
+                **kwargs)
+        except es_exceptions.ConflictError:
+            LOG.debug("Not deleting newer %s %s", self.document_type, id)
+
+    def publish(self, document):
+        """Publish an updated document if the plugin has enable_push set."""
+        if self.push:
+            utils.send_notification(document)
+
+    def get_resource_id(self, payload):
+        """Return the id of the resource a notification is about.
+        Notifications with the same resource id are processed in the order
+        they were received.
+        """
+        return payload.get('id')
@@ -12,18 +12,25 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import operator
+
 from searchlight.elasticsearch.plugins import base
+from searchlight.elasticsearch.plugins import utils
 
 
 def _walk_pages(list_func, *args, **kwargs):
-    while True:
-        items = list_func(*args, **kwargs)
-        if not items:
-            break
-        kwargs["marker"] = items[-1]["id"]
-
-        for item in items:
-            yield item
+    """Generator over every item from a designate list function, which is
+    called with args and kwargs. Pages are fetched ahead of the one being
+    consumed (see utils.prefetch_pages) up to read_ahead_pages deep.
+    """
+    depth = kwargs.pop('read_ahead_pages', 1)
+    marker = kwargs.pop('marker', None)
+
+    def list_page(marker):
+        return list_func(*args, marker=marker, **kwargs)
+
+    return utils.prefetch_pages(list_page, operator.itemgetter('id'),
+                                marker=marker, depth=depth)
 
 
 def _get_recordsets(zone_id, per_page=50):
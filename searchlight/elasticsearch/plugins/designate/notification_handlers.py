@@ -68,12 +68,10 @@ class DomainHandler(base.NotificationBase):
                     # TODO(ekarlso,sjmc7): doc_type below should come from
                     # the recordset plugin
                     # registers options
-                    self.engine.index(
-                        index=self.index_name,
+                    self.index_document(
+                        rs["id"], rs,
                         doc_type=RecordSetHandler.DOCUMENT_TYPE,
-                        body=rs,
-                        parent=rs["zone_id"],
-                        id=rs["id"])
+                        parent=rs["zone_id"])
             return oslo_messaging.NotificationResult.HANDLED
         except Exception as e:
             LOG.exception(e)
@@ -81,12 +79,7 @@ class DomainHandler(base.NotificationBase):
     def create_or_update(self, payload):
         payload = self._serialize(payload)
 
-        self.engine.index(
-            index=self.index_name,
-            doc_type=self.document_type,
-            body=payload,
-            id=payload["id"]
-        )
+        self.index_document(payload["id"], payload)
 
     def delete(self, payload):
         zone_id = payload['id']
@@ -123,11 +116,7 @@ class DomainHandler(base.NotificationBase):
                 actions=actions)
 
         try:
-            self.engine.delete(
-                index=self.index_name,
-                doc_type=self.document_type,
-                id=zone_id
-            )
+            self.delete_document(zone_id, updated_at=payload.get('updated_at'))
         except exceptions.NotFoundError:
             msg = "Zone %s not found when deleting"
             LOG.error(msg, zone_id)
@@ -154,17 +143,16 @@ class RecordSetHandler(base.NotificationBase):
         except Exception as e:
             LOG.exception(e)
 
+    def get_resource_id(self, payload):
+        # Keep recordset changes in order with those to their zone (deleting
+        # a zone deletes its recordsets)
+        return payload.get('domain_id')
+
     def create_or_update(self, payload):
         id_ = payload['id']
         payload = self._serialize(payload)
 
-        self.engine.index(
-            index=self.index_name,
-            doc_type=self.document_type,
-            body=payload,
-            parent=payload["zone_id"],
-            id=id_
-        )
+        self.index_document(id_, payload, parent=payload["zone_id"])
 
     def _serialize(self, obj):
         obj['project_id'] = obj.pop('tenant_id')
@@ -177,11 +165,7 @@ class RecordSetHandler(base.NotificationBase):
     def delete(self, payload):
         id_ = payload['id']
         try:
-            self.engine.delete(
-                index=self.index_name,
-                doc_type=self.document_type,
-                id=id_
-            )
+            self.delete_document(id_, updated_at=payload.get('updated_at'))
         except exceptions.NotFoundError:
             msg = "RecordSet %s not found when deleting"
             LOG.error(msg, id_)
@@ -12,8 +12,13 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import eventlet
+import itertools
+from oslo_config import cfg
+
 from searchlight.elasticsearch.plugins import designate
 from searchlight.elasticsearch.plugins.designate import notification_handlers
+from searchlight.elasticsearch.plugins import utils
 
 
 class RecordSetIndex(designate.DesignateBase):
@@ -74,22 +79,51 @@ class RecordSetIndex(designate.DesignateBase):
             {"term": {"project_id": request_context.owner}}
         ]
 
-    def get_objects(self):
+    def get_objects(self, since=None, marker=None):
         from searchlight.elasticsearch.plugins import openstack_clients
         client = openstack_clients.get_designateclient()
 
         zones = designate._walk_pages(
-            client.zones.list, {"all_tenants": str(True)}, limit=50)
+            client.zones.list, {"all_tenants": str(True)}, limit=50,
+            marker=marker,
+            read_ahead_pages=self.get_option('read_ahead_pages'))
+        if marker:
+            # marker is the zone that was being indexed when the sync
+            # stopped; start again from its first recordset
+            zones = itertools.chain([client.zones.get(marker)], zones)
+
+        # Any change to a zone's recordsets also updates the zone (its
+        # serial is incremented), so unchanged zones can be skipped
+        if since:
+            zones = (zone for zone in zones
+                     if utils.is_updated_since(zone, since))
+
+        def get_zone_recordsets(zone):
+            return zone, list(designate._get_recordsets(zone['id']))
 
-        for zone in zones:
-            recordsets = designate._get_recordsets(zone['id'])
+        # Recordsets for several zones are listed at once; imap hands them
+        # back in zone order, which resuming relies on
+        pool = eventlet.GreenPool(self.options.zone_workers)
+        for zone, recordsets in pool.imap(get_zone_recordsets, zones):
             for rs in recordsets:
                 rs['project_id'] = zone['project_id']
                 yield rs
 
+    @classmethod
+    def get_plugin_opts(cls):
+        opts = super(RecordSetIndex, cls).get_plugin_opts()
+        opts.append(cfg.IntOpt(
+            'zone_workers', default=4,
+            help='Number of zones whose recordsets are listed concurrently '
+                 'during initial indexing.'))
+        return opts
+
     def get_parent_id_field(self):
         return 'zone_id'
 
+    def get_resume_marker(self, document):
+        return document['zone_id']
+
     def serialize(self, obj):
         obj["_parent"] = obj["zone_id"]
         return designate._serialize_recordset(obj)
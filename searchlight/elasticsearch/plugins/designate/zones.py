@@ -14,6 +14,7 @@
 
 from searchlight.elasticsearch.plugins import designate
 from searchlight.elasticsearch.plugins.designate import notification_handlers
+from searchlight.elasticsearch.plugins import utils
 
 
 class ZoneIndex(designate.DesignateBase):
@@ -73,15 +74,21 @@ class ZoneIndex(designate.DesignateBase):
             {"term": {"project_id": request_context.owner}}
         ]
 
-    def get_objects(self):
+    def get_objects(self, since=None, marker=None):
         from searchlight.elasticsearch.plugins import openstack_clients
         client = openstack_clients.get_designateclient()
 
         iterator = designate._walk_pages(
             client.zones.list,
-            {"all_tenants": str(True)}, limit=50)
+            {"all_tenants": str(True)}, limit=50, marker=marker,
+            read_ahead_pages=self.get_option('read_ahead_pages'))
         for zone in iterator:
-            yield zone
+            # Designate can't filter zones by time
+            if not since or utils.is_updated_since(zone, since):
+                yield zone
+
+    def get_resume_marker(self, document):
+        return document['id']
 
     def serialize(self, obj):
         obj.pop("links", None)
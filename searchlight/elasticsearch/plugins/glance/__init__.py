@@ -55,14 +55,17 @@ def _normalize_visibility(image_doc):
 
 # Remove this once we can rely on glanceclient 1.0 being present
 @openstack_clients.clear_cached_glanceclient_on_unauthorized
-def serialize_glance_image(image):
-
+def serialize_glance_image(image, members=None):
+    """Serialize an image, or the id of one. Image members are retrieved
+    from glance unless they're given.
+    """
     # If we're being asked to index an ID, retrieve the full image information
     if isinstance(image, six.text_type):
         g_client = openstack_clients.get_glanceclient()
         image = g_client.images.get(image)
 
-    members = _get_image_members(image)
+    if members is None:
+        members = _get_image_members(image)
 
     fields_to_ignore = ['schema', 'file', 'locations']
 
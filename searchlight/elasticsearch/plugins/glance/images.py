@@ -13,12 +13,18 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import eventlet
+import itertools
+from oslo_config import cfg
+
 from searchlight.api import policy
 from searchlight.common import property_utils
 from searchlight.elasticsearch.plugins import base
+from searchlight.elasticsearch.plugins import glance
 from searchlight.elasticsearch.plugins.glance \
     import images_notification_handler
 from searchlight.elasticsearch.plugins.glance import serialize_glance_image
+from searchlight.elasticsearch.plugins import utils
 
 
 class ImageIndex(base.IndexBase):
@@ -107,14 +113,51 @@ class ImageIndex(base.IndexBase):
                             key, 'read', request_context):
                         del source[key]
 
-    def get_objects(self):
+    def get_objects(self, since=None, marker=None):
         from searchlight.elasticsearch.plugins import openstack_clients
         # Images include their properties and tags. Members are different
-        return openstack_clients.get_glanceclient().images.list()
+        images = openstack_clients.get_glanceclient().images
+        kwargs = {'filters': {'marker': marker}} if marker else {}
+        if not since:
+            return images.list(**kwargs)
+
+        # List most recently updated first and stop at the first image
+        # that hasn't changed
+        return itertools.takewhile(
+            lambda image: utils.is_updated_since(image, since),
+            images.list(sort_key='updated_at', sort_dir='desc', **kwargs))
 
     def serialize(self, obj):
         return serialize_glance_image(obj)
 
+    def serialize_objects(self, objects):
+        """Image members need a request per image; rather than make them one
+        at a time, retrieve them for several images concurrently.
+        """
+        from searchlight.elasticsearch.plugins import openstack_clients
+
+        @openstack_clients.clear_cached_glanceclient_on_unauthorized
+        def get_members(image):
+            return image, glance._get_image_members(image)
+
+        # imap keeps the images in order, and only takes more from objects
+        # as requests complete
+        pool = eventlet.GreenPool(self.options.member_workers)
+        for image, members in pool.imap(get_members, objects):
+            yield serialize_glance_image(image, members=members)
+
+    def get_resume_marker(self, document):
+        return document['id']
+
+    @classmethod
+    def get_plugin_opts(cls):
+        opts = super(ImageIndex, cls).get_plugin_opts()
+        opts.append(cfg.IntOpt(
+            'member_workers', default=10,
+            help='Number of requests for image members made concurrently '
+                 'during initial indexing.'))
+        return opts
+
     @classmethod
     def get_notification_exchanges(cls):
         return ['glance']
@@ -123,7 +166,8 @@ class ImageIndex(base.IndexBase):
         return images_notification_handler.ImageHandler(
             self.engine,
             self.get_index_name(),
-            self.get_document_type()
+            self.get_document_type(),
+            push=self.options.enable_push
         )
 
     def get_notification_supported_events(self):
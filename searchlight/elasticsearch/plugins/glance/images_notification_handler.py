@@ -23,7 +23,6 @@ from searchlight.elasticsearch.plugins.glance \
 from searchlight.elasticsearch.plugins.glance \
     import serialize_glance_notification
 
-from searchlight.elasticsearch.plugins.utils import send_notification
 LOG = logging.getLogger(__name__)
 
 
@@ -49,28 +48,25 @@ class ImageHandler(base.NotificationBase):
         except Exception as e:
             LOG.error(encodeutils.exception_to_unicode(e))
 
+    def get_resource_id(self, payload):
+        # Member notifications identify the image by image_id
+        return payload.get('image_id', payload.get('id'))
+
     def serialize_notification(self, notification):
         return serialize_glance_notification(notification)
 
     def create_or_update(self, payload):
         id = payload['id']
         payload = self.serialize_notification(payload)
-        self.engine.index(
-            index=self.index_name,
-            doc_type=self.document_type,
-            body=payload,
-            id=id
-        )
-	send_notification(payload)
+        self.index_document(id, payload)
+        self.publish(payload)
 
     def delete(self, payload):
         id = payload['id']
-        self.engine.delete(
-            index=self.index_name,
-            doc_type=self.document_type,
-            id=id
-        )
-	send_notification(payload)
+        self.delete_document(
+            id, updated_at=payload.get('deleted_at') or
+            payload.get('updated_at'))
+        self.publish(payload)
 
     def sync_members(self, payload):
         image_id = payload['image_id']
@@ -80,9 +76,4 @@ class ImageHandler(base.NotificationBase):
             id=image_id
         )
         payload = serialize_glance_image_members(image_es['_source'], payload)
-        self.engine.index(
-            index=self.index_name,
-            doc_type=self.document_type,
-            body=payload,
-            id=image_id
-        )
+        self.index_document(image_id, payload)
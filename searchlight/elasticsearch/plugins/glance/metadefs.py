@@ -18,6 +18,7 @@ from searchlight.elasticsearch.plugins.glance \
     import metadefs_notification_handler
 from searchlight.elasticsearch.plugins.glance \
     import serialize_glance_metadef_ns
+from searchlight.elasticsearch.plugins import utils
 
 
 class MetadefIndex(base.IndexBase):
@@ -31,6 +32,11 @@ class MetadefIndex(base.IndexBase):
     def get_document_id_field(self):
         return 'namespace'
 
+    def get_document_version(self, document):
+        # The listener updates objects, properties and tags within a
+        # namespace's document without changing its updated_at
+        return None
+
     def get_mapping(self):
         property_mapping = {
             'dynamic': True,
@@ -109,10 +115,16 @@ class MetadefIndex(base.IndexBase):
             }
         ]
 
-    def get_objects(self):
+    def get_objects(self, since=None, marker=None):
         from searchlight.elasticsearch.plugins import openstack_clients
         gc = openstack_clients.get_glanceclient()
-        return list(gc.metadefs_namespace.list())
+        namespaces = gc.metadefs_namespace.list()
+        if since:
+            # Namespaces can't be filtered by glance, but skipping unchanged
+            # ones avoids retrieving their full definitions
+            return [ns for ns in namespaces
+                    if utils.is_updated_since(ns, since)]
+        return list(namespaces)
 
     def serialize(self, metadef_obj):
         return serialize_glance_metadef_ns(metadef_obj)
@@ -59,6 +59,9 @@ class MetadefHandler(base.NotificationBase):
         except Exception as e:
             LOG.error(encodeutils.exception_to_unicode(e))
 
+    def get_resource_id(self, payload):
+        return payload.get('namespace')
+
     def run_create(self, id, payload):
         self.engine.create(
             index=self.index_name,
@@ -15,6 +15,7 @@
 
 import copy
 import logging
+from oslo_utils import timeutils
 import six
 
 from searchlight.elasticsearch.plugins import openstack_clients
@@ -29,6 +30,44 @@ _LW = i18n._LW
 # All 'links' will also be removed
 BLACKLISTED_FIELDS = set((u'progress', u'links'))
 
+# Server status reported by the nova API for each vm state, and any task
+# states that change it (see nova.api.openstack.common)
+_REBOOT = {u'rebooting': u'REBOOT', u'reboot_pending': u'REBOOT',
+           u'reboot_started': u'REBOOT', u'rebooting_hard': u'HARD_REBOOT',
+           u'reboot_pending_hard': u'HARD_REBOOT',
+           u'reboot_started_hard': u'HARD_REBOOT'}
+_REBUILD = {u'rebuilding': u'REBUILD',
+            u'rebuild_block_device_mapping': u'REBUILD',
+            u'rebuild_spawning': u'REBUILD'}
+_RESIZE = {u'resize_prep': u'RESIZE', u'resize_migrating': u'RESIZE',
+           u'resize_migrated': u'RESIZE', u'resize_finish': u'RESIZE'}
+
+
+def _statuses(default, *task_statuses):
+    statuses = {u'default': default}
+    for task_status in task_statuses:
+        statuses.update(task_status)
+    return statuses
+
+
+_STATE_MAP = {
+    u'active': _statuses(u'ACTIVE', _REBOOT, _REBUILD, _RESIZE,
+                         {u'migrating': u'MIGRATING',
+                          u'updating_password': u'PASSWORD'}),
+    u'building': _statuses(u'BUILD'),
+    u'stopped': _statuses(u'SHUTOFF', _REBUILD, _RESIZE),
+    u'resized': _statuses(u'VERIFY_RESIZE',
+                          {u'resize_reverting': u'REVERT_RESIZE'}),
+    u'paused': _statuses(u'PAUSED', {u'migrating': u'MIGRATING'}),
+    u'suspended': _statuses(u'SUSPENDED'),
+    u'rescued': _statuses(u'RESCUE'),
+    u'error': _statuses(u'ERROR', _REBUILD),
+    u'deleted': _statuses(u'DELETED'),
+    u'soft-delete': _statuses(u'SOFT_DELETED'),
+    u'shelved': _statuses(u'SHELVED'),
+    u'shelved_offloaded': _statuses(u'SHELVED_OFFLOADED'),
+}
+
 
 def serialize_nova_server(server):
     nc_client = openstack_clients.get_novaclient()
@@ -46,24 +85,93 @@ def serialize_nova_server(server):
     serialized[u'image'].pop(u'links', None)
     serialized[u'flavor'].pop(u'links', None)
 
-    _format_networks(server, serialized)
+    _format_networks(server.addresses, serialized)
 
     utils.normalize_date_fields(serialized)
 
     return serialized
 
 
-def _format_networks(server, serialized):
+def serialize_server_notification(payload, updated=None):
+    """Build as much of a server's document as possible from a
+    compute.instance.* notification payload. Fields only available from the
+    API (security groups, key name, volumes and so on) are left out, as is
+    the update time unless given.
+    """
+    task_state = payload.get(u'state_description') or None
+    state_map = _STATE_MAP.get(payload[u'state'], {})
+    serialized = {
+        u'id': payload[u'instance_id'],
+        u'name': payload[u'display_name'],
+        u'tenant_id': payload[u'tenant_id'],
+        u'owner': payload[u'tenant_id'],
+        u'user_id': payload[u'user_id'],
+        u'status': state_map.get(task_state,
+                                 state_map.get(u'default', u'UNKNOWN')),
+        u'OS-EXT-STS:vm_state': payload[u'state'],
+        u'OS-EXT-STS:task_state': task_state,
+        u'OS-EXT-SRV-ATTR:host': payload.get(u'host'),
+        u'OS-EXT-SRV-ATTR:hypervisor_hostname': payload.get(u'node'),
+        u'OS-EXT-AZ:availability_zone': payload.get(u'availability_zone'),
+        u'OS-SRV-USG:launched_at': _format_time(payload.get(u'launched_at')),
+        u'OS-SRV-USG:terminated_at': _format_time(
+            payload.get(u'terminated_at')),
+        u'accessIPv4': payload.get(u'access_ip_v4') or u'',
+        u'accessIPv6': payload.get(u'access_ip_v6') or u'',
+        u'metadata': payload.get(u'metadata', {}),
+        u'created': _format_time(payload[u'created_at']),
+    }
+    if payload.get(u'instance_flavor_id'):
+        serialized[u'flavor'] = {u'id': payload[u'instance_flavor_id']}
+    if payload.get(u'image_ref_url'):
+        # The URL ends in the image id
+        image_id = payload[u'image_ref_url'].rstrip(u'/').rsplit(u'/', 1)[-1]
+        serialized[u'image'] = {u'id': image_id}
+    if updated:
+        serialized[u'updated'] = _format_time(updated)
+        serialized[u'updated_at'] = serialized[u'updated']
+    if u'fixed_ips' in payload:
+        serialized[u'addresses'] = _get_notification_addresses(
+            payload[u'fixed_ips'])
+        _format_networks(serialized[u'addresses'], serialized)
+
+    serialized[u'created_at'] = serialized[u'created']
+    return serialized
+
+
+def _format_time(value):
+    if not value:
+        return None
+    parsed = timeutils.normalize_time(timeutils.parse_isotime(value))
+    return parsed.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _get_notification_addresses(fixed_ips):
+    """Convert the fixed_ips of a notification to the API's addresses"""
+    addresses = {}
+    for ip in fixed_ips:
+        ports = addresses.setdefault(ip[u'label'], [])
+        for address in [ip] + ip.get(u'floating_ips', []):
+            ports.append({
+                u'addr': address[u'address'],
+                u'version': address.get(u'version', ip[u'version']),
+                u'OS-EXT-IPS:type': address[u'type'],
+                u'OS-EXT-IPS-MAC:mac_addr': ip.get(u'vif_mac')
+            })
+    return addresses
+
+
+def _format_networks(addresses, serialized):
     networks = []
 
     # Keep the original as well
-    addresses = copy.deepcopy(server.addresses)
+    addresses = copy.deepcopy(addresses)
 
     for net_name, ports in six.iteritems(addresses):
         for port in ports:
 
             LOG.debug("Transforming net %s port %s for server %s",
-                      net_name, port, server)
+                      net_name, port, serialized[u'id'])
             addr = {u"name": net_name}
             port_address = port.pop(u'addr')
             if port[u'version'] == 4:
@@ -13,11 +13,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import operator
+
+from oslo_config import cfg
+
 from searchlight.elasticsearch.plugins import base
 from searchlight.elasticsearch.plugins.nova import serialize_nova_server
 from searchlight.elasticsearch.plugins.nova \
     import servers_notification_handler
 from searchlight.elasticsearch.plugins import openstack_clients
+from searchlight.common import utils as common_utils
+from searchlight.elasticsearch.plugins import utils
 
 
 # TODO(sjmc7): Parameterize once we have plugin configs
@@ -30,6 +36,9 @@ class ServerIndex(base.IndexBase):
 
     def __init__(self):
         super(ServerIndex, self).__init__()
+        self._update_coalescer = None
+        self._backfill = None
+        self._fingerprints = None
 
     @classmethod
     def get_document_type(self):
@@ -97,6 +106,11 @@ class ServerIndex(base.IndexBase):
                     }
                 },
                 'status': {'type': 'string', 'index': 'not_analyzed'},
+                servers_notification_handler.FINGERPRINT_FIELD: {
+                    'type': 'string',
+                    'index': 'no',
+                    'include_in_all': False
+                },
             },
         }
 
@@ -129,42 +143,126 @@ class ServerIndex(base.IndexBase):
             {'term': {'tenant_id': request_context.owner}}
         ]
 
-    def get_objects(self):
-        """Generator that lists all nova servers owned by all tenants."""
-        has_more = True
-        marker = None
-        while has_more:
-            servers = openstack_clients.get_novaclient().servers.list(
+    def get_objects(self, since=None, marker=None):
+        """Generator that lists all nova servers owned by all tenants. If
+        since is given, nova returns servers changed (including deleted)
+        after it. Listing starts after the server whose id is marker.
+        """
+        search_opts = {'all_tenants': True}
+        if since:
+            search_opts['changes-since'] = since.isoformat()
+
+        def list_servers(marker):
+            return openstack_clients.get_novaclient().servers.list(
                 limit=LIST_LIMIT,
-                search_opts={'all_tenants': True},
+                search_opts=search_opts,
                 marker=marker
             )
 
-            if not servers:
-                # Definitely no more; break straight away
-                break
-
-            # servers.list always returns a list so we can grab the last id
-            has_more = len(servers) == LIST_LIMIT
-            marker = servers[-1].id
-
-            for server in servers:
-                yield server
+        return utils.prefetch_pages(
+            list_servers, operator.attrgetter('id'), marker=marker,
+            page_size=LIST_LIMIT, depth=self.get_option('read_ahead_pages'))
 
     def serialize(self, server):
         return serialize_nova_server(server)
 
+    def is_deleted(self, document):
+        return document.get('status') == 'DELETED'
+
+    def get_resume_marker(self, document):
+        return document['id']
+
     @classmethod
     def get_notification_exchanges(cls):
         return ['nova', 'neutron']
 
+    def filter_result(self, hit, request_context):
+        super(ServerIndex, self).filter_result(hit, request_context)
+        hit.get('_source', {}).pop(
+            servers_notification_handler.FINGERPRINT_FIELD, None)
+
     def get_notification_handler(self):
         return servers_notification_handler.InstanceHandler(
             self.engine,
             self.get_index_name(),
-            self.get_document_type()
+            self.get_document_type(),
+            coalescer=self._get_update_coalescer(),
+            fingerprints=self._get_fingerprints(),
+            payload_updates=self.options.use_notification_payload,
+            backfill=self._get_backfill(),
+            push=self.options.enable_push
         )
 
+    def _get_fingerprints(self):
+        cache_size = self.options.fingerprint_cache_size
+        if not cache_size:
+            return None
+        if self._fingerprints is None:
+            self._fingerprints = common_utils.LRUCache(cache_size)
+        return self._fingerprints
+
+    def _get_update_coalescer(self):
+        window = self.options.update_coalesce_window
+        if not window:
+            return None
+        if self._update_coalescer is None:
+            self._update_coalescer = self._get_deferred_updater(window)
+        return self._update_coalescer
+
+    def _get_backfill(self):
+        if not self.options.use_notification_payload:
+            return None
+        if self._backfill is None:
+            self._backfill = self._get_deferred_updater(
+                self.options.backfill_delay)
+        return self._backfill
+
+    def flush_deferred_updates(self):
+        for updater in self._update_coalescer, self._backfill:
+            if updater:
+                updater.flush()
+
+    def _get_deferred_updater(self, window):
+        # Deferred updates are applied directly rather than through the
+        # handler that received the notification, whose engine may only be
+        # buffering writes for a batch of notifications
+        handler = servers_notification_handler.InstanceHandler(
+            self.engine,
+            self.get_index_name(),
+            self.get_document_type(),
+            push=self.options.enable_push
+        )
+        return utils.Coalescer(window, handler.update_instance)
+
+    @classmethod
+    def get_plugin_opts(cls):
+        opts = super(ServerIndex, cls).get_plugin_opts()
+        opts.append(cfg.FloatOpt(
+            'update_coalesce_window', default=0,
+            help='Number of seconds to wait after a notification for a '
+                 'server before updating it, so that a burst of '
+                 'notifications results in a single update. 0 updates '
+                 'servers immediately.'))
+        opts.append(cfg.BoolOpt(
+            'use_notification_payload', default=False,
+            help='Update servers from the content of nova notifications '
+                 'rather than retrieving them from the nova API. Servers '
+                 'are still retrieved once after being created, for the '
+                 'fields notifications don\'t include.'))
+        opts.append(cfg.FloatOpt(
+            'backfill_delay', default=5,
+            help='With use_notification_payload, the number of seconds '
+                 'to wait after a server is created before retrieving it '
+                 'from the nova API, so that the fields set while it\'s '
+                 'being built are filled in by a single request.'))
+        opts.append(cfg.IntOpt(
+            'fingerprint_cache_size', default=100000,
+            help='Number of servers for which the listener remembers the '
+                 'state last indexed, so that audit notifications for '
+                 'unchanged servers can be ignored without a request to '
+                 'Elasticsearch. 0 disables the cache.'))
+        return opts
+
     def get_notification_supported_events(self):
         # TODO(sjmc7): DRY
         # Most events are duplicated by instance.update
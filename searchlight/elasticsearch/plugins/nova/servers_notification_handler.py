@@ -13,28 +13,76 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from elasticsearch import exceptions as es_exceptions
 import novaclient.exceptions
 from oslo_log import log as logging
 import oslo_messaging
 from oslo_utils import encodeutils
+from oslo_utils import timeutils
 
 from searchlight.elasticsearch.plugins import base
 from searchlight.elasticsearch.plugins.nova import serialize_nova_server
+from searchlight.elasticsearch.plugins.nova \
+    import serialize_server_notification
+from searchlight.elasticsearch.plugins import utils
 from searchlight import i18n
 
-from searchlight.elasticsearch.plugins.utils import send_notification
-
 LOG = logging.getLogger(__name__)
 _LW = i18n._LW
 _LE = i18n._LE
 
+# Stored with servers updated from a notification. Holds a hash of the
+# notification's description of the server, which is compared with those of
+# later notifications to tell whether anything has changed
+FINGERPRINT_FIELD = 'searchlight_notification_fingerprint'
+
+# Fields of the (common) nova notification payload that make up the
+# fingerprint; between them they change whenever the server does
+FINGERPRINT_PAYLOAD_FIELDS = (
+    'state', 'state_description', 'progress', 'updated_at', 'launched_at',
+    'terminated_at', 'deleted_at', 'display_name', 'host', 'node',
+    'availability_zone', 'instance_flavor_id', 'instance_type_id',
+    'image_ref_url', 'fixed_ips', 'access_ip_v4', 'access_ip_v6', 'metadata'
+)
+
+
+# Compute notifications that describe the whole server
+PAYLOAD_EVENTS = (
+    'compute.instance.update', 'compute.instance.exists',
+    'compute.instance.create.end', 'compute.instance.power_on.end',
+    'compute.instance.power_off.end'
+)
+
+
+def get_fingerprint(payload):
+    return utils.get_content_hash(
+        dict((field, payload.get(field))
+             for field in FINGERPRINT_PAYLOAD_FIELDS))
+
 
 class InstanceHandler(base.NotificationBase):
     """Handles nova server notifications. These can come as a result of
     a user action (like a name change, state change etc) or as a result of
     periodic auditing notifications nova sends
+
+    If a coalescer is given, updates are passed to it rather than being
+    applied straight away so that a burst of notifications for a server
+    results in a single update.
+
+    fingerprints, if given, is an LRUCache of the fingerprint last stored
+    for each server, which saves looking it up in the index when deciding
+    whether an audit notification describes a change.
+
+    If payload_updates is set, servers are updated from compute
+    notifications' payloads rather than being retrieved from nova. Fields
+    that aren't in the payload are filled in for new servers by passing
+    them to backfill, a coalescer that retrieves them from nova later.
     """
     def __init__(self, *args, **kwargs):
+        self.coalescer = kwargs.pop('coalescer', None)
+        self.fingerprints = kwargs.pop('fingerprints', None)
+        self.payload_updates = kwargs.pop('payload_updates', False)
+        self.backfill = kwargs.pop('backfill', None)
         super(InstanceHandler, self).__init__(*args, **kwargs)
 
     def process(self, ctxt, publisher_id, event_type, payload, metadata):
@@ -46,7 +94,7 @@ class InstanceHandler(base.NotificationBase):
                 # compute.instance.update seems to be the event set as a
                 # result of a state change etc
                 'compute.instance.update': self.create_or_update,
-                'compute.instance.exists': self.create_or_update,
+                'compute.instance.exists': self.update_if_changed,
                 'compute.instance.create.end': self.create_or_update,
                 'compute.instance.power_on.end': self.create_or_update,
                 'compute.instance.power_off.end': self.create_or_update,
@@ -60,49 +108,162 @@ class InstanceHandler(base.NotificationBase):
             }
             #import pdb
             #pdb.set_trace()
-            result = actions[event_type](payload)
-            send_notification(result)
+            if self.payload_updates and event_type in PAYLOAD_EVENTS:
+                result = self.update_from_payload(event_type, payload,
+                                                  metadata)
+            else:
+                result = actions[event_type](payload)
+            self.publish(result)
             return oslo_messaging.NotificationResult.HANDLED
         except Exception as e:
             LOG.error(encodeutils.exception_to_unicode(e))
 
+    def get_resource_id(self, payload):
+        if 'port' in payload:
+            return payload['port'].get('device_id')
+        return payload.get('instance_id')
+
     def create_or_update(self, payload):
         instance_id = payload['instance_id']
+        if self.coalescer:
+            LOG.debug("Deferring update of nova server %s", instance_id)
+            # The deferred update may reflect later notifications, so it
+            # can't store this one's fingerprint
+            self._forget_fingerprint(instance_id)
+            self.coalescer.add(instance_id)
+            return
         LOG.debug("Updating nova server information for %s", instance_id)
-        return self._update_instance(instance_id)
-	
+        return self._update_instance(instance_id,
+                                     fingerprint=get_fingerprint(payload))
+
+    def update_if_changed(self, payload):
+        """Nova sends compute.instance.exists for every server once each
+        audit period. Skip retrieving and reindexing servers whose
+        notification fingerprint matches the one stored with them.
+        """
+        if self._is_unchanged(payload):
+            return
+        return self.create_or_update(payload)
+
+    def update_from_payload(self, event_type, payload, metadata):
+        """Apply a compute notification's description of a server to its
+        document, creating it if necessary.
+        """
+        instance_id = payload['instance_id']
+        if (event_type == 'compute.instance.exists' and
+                self._is_unchanged(payload)):
+            return
+
+        LOG.debug("Updating nova server %s from notification", instance_id)
+        fingerprint = get_fingerprint(payload)
+        document = serialize_server_notification(
+            payload, updated=metadata.get('timestamp'))
+        doc = dict(document, **{
+            FINGERPRINT_FIELD: fingerprint,
+            # The hash stored by the last sync no longer matches
+            base.CONTENT_HASH_FIELD: None
+        })
+        if doc.get('updated_at'):
+            # Partial updates can't carry an external version (and an
+            # upsert would recreate a server deleted since this notification
+            # was sent), so the notification is merged into the stored
+            # document and the whole of it indexed with the notification's
+            # update time as its version. A newer document or deletion
+            # rejects it
+            try:
+                stored = self.engine.get(
+                    index=self.index_name,
+                    doc_type=self.document_type,
+                    id=instance_id
+                )['_source']
+            except es_exceptions.NotFoundError:
+                stored = {}
+            self.index_document(instance_id, dict(stored, **doc))
+        else:
+            self.engine.update(
+                index=self.index_name,
+                doc_type=self.document_type,
+                id=instance_id,
+                body={'doc': doc, 'doc_as_upsert': True}
+            )
+        if self.fingerprints is not None:
+            self.fingerprints[instance_id] = fingerprint
+
+        if event_type == 'compute.instance.create.end' and self.backfill:
+            # Security groups, key name, volumes and so on only come from
+            # the API
+            self.backfill.add(instance_id)
+        return document
+
+    def _is_unchanged(self, payload):
+        instance_id = payload['instance_id']
+        stored = self._get_stored_fingerprint(instance_id)
+        if get_fingerprint(payload) == stored:
+            LOG.debug("Nova server %s is unchanged", instance_id)
+            return True
+        return False
+
+    def _get_stored_fingerprint(self, instance_id):
+        if self.fingerprints is not None and instance_id in self.fingerprints:
+            return self.fingerprints.get(instance_id)
+        try:
+            document = self.engine.get(
+                index=self.index_name,
+                doc_type=self.document_type,
+                id=instance_id,
+                _source_include=[FINGERPRINT_FIELD]
+            )
+        except es_exceptions.NotFoundError:
+            return None
+        fingerprint = document.get('_source', {}).get(FINGERPRINT_FIELD)
+        if fingerprint and self.fingerprints is not None:
+            self.fingerprints[instance_id] = fingerprint
+        return fingerprint
+
+    def _forget_fingerprint(self, instance_id):
+        if self.fingerprints is not None:
+            self.fingerprints.pop(instance_id)
+
     def update_from_neutron(self, payload):
         instance_id = payload['port']['device_id']
         LOG.debug("Updating server %s from neutron notification",
                   instance_id)
         if not instance_id:
             return
+        if self.coalescer:
+            self.coalescer.add(instance_id)
+            return
         return self._update_instance(instance_id)
 
-    def _update_instance(self, instance_id):
+    def update_instance(self, instance_id):
+        """Apply an update deferred by the coalescer."""
+        LOG.debug("Updating nova server information for %s", instance_id)
+        self.publish(self._update_instance(instance_id))
+
+    def _update_instance(self, instance_id, fingerprint=None):
+        self._forget_fingerprint(instance_id)
         try:
             payload = serialize_nova_server(instance_id)
         except novaclient.exceptions.NotFound:
             LOG.warning(_LW("Instance %s not found; deleting") % instance_id)
             try:
-                self.engine.delete(
-                    index=self.index_name,
-                    doc_type=self.document_type,
-                    id=instance_id
-                )
+                # Nova doesn't say when it was deleted, but it was before
+                # now; any later notification about it is older
+                self.delete_document(
+                    instance_id, updated_at=timeutils.utcnow().isoformat())
             except Exception as e:
                 LOG.error(_LE(
                     'Error deleting instance %(instance_id)s '
                     'from index: %(exc)s') % (instance_id, e))
             return
 
-        self.engine.index(
-            index=self.index_name,
-            doc_type=self.document_type,
-            body=payload,
-            id=instance_id
-        )
-	return payload
+        body = payload
+        if fingerprint:
+            body = dict(payload, **{FINGERPRINT_FIELD: fingerprint})
+        self.index_document(instance_id, body)
+        if fingerprint and self.fingerprints is not None:
+            self.fingerprints[instance_id] = fingerprint
+        return payload
 
     def delete(self, payload):
         instance_id = payload['instance_id']
@@ -110,8 +271,12 @@ class InstanceHandler(base.NotificationBase):
         if not instance_id:
             return
 
-        self.engine.delete(
-            index=self.index_name,
-            doc_type=self.document_type,
-            id=instance_id
-        )
+        # Any pending update would only find the server gone
+        if self.coalescer:
+            self.coalescer.cancel(instance_id)
+        if self.backfill:
+            self.backfill.cancel(instance_id)
+        self._forget_fingerprint(instance_id)
+
+        self.delete_document(instance_id,
+                             updated_at=payload.get('deleted_at'))
@@ -20,6 +20,7 @@ from glanceclient.v2 import client as glance
 from keystoneclient import auth as ks_auth
 from keystoneclient import session as ks_session
 import novaclient.client
+from oslo_concurrency import lockutils
 from oslo_config import cfg
 
 
@@ -44,55 +45,100 @@ ks_auth.register_conf_options(cfg.CONF, GROUP)
 
 _session = None
 
+# One client per service, shared by every caller (including green threads)
+# so that connections to each service are kept alive and reused
+_clients = {}
+
+_LOCK_NAME = 'openstack-clients'
+
 
 def _get_session():
+    if not _session:
+        _create_session()
+    return _session
+
+
+@lockutils.synchronized(_LOCK_NAME)
+def _create_session():
     global _session
     if not _session:
         auth = ks_auth.load_from_conf_options(cfg.CONF, GROUP)
 
-        _session = ks_session.Session.load_from_conf_options(
+        session = ks_session.Session.load_from_conf_options(
             cfg.CONF, GROUP)
-        _session.auth = auth
-    return _session
+        session.auth = auth
+        _session = session
 
 
-# Glance still needs special handling because versions prior to 1.0 don't
-# support keystone sessions. Rather than maintain two codepaths, we'll do this
-_glanceclient = None
+def _get_client(name, create_client):
+    """Return the cached client for a service, creating it by calling
+    create_client(session) if there isn't one.
+    """
+    client = _clients.get(name)
+    if client is None:
+        client = _create_client(name, create_client, _get_session())
+    return client
+
+
+@lockutils.synchronized(_LOCK_NAME)
+def _create_client(name, create_client, session):
+    # Another thread may have created it while this one waited for the lock
+    if name not in _clients:
+        _clients[name] = create_client(session)
+    return _clients[name]
+
+
+def reset():
+    """Discard the session and all clients, for instance after a token has
+    been rejected.
+    """
+    global _session
+    _session = None
+    _clients.clear()
 
 
 def clear_cached_glanceclient_on_unauthorized(fn):
     def wrapper(*args, **kwargs):
-        global _session
-        global _glanceclient
         try:
             return fn(*args, **kwargs)
         except glance_exc.Unauthorized:
-            _session = None
-            _glanceclient = None
+            reset()
             return fn(*args, **kwargs)
     return wrapper
 
 
+# Glance still needs special handling because versions prior to 1.0 don't
+# support keystone sessions. Rather than maintain two codepaths, we'll do this
 def get_glanceclient():
-    global _glanceclient
-    if _glanceclient:
-        return _glanceclient
-
     session = _get_session()
+    # The auth plugin caches its token and gets a new one shortly before it
+    # expires; the client is rebuilt whenever the token changes
+    token = session.auth.get_token(session)
+    client, client_token = _clients.get('glance', (None, None))
+    if client is None or client_token != token:
+        client, client_token = _create_glanceclient(session, token)
+    return client
+
+
+@lockutils.synchronized(_LOCK_NAME)
+def _create_glanceclient(session, token):
+    client, client_token = _clients.get('glance', (None, None))
+    if client is not None and client_token == token:
+        return client, client_token
 
     endpoint = session.get_endpoint(
         service_type='image',
         region_name=cfg.CONF.service_credentials.os_region_name,
         interface=cfg.CONF.service_credentials.os_endpoint_type)
 
-    _glanceclient = glance.Client(
+    client = glance.Client(
         endpoint=endpoint,
-        token=session.auth.get_token(session),
+        token=token,
         cacert=cfg.CONF.service_credentials.cafile,
         insecure=cfg.CONF.service_credentials.insecure
     )
-    return _glanceclient
+    _clients['glance'] = (client, token)
+    return client, token
 
     # Once we use 1.0, use the below code.
     # session = _get_session()
@@ -103,18 +149,18 @@ def get_glanceclient():
 
 
 def get_novaclient():
-    session = _get_session()
-
-    return novaclient.client.Client(
-        version=2,
-        session=session,
-        region_name=cfg.CONF.service_credentials.os_region_name)
+    def create_client(session):
+        return novaclient.client.Client(
+            version=2,
+            session=session,
+            region_name=cfg.CONF.service_credentials.os_region_name)
+    return _get_client('nova', create_client)
 
 
 def get_designateclient():
-    session = _get_session()
-
-    return designateclient.Client(
-        session=session,
-        region_name=cfg.CONF.service_credentials.os_region_name,
-    )
+    def create_client(session):
+        return designateclient.Client(
+            session=session,
+            region_name=cfg.CONF.service_credentials.os_region_name,
+        )
+    return _get_client('designate', create_client)
@@ -13,8 +13,43 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-from six.moves.urllib.request import Request, urlopen
+import calendar
+from elasticsearch import helpers
+import eventlet
+from eventlet import queue
+from eventlet import semaphore
+import hashlib
 import json
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+from oslo_utils import timeutils
+import os
+import six
+import sys
+import tempfile
+
+from searchlight.elasticsearch import bulk
+from searchlight import i18n
+from searchlight import publisher
+
+CONF = cfg.CONF
+CONF.import_opt('lock_path', 'oslo_concurrency.lockutils',
+                group='oslo_concurrency')
+LOG = logging.getLogger(__name__)
+_LE = i18n._LE
+_LW = i18n._LW
+
+# Settings applied to an index while it's being built from scratch. Replicas
+# and periodic refreshes only slow down bulk indexing when nobody can search
+# the index yet; they're put back before the index is made visible.
+BUILD_SETTINGS = {
+    'index': {
+        'number_of_replicas': 0,
+        'refresh_interval': '-1'
+    }
+}
+
 
 def normalize_date_fields(document,
                           created_at='created',
@@ -27,16 +62,273 @@ def normalize_date_fields(document,
     if updated_at and 'updated_at' not in document:
         document[u'updated_at'] = document[updated_at]
 
-def send_notification(message):
-    push_url = 'http://localhost:8888/v2/queues/testqueue/messages'
-    data = {'messages':[
-             {'ttl':1000,
-             'body': message}]}
-    header = {'Client-ID': '133c9b5c-7ed0-11e5-83e0-4335d873a583',
-              'X-Project-Id': 'demo',
-              'Content-Type': 'application/json'
-             }
-    req = Request(push_url, json.dumps(data), header)
-    rep = urlopen(req).read()
-    print rep
 
+class _ListingError(object):
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+def prefetch_pages(list_page, get_marker, marker=None, page_size=None,
+                   depth=1):
+    """Generator over the items of a listing paginated by marker, where
+    list_page(marker) returns a page and get_marker(item) the marker from
+    which the page after item starts. Listing stops at an empty page, or
+    one shorter than page_size if given.
+
+    Up to depth pages are requested in the background ahead of the page
+    whose items are being consumed, so that the caller's processing of one
+    page overlaps with waiting for the next. A depth of 0 disables this.
+    """
+    def walk_pages(marker):
+        while True:
+            page = list_page(marker)
+            if not page:
+                return
+            yield page
+            if page_size and len(page) < page_size:
+                return
+            marker = get_marker(page[-1])
+
+    if not depth:
+        for page in walk_pages(marker):
+            for item in page:
+                yield item
+        return
+
+    end = object()
+    pages = queue.LightQueue()
+    # Taken before requesting a page and given back as the consumer starts
+    # on a page, so that no more than depth pages are ever waiting
+    read_ahead = semaphore.Semaphore(depth)
+
+    def produce():
+        page_iter = walk_pages(marker)
+        page = None
+        while page is not end:
+            read_ahead.acquire()
+            try:
+                page = next(page_iter, end)
+            except Exception:
+                pages.put(_ListingError(sys.exc_info()))
+                return
+            pages.put(page)
+
+    producer = eventlet.spawn(produce)
+    try:
+        while True:
+            page = pages.get()
+            if page is end:
+                return
+            if isinstance(page, _ListingError):
+                six.reraise(*page.exc_info)
+            read_ahead.release()
+            for item in page:
+                yield item
+    finally:
+        # The consumer may stop early; don't leave the producer waiting
+        producer.kill()
+
+
+def get_content_hash(document):
+    """Return a digest of a serialized document that doesn't depend on the
+    order of its keys.
+    """
+    serialized = jsonutils.dumps(document, sort_keys=True)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def get_version(document, field='updated_at'):
+    """Return the external version with which to index a document: its
+    update time in milliseconds since the epoch, or None if it has none.
+    """
+    value = document.get(field)
+    if not value:
+        return None
+    updated = timeutils.normalize_time(timeutils.parse_isotime(value))
+    return (calendar.timegm(updated.timetuple()) * 1000 +
+            updated.microsecond // 1000)
+
+
+def is_updated_since(obj, since, fields=('updated_at', 'created_at')):
+    """For services that can't filter listings by time, check whether an
+    object changed after since (a naive UTC datetime). The first of fields
+    with a value is used; objects without any are assumed to have changed.
+    """
+    for field in fields:
+        value = obj.get(field)
+        if value:
+            changed = timeutils.normalize_time(timeutils.parse_isotime(value))
+            return changed >= since
+    return True
+
+
+class SyncState(object):
+    """Bookkeeping for searchlight-manage, such as when each plugin last
+    completed a sync, kept per document type in a JSON file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.state = {}
+        if os.path.exists(path):
+            with open(path) as state_file:
+                self.state = json.load(state_file)
+
+    def get(self, doc_type, key, default=None):
+        return self.state.get(doc_type, {}).get(key, default)
+
+    def set(self, doc_type, key, value):
+        self.state.setdefault(doc_type, {})[key] = value
+        self._save()
+
+    def _save(self):
+        # Write to a temporary file and rename so that the file is never
+        # left half written
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as state_file:
+            json.dump(self.state, state_file, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+
+def get_sync_state_path():
+    """Return the file given by the sync_state_file option, or one in the
+    lock directory if it isn't set.
+    """
+    if CONF.resource_plugin.sync_state_file:
+        return CONF.resource_plugin.sync_state_file
+    lock_path = CONF.oslo_concurrency.lock_path or tempfile.gettempdir()
+    return os.path.join(lock_path, 'searchlight_sync_state.json')
+
+
+def get_versioned_index_name(alias_name):
+    """Physical indices are named after the alias through which they're
+    used, with the time of creation appended.
+    """
+    return "%s-%s" % (alias_name,
+                      timeutils.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f'))
+
+
+def create_versioned_index(es_engine, alias_name, settings=None):
+    index_name = get_versioned_index_name(alias_name)
+    body = {'settings': settings} if settings else None
+    es_engine.indices.create(index=index_name, body=body)
+    return index_name
+
+
+def get_alias_indices(es_engine, alias_name):
+    """Return the names of physical indices behind an alias. If alias_name
+    is a physical index (as created by older versions) it's returned on its
+    own; if it doesn't exist, the list is empty.
+    """
+    if not es_engine.indices.exists(index=alias_name):
+        return []
+    if es_engine.indices.exists_alias(name=alias_name):
+        return list(es_engine.indices.get_alias(name=alias_name).keys())
+    return [alias_name]
+
+
+def get_build_settings_to_restore(es_engine, index_name):
+    """Return the current values of the settings in BUILD_SETTINGS."""
+    current = es_engine.indices.get_settings(index=index_name)
+    index_settings = current[index_name]['settings']['index']
+    return {
+        'index': {
+            'number_of_replicas': index_settings['number_of_replicas'],
+            'refresh_interval': index_settings.get('refresh_interval', '1s')
+        }
+    }
+
+
+def switch_alias(es_engine, alias_name, index_name):
+    """Atomically point alias_name at index_name and nothing else. Returns
+    the physical indices the alias pointed to before.
+    """
+    old_indices = get_alias_indices(es_engine, alias_name)
+    if old_indices == [alias_name]:
+        # An alias can't share its name with an index, so the one-off
+        # migration from a plain index can't be made atomic
+        LOG.warning(_LW("Replacing index %s with an alias; searches will "
+                        "fail until the alias is created") % alias_name)
+        es_engine.indices.delete(index=alias_name)
+        old_indices = []
+
+    actions = [{'remove': {'index': old_index, 'alias': alias_name}}
+               for old_index in old_indices]
+    actions.append({'add': {'index': index_name, 'alias': alias_name}})
+    es_engine.indices.update_aliases(body={'actions': actions})
+    return old_indices
+
+
+def copy_documents(es_engine, source_index, target_index, doc_type):
+    """Copy every document of a type between indices, keeping parents."""
+    hits = helpers.scan(client=es_engine,
+                        index=source_index,
+                        doc_type=doc_type,
+                        query={'query': {'match_all': {}},
+                               'fields': ['_source', '_parent']})
+
+    def actions():
+        for hit in hits:
+            action = {'_id': hit['_id'], '_source': hit['_source']}
+            parent = hit.get('fields', {}).get('_parent')
+            if parent:
+                action['_parent'] = parent
+            yield action
+
+    writer = bulk.BulkWriter(es_engine, target_index, doc_type)
+    return writer.write(actions())
+
+
+class Coalescer(object):
+    """Collapses bursts of work for the same key. The first add() for a key
+    schedules callback(key) to run `window` seconds later; further adds for
+    that key before then are absorbed by the pending call.
+    """
+    def __init__(self, window, callback):
+        self.window = window
+        self.callback = callback
+        self._pending = {}
+        self._running = set()
+
+    def add(self, key):
+        if key not in self._pending:
+            self._pending[key] = eventlet.spawn_after(self.window,
+                                                      self._run, key)
+
+    def cancel(self, key):
+        """Drop any pending call for key."""
+        pending = self._pending.pop(key, None)
+        if pending:
+            pending.cancel()
+
+    def flush(self):
+        """Make every pending call now rather than at the end of its
+        window, and wait for any that are already running.
+        """
+        while self._pending:
+            key, pending = self._pending.popitem()
+            pending.cancel()
+            self._call(key)
+        for thread in list(self._running):
+            thread.wait()
+
+    def _run(self, key):
+        thread = self._pending.pop(key)
+        self._running.add(thread)
+        try:
+            self._call(key)
+        finally:
+            self._running.discard(thread)
+
+    def _call(self, key):
+        try:
+            self.callback(key)
+        except Exception:
+            LOG.exception(_LE("Error processing coalesced update for %s"),
+                          key)
+
+
+def send_notification(message):
+    """Publish an indexed document to the outbound change queue, if that's
+    enabled. Publishing happens in the background.
+    """
+    publisher.publish(message)
@@ -13,6 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+from elasticsearch import exceptions as es_exceptions
+from elasticsearch import helpers
+import eventlet
+from eventlet import queue
 import six
 
 from oslo_config import cfg
@@ -23,22 +28,108 @@ import oslo_messaging
 from oslo_policy import opts as oslo_policy_opts
 from oslo_service import service as os_service
 
+from searchlight.common import result_cache
 from searchlight.common import utils
+import searchlight.elasticsearch
+from searchlight.elasticsearch import bulk
 from searchlight import i18n
+from searchlight import publisher
 
 LOG = logging.getLogger(__name__)
 _ = i18n._
 _LE = i18n._LE
 
+listener_opts = [
+    cfg.IntOpt('batch_size', default=1,
+               help='Maximum number of notifications to process together. '
+                    'The index updates for each batch are sent to '
+                    'Elasticsearch in a single bulk request, and the '
+                    'notifications are acknowledged once it succeeds. '
+                    'The default of 1 processes notifications one at a '
+                    'time.'),
+    cfg.IntOpt('batch_timeout', default=1,
+               help='Maximum number of seconds to wait for a batch of '
+                    'notifications to fill before processing it.'),
+    cfg.IntOpt('handler_workers', default=1,
+               help='Number of notifications to process concurrently. '
+                    'Notifications for the same resource are always '
+                    'processed in the order they were received, and each '
+                    'is only acknowledged once it has been processed.'),
+    cfg.IntOpt('handler_queue_depth', default=100,
+               help='Maximum number of notifications waiting for each '
+                    'worker when handler_workers is more than 1. Once a '
+                    'worker\'s queue is full no more notifications are '
+                    'received until it catches up.'),
+    cfg.StrOpt('spool_file',
+               help='File to which index updates are appended while '
+                    'Elasticsearch is unavailable, so that they can be '
+                    'applied once it recovers rather than being lost. '
+                    'By default updates that fail are only logged.'),
+    cfg.IntOpt('spool_replay_interval', default=10,
+               help='Seconds between attempts to replay spooled index '
+                    'updates.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(listener_opts, group='listener')
 
 oslo_policy_opts._register(cfg.CONF)
 
 
+class PartitionedWorkers(object):
+    """Runs functions on a fixed number of green threads, each with its
+    own queue. Functions added with the same key always go to the same
+    worker, so they run in the order they were added.
+
+    dispatch() returns an event which receives the function's result, or
+    the exception it raised.
+    """
+    def __init__(self, workers, queue_depth):
+        self.queues = [queue.Queue(queue_depth) for i in range(workers)]
+        self.threads = [eventlet.spawn(self._work, work_queue)
+                        for work_queue in self.queues]
+
+    def dispatch(self, key, func, *args):
+        """Queue func(*args) on the worker for key, waiting for room in
+        its queue if it's full. Returns an event to wait for it with.
+        """
+        done = eventlet.event.Event()
+        self.queues[hash(key) % len(self.queues)].put((func, args, done))
+        return done
+
+    def wait(self):
+        """Wait until everything queued so far has run."""
+        for work_queue in self.queues:
+            work_queue.join()
+
+    def stop(self):
+        self.wait()
+        for thread in self.threads:
+            thread.kill()
+
+    def _work(self, work_queue):
+        while True:
+            func, args, done = work_queue.get()
+            try:
+                done.send(func(*args))
+            except Exception as e:
+                done.send_exception(e)
+            finally:
+                work_queue.task_done()
+
+
 class NotificationEndpoint(object):
 
-    def __init__(self, plugins):
+    def __init__(self, plugins, spool=None):
         self.plugins = plugins
+        self.spool = spool
+        self.workers = None
+        if CONF.listener.handler_workers > 1:
+            self.workers = PartitionedWorkers(
+                CONF.listener.handler_workers,
+                CONF.listener.handler_queue_depth)
         self.notification_target_map = {}
+        self.invalidated_types = self._get_invalidated_types()
         for plugin_type, plugin in six.iteritems(self.plugins):
             try:
                 event_list = plugin.obj.get_notification_supported_events()
@@ -52,6 +143,26 @@ class NotificationEndpoint(object):
                               "%(ext)s: %(e)s") %
                           {'ext': plugin.name, 'e': e})
 
+    def _get_invalidated_types(self):
+        """Map each plugin's document type to the types whose cached
+        search results are invalidated by its notifications: its own, and
+        those of its parent and children, whose documents its handler may
+        also update.
+        """
+        invalidated_types = collections.defaultdict(set)
+        for plugin in six.itervalues(self.plugins):
+            doc_type = plugin.obj.get_document_type()
+            invalidated_types[doc_type].add(doc_type)
+            try:
+                parent_type = plugin.obj.get_mapping().get(
+                    '_parent', {}).get('type')
+            except Exception:
+                continue
+            if parent_type:
+                invalidated_types[doc_type].add(parent_type)
+                invalidated_types[parent_type].add(doc_type)
+        return invalidated_types
+
     def info(self, ctxt, publisher_id, event_type, payload, metadata):
         event_type_l = event_type.lower()
         if event_type_l in self.notification_target_map:
@@ -59,12 +170,112 @@ class NotificationEndpoint(object):
             LOG.debug("Processing event '%s' with plugin '%s'",
                       event_type_l, plugin.name)
             handler = plugin.get_notification_handler()
-            handler.process(
-                ctxt,
-                publisher_id,
-                event_type,
-                payload,
-                metadata)
+            # Wait for a worker to process it so that it's only
+            # acknowledged (or requeued if it fails) afterwards
+            self._process(handler, ctxt, publisher_id, event_type, payload,
+                          metadata,
+                          self.invalidated_types[plugin.get_document_type()]
+                          ).wait()
+
+    def _process(self, handler, ctxt, publisher_id, event_type, payload,
+                 metadata, invalidated_types=()):
+        """Process a notification, on a worker if there are several.
+        Returns an event to wait for it with.
+        """
+        args = (handler, ctxt, publisher_id, event_type, payload, metadata,
+                invalidated_types)
+        if self.workers:
+            return self.workers.dispatch(handler.get_resource_id(payload),
+                                         self._handle, *args)
+        done = eventlet.event.Event()
+        done.send(self._handle(*args))
+        return done
+
+    def _handle(self, handler, ctxt, publisher_id, event_type, payload,
+                metadata, invalidated_types):
+        try:
+            handler.process(ctxt, publisher_id, event_type, payload,
+                            metadata)
+        finally:
+            if invalidated_types:
+                result_cache.invalidate(invalidated_types)
+
+    def stop(self):
+        """Finish processing notifications that have been received."""
+        if self.workers:
+            self.workers.stop()
+
+
+class BatchNotificationEndpoint(NotificationEndpoint):
+    """Processes batches of notifications, buffering each batch's index
+    updates so that they're sent to Elasticsearch in one bulk request.
+    """
+
+    def info(self, messages):
+        engines = {}
+        doc_types = set()
+        processing = []
+        for message in messages:
+            event_type_l = message['event_type'].lower()
+            if event_type_l not in self.notification_target_map:
+                continue
+            plugin = self.notification_target_map[event_type_l]
+            LOG.debug("Processing event '%s' with plugin '%s'",
+                      event_type_l, plugin.name)
+            if plugin.engine not in engines:
+                engines[plugin.engine] = bulk.BufferingEngine(
+                    plugin.engine,
+                    spool=self.spool,
+                    max_chunk_bytes=CONF.resource_plugin.bulk_max_chunk_bytes,
+                    max_retries=CONF.resource_plugin.bulk_max_retries,
+                    retry_backoff=CONF.resource_plugin.bulk_retry_backoff)
+            handler = plugin.get_notification_handler()
+            handler.engine = engines[plugin.engine]
+            doc_types.update(
+                self.invalidated_types[plugin.get_document_type()])
+            processing.append(self._process(handler,
+                                            message['ctxt'],
+                                            message['publisher_id'],
+                                            message['event_type'],
+                                            message['payload'],
+                                            message['metadata']))
+
+        # A notification that couldn't be processed requeues the batch,
+        # once the others have finished with its engines
+        errors = []
+        for done in processing:
+            try:
+                done.wait()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+        # Handlers log and carry on when elasticsearch can't be read, so
+        # their writes may be incomplete; the whole batch is requeued
+        # without sending any of them
+        for engine in six.itervalues(engines):
+            if engine.unavailable:
+                raise engine.unavailable
+
+        # If a bulk request fails the whole batch is requeued (unless it's
+        # spooled); this is safe because processing a notification again
+        # gives the same result
+        for engine in six.itervalues(engines):
+            try:
+                engine.flush()
+            except helpers.BulkIndexError as e:
+                if bulk.is_unavailable(e):
+                    raise
+                errors = [result for error in e.errors
+                          for result in six.itervalues(error)]
+                # Anything else (an update to a document that doesn't
+                # exist, for instance) would fail again if redelivered
+                LOG.error(_LE("Failed to apply %(count)d index update(s): "
+                              "%(errors)s") %
+                          {'count': len(errors), 'errors': errors})
+        if doc_types:
+            result_cache.invalidate(doc_types)
 
 
 class ListenerService(os_service.Service):
@@ -72,6 +283,17 @@ class ListenerService(os_service.Service):
         super(ListenerService, self).__init__(*args, **kwargs)
         self.plugins = utils.get_search_plugins()
         self.listeners = []
+        self.endpoints = []
+        self.spool = None
+        self.replayer = None
+        if CONF.listener.spool_file:
+            self.spool = bulk.Spool(CONF.listener.spool_file)
+            self.engine = searchlight.elasticsearch.get_api()
+            # Every write made on behalf of a plugin, including those it
+            # defers, goes through its engine
+            for plugin in six.itervalues(self.plugins):
+                plugin.obj.engine = bulk.SpoolingEngine(plugin.obj.engine,
+                                                        self.spool)
         self.topics_exchanges_set = self.topics_and_exchanges()
 
     def topics_and_exchanges(self):
@@ -100,18 +322,63 @@ class ListenerService(os_service.Service):
             oslo_messaging.Target(topic=pl_topic, exchange=pl_exchange)
             for pl_topic, pl_exchange in self.topics_exchanges_set
         ]
-        endpoints = [
-            NotificationEndpoint(self.plugins)
-        ]
-        listener = oslo_messaging.get_notification_listener(
-            transport,
-            targets,
-            endpoints)
+        if CONF.listener.batch_size > 1:
+            endpoint = BatchNotificationEndpoint(self.plugins, self.spool)
+            listener = oslo_messaging.get_batch_notification_listener(
+                transport,
+                targets,
+                [endpoint],
+                allow_requeue=True,
+                batch_size=CONF.listener.batch_size,
+                batch_timeout=CONF.listener.batch_timeout)
+        else:
+            endpoint = NotificationEndpoint(self.plugins, self.spool)
+            # Each notification waits for its worker, so they're only
+            # processed concurrently if the executor runs several at once
+            executor = ('eventlet' if CONF.listener.handler_workers > 1
+                        else 'blocking')
+            listener = oslo_messaging.get_notification_listener(
+                transport,
+                targets,
+                [endpoint],
+                executor=executor)
         listener.start()
         self.listeners.append(listener)
+        self.endpoints.append(endpoint)
+        if self.spool:
+            self.replayer = eventlet.spawn(self._replay_spool)
+
+    def _replay_spool(self):
+        while True:
+            try:
+                self.spool.replay(
+                    self.engine,
+                    chunk_size=CONF.resource_plugin.bulk_chunk_size,
+                    max_chunk_bytes=CONF.resource_plugin.bulk_max_chunk_bytes,
+                    max_retries=CONF.resource_plugin.bulk_max_retries,
+                    retry_backoff=CONF.resource_plugin.bulk_retry_backoff)
+            except (es_exceptions.TransportError,
+                    helpers.BulkIndexError) as e:
+                LOG.debug("Elasticsearch still unavailable, not replaying "
+                          "spooled updates: %s", e)
+            except Exception:
+                LOG.exception(_LE("Error replaying spooled updates"))
+            eventlet.sleep(CONF.listener.spool_replay_interval)
 
     def stop(self):
         for listener in self.listeners:
             listener.stop()
             listener.wait()
+        for endpoint in self.endpoints:
+            endpoint.stop()
+        for plugin in six.itervalues(self.plugins):
+            try:
+                plugin.obj.flush_deferred_updates()
+            except Exception as e:
+                LOG.error(_LE("Failed to apply deferred updates for "
+                              "%(ext)s: %(e)s") %
+                          {'ext': plugin.name, 'e': e})
+        if self.replayer:
+            self.replayer.kill()
+        publisher.stop(CONF.publisher.timeout)
         super(ListenerService, self).stop()
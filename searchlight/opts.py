@@ -17,8 +17,11 @@ import itertools
 
 import searchlight.common.config
 import searchlight.common.property_utils
+import searchlight.common.result_cache
 import searchlight.common.wsgi
 import searchlight.elasticsearch
+import searchlight.listener
+import searchlight.publisher
 
 
 def list_opts():
@@ -30,6 +33,10 @@ def list_opts():
                          searchlight.common.property_utils.property_opts,
                          searchlight.common.config.common_opts)),
         ('elasticsearch', searchlight.elasticsearch.search_opts),
+        ('listener', searchlight.listener.listener_opts),
         ('paste_deploy', searchlight.common.config.paste_deploy_opts),
         ('profiler', searchlight.common.wsgi.profiler_opts),
+        ('publisher', searchlight.publisher.publisher_opts),
+        ('result_cache',
+         searchlight.common.result_cache.result_cache_opts),
     ]
@@ -0,0 +1,191 @@
+# Copyright (c) 2015 Hewlett-Packard Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import eventlet
+from eventlet import queue
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+import requests
+from requests import adapters
+import time
+
+from searchlight import i18n
+
+LOG = logging.getLogger(__name__)
+_LI = i18n._LI
+_LW = i18n._LW
+
+DROP_NEW = 'drop_new'
+DROP_OLD = 'drop_old'
+BLOCK = 'block'
+
+publisher_opts = [
+    cfg.StrOpt('url',
+               default='http://localhost:8888/v2/queues/testqueue/messages',
+               help='URL of the queue to which changes are posted.'),
+    cfg.StrOpt('client_id', default='133c9b5c-7ed0-11e5-83e0-4335d873a583',
+               help='Client-ID header sent with each post.'),
+    cfg.StrOpt('project_id', default='demo',
+               help='X-Project-Id header sent with each post.'),
+    cfg.IntOpt('message_ttl', default=1000,
+               help='Seconds for which the queue keeps each message.'),
+    cfg.IntOpt('queue_size', default=1000,
+               help='Maximum number of changes held in memory waiting to '
+                    'be posted.'),
+    cfg.StrOpt('overflow_policy', default=DROP_NEW,
+               choices=(DROP_NEW, DROP_OLD, BLOCK),
+               help='What to do with a change when the queue is full: '
+                    'drop_new discards it, drop_old discards the oldest '
+                    'waiting change to make room for it, and block makes '
+                    'the listener wait for room, slowing indexing down to '
+                    'the rate at which changes can be posted.'),
+    cfg.IntOpt('batch_size', default=10,
+               help='Maximum number of changes posted in one request.'),
+    cfg.FloatOpt('batch_timeout', default=0.1,
+                 help='Seconds to wait for a batch to fill before posting '
+                      'it.'),
+    cfg.IntOpt('workers', default=2,
+               help='Number of requests that may be in progress at once. '
+                    'Each worker keeps its connection open between '
+                    'requests.'),
+    cfg.FloatOpt('timeout', default=10,
+                 help='Seconds to wait for the queue to respond to a post.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(publisher_opts, group='publisher')
+
+_publisher = None
+
+
+def publish(message):
+    """Queue a change to be posted. This never waits for the post
+    itself.
+    """
+    if message is None:
+        return
+    global _publisher
+    if _publisher is None:
+        _publisher = Publisher()
+    _publisher.publish(message)
+
+
+def stop(timeout=None):
+    """Post any queued changes and stop publishing."""
+    global _publisher
+    if _publisher is not None:
+        _publisher.stop(timeout)
+        _publisher = None
+
+
+class Publisher(object):
+    """Posts messages to a queue in batches from background green threads,
+    so that publishing adds no latency to indexing. Messages wait in a
+    bounded queue; when it's full overflow_policy decides whether new or
+    old messages are dropped, or the caller waits for room.
+
+    Counts of the messages published, dropped and failed are kept in
+    stats, and logged when the publisher is stopped.
+    """
+    def __init__(self):
+        self.options = CONF.publisher
+        self.queue = queue.LightQueue(self.options.queue_size)
+        self.stats = {'published': 0, 'dropped': 0, 'failed': 0,
+                      'batches': 0}
+        self.session = requests.Session()
+        # Enough connections for every worker to keep its own open
+        self.session.mount(self.options.url, adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.options.workers))
+        self.headers = {'Client-ID': self.options.client_id,
+                        'X-Project-Id': self.options.project_id,
+                        'Content-Type': 'application/json'}
+        self._in_flight = 0
+        self._overflowing = False
+        self.threads = [eventlet.spawn(self._work)
+                        for i in range(self.options.workers)]
+
+    def publish(self, message):
+        if self.options.overflow_policy == BLOCK:
+            self.queue.put(message)
+            return
+        try:
+            self.queue.put_nowait(message)
+            self._overflowing = False
+            return
+        except queue.Full:
+            pass
+
+        if self.options.overflow_policy == DROP_OLD:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.queue.put_nowait(message)
+        self.stats['dropped'] += 1
+        if not self._overflowing:
+            LOG.warning(_LW("Publisher queue is full; dropping changes"))
+            self._overflowing = True
+
+    def stop(self, timeout=None):
+        """Wait up to timeout seconds (or indefinitely) for queued messages
+        to be posted, then stop the workers.
+        """
+        deadline = timeout and time.time() + timeout
+        while self.queue.qsize() or self._in_flight:
+            if deadline and time.time() >= deadline:
+                break
+            eventlet.sleep(0.1)
+        for thread in self.threads:
+            thread.kill()
+        self.session.close()
+        LOG.info(_LI("Publisher stopped: %s") % self.stats)
+
+    def _work(self):
+        while True:
+            batch = [self.queue.get()]
+            self._in_flight += 1
+            try:
+                self._fill_batch(batch)
+                self._post(batch)
+            finally:
+                self._in_flight -= 1
+
+    def _fill_batch(self, batch):
+        deadline = time.time() + self.options.batch_timeout
+        while len(batch) < self.options.batch_size:
+            try:
+                batch.append(self.queue.get(
+                    timeout=max(deadline - time.time(), 0)))
+            except queue.Empty:
+                break
+
+    def _post(self, batch):
+        data = {'messages': [{'ttl': self.options.message_ttl, 'body': m}
+                             for m in batch]}
+        try:
+            response = self.session.post(self.options.url,
+                                         data=jsonutils.dumps(data),
+                                         headers=self.headers,
+                                         timeout=self.options.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            self.stats['failed'] += len(batch)
+            LOG.warning(_LW("Failed to publish %(count)d change(s): "
+                            "%(e)s") % {'count': len(batch), 'e': e})
+            return
+        self.stats['published'] += len(batch)
+        self.stats['batches'] += 1
+        LOG.debug("Published %d change(s)", len(batch))
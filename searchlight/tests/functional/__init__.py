@@ -36,6 +36,7 @@ import tempfile
 import time
 
 import fixtures
+import mock
 from oslo_serialization import jsonutils
 # NOTE(jokke): simplified transition to py3, behaves like py2 xrange
 from six.moves import range
@@ -48,6 +49,19 @@ execute, get_unused_port = test_utils.execute, test_utils.get_unused_port
 tracecmd_osmap = {'Linux': 'strace', 'FreeBSD': 'truss'}
 
 
+def stub_plugin_options(plugin, **options):
+    """Set the options of a search plugin whose __init__ has been patched
+    out. Each option the plugin registers has its default (None for those
+    inherited from [resource_plugin]) unless it's given here; options given
+    that the plugin doesn't register are ignored, and reading one raises
+    AttributeError.
+    """
+    opts = plugin.get_plugin_opts()
+    plugin.options = mock.Mock(spec_set=[opt.dest for opt in opts])
+    for opt in opts:
+        setattr(plugin.options, opt.dest, options.get(opt.dest, opt.default))
+
+
 class Server(object):
     """
     Class used to easily manage starting and stopping
@@ -61,10 +61,9 @@ class TestSearchListener(functional.FunctionalTest):
             "http://localhost:%s" % self.api_server.elasticsearch_port)
 
         def dummy_plugin_init(plugin):
-            plugin.options = mock.Mock()
-            plugin.options.index_name = "searchlight"
-            plugin.options.enabled = True
-            plugin.options.unsearchable_fields = None
+            functional.stub_plugin_options(plugin,
+                                           index_name="searchlight",
+                                           member_workers=1)
 
             plugin.engine = self.elastic_connection
 
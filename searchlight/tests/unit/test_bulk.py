@@ -0,0 +1,350 @@
+# Copyright (c) 2015 Hewlett-Packard Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from elasticsearch import exceptions as es_exceptions
+from elasticsearch import helpers
+from elasticsearch.serializer import JSONSerializer
+import json
+import mock
+import os
+
+from searchlight.elasticsearch import bulk
+import searchlight.tests.utils as test_utils
+
+
+def _actions(count, size=10):
+    for i in range(count):
+        yield {'_id': str(i), '_source': {'data': 'x' * size}}
+
+
+def _bulk_response(body, status=201):
+    lines = body.splitlines()
+    return {'items': [{'index': {'status': status}}
+                      for i in range(len(lines) // 2)]}
+
+
+class TestBulkWriter(test_utils.BaseTestCase):
+    def setUp(self):
+        super(TestBulkWriter, self).setUp()
+        self.engine = mock.Mock()
+        self.engine.transport.serializer = JSONSerializer()
+        self.engine.bulk.side_effect = (
+            lambda body, **kwargs: _bulk_response(body))
+
+        patched_sleep = mock.patch('eventlet.sleep')
+        self.mock_sleep = patched_sleep.start()
+        self.addCleanup(patched_sleep.stop)
+
+    def _chunk_sizes(self):
+        return [len(c[1]['body'].splitlines()) // 2
+                for c in self.engine.bulk.call_args_list]
+
+    def test_chunk_by_count(self):
+        writer = bulk.BulkWriter(self.engine, 'searchlight', 'OS::Test',
+                                 workers=2, chunk_size=3)
+        self.assertEqual(7, writer.write(_actions(7)))
+        self.assertEqual([3, 3, 1], self._chunk_sizes())
+        self.engine.bulk.assert_called_with(
+            body=mock.ANY, index='searchlight', doc_type='OS::Test')
+
+    def test_chunk_by_bytes(self):
+        # Each action is a little over 1000 bytes once serialized
+        writer = bulk.BulkWriter(self.engine, 'searchlight', 'OS::Test',
+                                 chunk_size=100, max_chunk_bytes=2500)
+        self.assertEqual(5, writer.write(_actions(5, size=1000)))
+        self.assertEqual([2, 2, 1], self._chunk_sizes())
+
+    def test_on_chunk(self):
+        writer = bulk.BulkWriter(self.engine, 'searchlight', 'OS::Test',
+                                 workers=3, chunk_size=2)
+        on_chunk = mock.Mock()
+        writer.write(_actions(5), on_chunk=on_chunk)
+        self.assertEqual([mock.call(2), mock.call(2), mock.call(1)],
+                         on_chunk.call_args_list)
+
+    def test_oversized_document(self):
+        writer = bulk.BulkWriter(self.engine, 'searchlight', 'OS::Test',
+                                 max_chunk_bytes=10)
+        self.assertEqual(2, writer.write(_actions(2, size=100)))
+        self.assertEqual([1, 1], self._chunk_sizes())
+
+    def test_item_errors(self):
+        self.engine.bulk.side_effect = (
+            lambda body, **kwargs: _bulk_response(body, status=400))
+        writer = bulk.BulkWriter(self.engine, 'searchlight', 'OS::Test')
+        self.assertRaises(helpers.BulkIndexError,
+                          writer.write, _actions(2))
+
+    def test_version_conflicts(self):
+        """Writes rejected for being out of date are ignored"""
+        self.engine.bulk.side_effect = (
+            lambda body, **kwargs: _bulk_response(body, status=409))
+        writer = bulk.BulkWriter(self.engine, 'searchlight', 'OS::Test')
+        self.assertEqual(2, writer.write(_actions(2)))
+
+    def test_retry_rejected_items(self):
+        """Only the items rejected with a 429 are sent again"""
+        responses = [
+            {'items': [{'index': {'status': 201}},
+                       {'index': {'status': 429}}]},
+            {'items': [{'index': {'status': 201}}]}
+        ]
+        self.engine.bulk.side_effect = lambda body, **kwargs: responses.pop(0)
+        writer = bulk.BulkWriter(self.engine, 'searchlight', 'OS::Test')
+
+        self.assertEqual(2, writer.write(_actions(2)))
+        self.assertEqual([2, 1], self._chunk_sizes())
+        retried = self.engine.bulk.call_args[1]['body'].splitlines()
+        self.assertEqual({'index': {'_id': '1'}}, json.loads(retried[0]))
+        self.assertEqual(1, self.mock_sleep.call_count)
+
+    def test_retry_request(self):
+        self.engine.bulk.side_effect = [
+            es_exceptions.TransportError(503, 'unavailable'),
+            {'items': [{'index': {'status': 201}}]}
+        ]
+        writer = bulk.BulkWriter(self.engine, 'searchlight', 'OS::Test')
+        self.assertEqual(1, writer.write(_actions(1)))
+        self.assertEqual(2, self.engine.bulk.call_count)
+
+    def test_retries_exhausted(self):
+        self.engine.bulk.side_effect = (
+            lambda body, **kwargs: _bulk_response(body, status=429))
+        writer = bulk.BulkWriter(self.engine, 'searchlight', 'OS::Test',
+                                 max_retries=2, retry_backoff=1)
+        self.assertRaises(helpers.BulkIndexError,
+                          writer.write, _actions(1))
+        self.assertEqual(3, self.engine.bulk.call_count)
+        # Backoff doubles with each retry
+        delays = [c[0][0] for c in self.mock_sleep.call_args_list]
+        self.assertTrue(0.5 <= delays[0] <= 1)
+        self.assertTrue(1 <= delays[1] <= 2)
+
+    def test_dead_letter_file(self):
+        self.engine.bulk.side_effect = (
+            lambda body, **kwargs: _bulk_response(body, status=400))
+        dead_letter_file = os.path.join(self.test_dir, 'dead_letters.json')
+        writer = bulk.BulkWriter(self.engine, 'searchlight', 'OS::Test',
+                                 chunk_size=1,
+                                 dead_letter_file=dead_letter_file)
+        on_chunk = mock.Mock()
+
+        self.assertEqual(0, writer.write(_actions(2), on_chunk=on_chunk))
+        self.assertEqual([mock.call(1), mock.call(1)],
+                         on_chunk.call_args_list)
+        with open(dead_letter_file) as dead_letters:
+            lines = [json.loads(line) for line in dead_letters]
+        self.assertEqual([
+            {'index': {'_id': '0', '_index': 'searchlight',
+                       '_type': 'OS::Test'}},
+            {'data': 'x' * 10},
+            {'index': {'_id': '1', '_index': 'searchlight',
+                       '_type': 'OS::Test'}},
+            {'data': 'x' * 10}
+        ], lines)
+
+
+class TestBufferingEngine(test_utils.BaseTestCase):
+    def setUp(self):
+        super(TestBufferingEngine, self).setUp()
+        self.engine = mock.Mock()
+        self.engine.transport.serializer = JSONSerializer()
+        self.engine.bulk.side_effect = (
+            lambda body, **kwargs: _bulk_response(body))
+        self.buffered = bulk.BufferingEngine(self.engine)
+
+    def test_flush(self):
+        """Writes are held until flushed, then sent in one request"""
+        self.buffered.index(index='searchlight', doc_type='OS::Test',
+                            body={'name': 'a'}, id='1', parent='p1')
+        self.buffered.update(index='searchlight', doc_type='OS::Test',
+                             body={'doc': {'name': 'b'}}, id='2')
+        self.buffered.delete(index='searchlight', doc_type='OS::Test',
+                             id='3')
+        self.assertFalse(self.engine.bulk.called)
+
+        self.assertEqual(3, self.buffered.flush())
+        self.engine.bulk.assert_called_once_with(
+            body=mock.ANY, index=None, doc_type=None)
+        body = self.engine.bulk.call_args[1]['body']
+        self.assertEqual([
+            {'index': {'_index': 'searchlight', '_type': 'OS::Test',
+                       '_id': '1', '_parent': 'p1'}},
+            {'name': 'a'},
+            {'update': {'_index': 'searchlight', '_type': 'OS::Test',
+                        '_id': '2'}},
+            {'doc': {'name': 'b'}},
+            {'delete': {'_index': 'searchlight', '_type': 'OS::Test',
+                        '_id': '3'}}
+        ], [json.loads(line) for line in body.splitlines()])
+
+        # Nothing left to send
+        self.assertEqual(0, self.buffered.flush())
+        self.assertEqual(1, self.engine.bulk.call_count)
+
+    def test_read_passes_through(self):
+        """Reads of other documents go straight to elasticsearch without
+        flushing
+        """
+        self.buffered.index(index='searchlight', doc_type='OS::Test',
+                            body={'name': 'a'}, id='1')
+
+        self.buffered.get(index='searchlight', doc_type='OS::Test', id='2')
+        self.engine.get.assert_called_once_with(
+            index='searchlight', doc_type='OS::Test', id='2')
+        self.assertFalse(self.engine.bulk.called)
+        self.assertIsNone(self.buffered.unavailable)
+
+    def test_read_buffered(self):
+        """Reads see documents as buffered writes will leave them"""
+        self.buffered.index(index='searchlight', doc_type='OS::Test',
+                            body={'name': 'a'}, id='1')
+        self.buffered.index(index='searchlight', doc_type='OS::Test',
+                            body={'name': 'b'}, id='1')
+        self.buffered.delete(index='searchlight', doc_type='OS::Test',
+                             id='2')
+
+        document = self.buffered.get(index='searchlight',
+                                     doc_type='OS::Test', id='1')
+        self.assertEqual({'name': 'b'}, document['_source'])
+        self.assertRaises(es_exceptions.NotFoundError, self.buffered.get,
+                          index='searchlight', doc_type='OS::Test', id='2')
+        self.assertFalse(self.engine.get.called)
+        self.assertFalse(self.engine.bulk.called)
+
+    def test_read_partial_update_flushes(self):
+        """A document with a buffered partial update is read after
+        flushing
+        """
+        self.buffered.update(index='searchlight', doc_type='OS::Test',
+                             body={'doc': {'name': 'a'}}, id='1')
+        self.engine.get.side_effect = (
+            lambda **kwargs: self.assertTrue(self.engine.bulk.called))
+
+        self.buffered.get(index='searchlight', doc_type='OS::Test', id='1')
+        self.engine.get.assert_called_once_with(
+            index='searchlight', doc_type='OS::Test', id='1')
+
+    def test_read_unavailable(self):
+        """A read failing because elasticsearch is unavailable is kept"""
+        error = es_exceptions.ConnectionError('N/A', 'down', None)
+        self.engine.get.side_effect = error
+        self.assertRaises(es_exceptions.ConnectionError, self.buffered.get,
+                          index='searchlight', doc_type='OS::Test', id='1')
+        self.assertIs(error, self.buffered.unavailable)
+
+
+class TestSpool(test_utils.BaseTestCase):
+    def setUp(self):
+        super(TestSpool, self).setUp()
+        self.engine = mock.Mock()
+        self.engine.transport.serializer = JSONSerializer()
+        self.engine.bulk.side_effect = (
+            lambda body, **kwargs: _bulk_response(body))
+        self.path = os.path.join(self.test_dir, 'spool.json')
+        self.spool = bulk.Spool(self.path)
+        self.spooling = bulk.SpoolingEngine(self.engine, self.spool)
+
+        patched_sleep = mock.patch('eventlet.sleep')
+        patched_sleep.start()
+        self.addCleanup(patched_sleep.stop)
+
+    def _spooled(self):
+        with open(self.path) as journal:
+            return [json.loads(line) for line in journal]
+
+    def test_spool_when_unavailable(self):
+        """Writes are spooled while elasticsearch is down, and until the
+        spool has been replayed
+        """
+        self.engine.index.side_effect = es_exceptions.ConnectionError(
+            'N/A', 'down', None)
+        self.spooling.index(index='searchlight', doc_type='OS::Test',
+                            body={'name': 'a'}, id='1', version=10,
+                            version_type=bulk.VERSION_TYPE)
+        self.spooling.delete(index='searchlight', doc_type='OS::Test',
+                             id='2')
+
+        self.assertTrue(self.spool.pending)
+        self.assertEqual(1, self.engine.index.call_count)
+        self.assertFalse(self.engine.delete.called)
+        self.assertEqual([
+            {'index': {'_index': 'searchlight', '_type': 'OS::Test',
+                       '_id': '1', '_version': 10,
+                       '_version_type': bulk.VERSION_TYPE}},
+            {'name': 'a'},
+            {'delete': {'_index': 'searchlight', '_type': 'OS::Test',
+                        '_id': '2'}}
+        ], self._spooled())
+
+        # The spool survives a restart
+        self.assertTrue(bulk.Spool(self.path).pending)
+
+        spooled = self._spooled()
+        self.assertEqual(2, self.spool.replay(self.engine))
+        body = self.engine.bulk.call_args[1]['body']
+        self.assertEqual(spooled, [json.loads(line)
+                                   for line in body.splitlines()])
+        self.assertFalse(self.spool.pending)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.spool.replay_path))
+
+        # Writes go straight to elasticsearch again
+        self.spooling.delete(index='searchlight', doc_type='OS::Test',
+                             id='3')
+        self.engine.delete.assert_called_once_with(
+            index='searchlight', doc_type='OS::Test', id='3')
+
+    def test_other_errors_raised(self):
+        self.engine.update.side_effect = es_exceptions.NotFoundError(
+            404, 'missing')
+        self.assertRaises(es_exceptions.NotFoundError, self.spooling.update,
+                          index='searchlight', doc_type='OS::Test', id='1',
+                          body={'doc': {'name': 'a'}})
+        self.assertFalse(self.spool.pending)
+
+    def test_replay_while_unavailable(self):
+        """The journal is kept if elasticsearch is still down"""
+        self.spool.append(list(_actions(1)))
+        self.engine.bulk.side_effect = es_exceptions.ConnectionError(
+            'N/A', 'down', None)
+
+        self.assertRaises(es_exceptions.ConnectionError, self.spool.replay,
+                          self.engine, max_retries=0)
+        self.assertTrue(self.spool.pending)
+        self.assertTrue(os.path.exists(self.spool.replay_path))
+
+        # Later writes are kept behind the ones being replayed
+        self.spool.append([{'_id': '9', '_source': {'data': 'y'}}])
+        self.engine.bulk.side_effect = (
+            lambda body, **kwargs: _bulk_response(body))
+        self.assertEqual(2, self.spool.replay(self.engine))
+        ids = [json.loads(call[1]['body'].splitlines()[0])['index']['_id']
+               for call in self.engine.bulk.call_args_list[-2:]]
+        self.assertEqual(['0', '9'], ids)
+        self.assertFalse(self.spool.pending)
+
+    def test_buffering_engine_spools(self):
+        """A batch that can't be written is spooled instead of failing"""
+        self.engine.bulk.side_effect = (
+            lambda body, **kwargs: _bulk_response(body, status=429))
+        buffered = bulk.BufferingEngine(self.engine, spool=self.spool,
+                                        max_retries=0)
+        buffered.index(index='searchlight', doc_type='OS::Test',
+                       body={'name': 'a'}, id='1')
+
+        self.assertEqual(0, buffered.flush())
+        self.assertTrue(self.spool.pending)
+        self.assertEqual(2, len(self._spooled()))
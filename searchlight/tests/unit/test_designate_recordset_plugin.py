@@ -14,10 +14,15 @@
 #    under the License.
 
 import datetime
+from elasticsearch.serializer import JSONSerializer
+import eventlet
+import json
 import mock
 
+from searchlight.elasticsearch.plugins import base
 from searchlight.elasticsearch.plugins.designate import \
     recordsets as recordsets_plugin
+from searchlight.elasticsearch.plugins import utils
 from searchlight.tests.unit import utils as unit_test_utils
 import searchlight.tests.utils as test_utils
 
@@ -140,3 +145,102 @@ class TestZonePlugin(test_utils.BaseTestCase):
             ignore_unavailable=True,
             search_type='count'
         )
+
+    def test_save_documents(self):
+        """Documents are sent to the bulk API along with their parent"""
+        documents = [
+            {'id': ID1, 'zone_id': ZONE_ID1, 'name': 'www.test.com.'},
+            {'id': ID2, 'zone_id': ZONE_ID2, 'name': 'www.other.com.'}
+        ]
+        mock_engine = mock.Mock()
+        mock_engine.transport.serializer = JSONSerializer()
+        mock_engine.bulk.return_value = {'items': [
+            {'index': {'_id': ID1, 'status': 201}},
+            {'index': {'_id': ID2, 'status': 201}}
+        ]}
+        self.plugin.engine = mock_engine
+
+        count = self.plugin.save_documents(iter(documents))
+
+        self.assertEqual(2, count)
+        body = mock_engine.bulk.call_args[1]['body']
+        hash_field = base.CONTENT_HASH_FIELD
+        self.assertEqual([
+            {'index': {'_id': ID1, '_parent': ZONE_ID1}},
+            dict(documents[0], **{
+                hash_field: utils.get_content_hash(documents[0])}),
+            {'index': {'_id': ID2, '_parent': ZONE_ID2}},
+            dict(documents[1], **{
+                hash_field: utils.get_content_hash(documents[1])})
+        ], [json.loads(line) for line in body.splitlines()])
+
+    def test_save_documents_checkpoint(self):
+        """The zone of the last recordset in each indexed chunk is saved"""
+        documents = [
+            {'id': ID1, 'zone_id': ZONE_ID1},
+            {'id': ID2, 'zone_id': ZONE_ID1},
+            {'id': ID3, 'zone_id': ZONE_ID2}
+        ]
+        mock_engine = mock.Mock()
+        mock_engine.transport.serializer = JSONSerializer()
+        mock_engine.bulk.side_effect = lambda body, **kwargs: {'items': [
+            {'index': {'status': 201}}
+            for i in range(len(body.splitlines()) // 2)]}
+        self.plugin.engine = mock_engine
+        self.config(bulk_chunk_size=2, group='resource_plugin')
+        checkpoint = mock.Mock()
+
+        self.plugin.save_documents(iter(documents), checkpoint=checkpoint)
+
+        self.assertEqual([mock.call(ZONE_ID1), mock.call(ZONE_ID2)],
+                         checkpoint.call_args_list)
+
+    def test_get_objects_resume(self):
+        """Resuming starts again from the start of the marker zone"""
+        zone1 = {'id': ZONE_ID1, 'project_id': TENANT1}
+        zone2 = {'id': ZONE_ID2, 'project_id': TENANT1}
+        mock_client = mock.Mock()
+        mock_client.zones.get.return_value = zone1
+        mock_client.zones.list.side_effect = [[zone2], []]
+        recordsets = {
+            ZONE_ID1: [dict(self.recordset1, id=ID1),
+                       dict(self.recordset2, id=ID2)],
+            ZONE_ID2: [dict(self.recordset3, id=ID3)]
+        }
+
+        def list_recordsets(zone_id, criterion, limit, marker=None):
+            return [] if marker else recordsets[zone_id]
+        mock_client.recordsets.list.side_effect = list_recordsets
+
+        with mock.patch('searchlight.elasticsearch.plugins.openstack_clients.'
+                        'get_designateclient', return_value=mock_client):
+            objects = list(self.plugin.get_objects(marker=ZONE_ID1))
+
+        self.assertEqual([ID1, ID2, ID3], [o['id'] for o in objects])
+        mock_client.zones.get.assert_called_once_with(ZONE_ID1)
+        mock_client.zones.list.assert_any_call(
+            {'all_tenants': 'True'}, limit=50, marker=ZONE_ID1)
+
+    def test_get_objects_concurrent_zones(self):
+        """Zones are listed concurrently, but recordsets stay in order"""
+        zones = [{'id': 'zone-%d' % i, 'project_id': TENANT1}
+                 for i in range(5)]
+        mock_client = mock.Mock()
+        mock_client.zones.list.side_effect = [zones, []]
+
+        def list_recordsets(zone_id, criterion, limit, marker=None):
+            if marker:
+                return []
+            # Make earlier zones finish last
+            eventlet.sleep(0.01 * (5 - int(zone_id[-1])))
+            return [{'id': zone_id + '-rs', 'zone_id': zone_id}]
+        mock_client.recordsets.list.side_effect = list_recordsets
+        self.config(zone_workers=5,
+                    group='resource_plugin:os_designate_recordset')
+
+        with mock.patch('searchlight.elasticsearch.plugins.openstack_clients.'
+                        'get_designateclient', return_value=mock_client):
+            objects = list(self.plugin.get_objects())
+
+        self.assertEqual(['zone-%d-rs' % i for i in range(5)],
+                         [o['id'] for o in objects])
@@ -14,9 +14,14 @@
 #    under the License.
 
 import datetime
+import elasticsearch
+from elasticsearch.serializer import JSONSerializer
+import json
 import mock
 
+from searchlight.elasticsearch.plugins import base
 from searchlight.elasticsearch.plugins.designate import zones as zones_plugin
+from searchlight.elasticsearch.plugins import utils
 import searchlight.tests.unit.utils as unit_test_utils
 import searchlight.tests.utils as test_utils
 
@@ -130,3 +135,70 @@ class TestZonePlugin(test_utils.BaseTestCase):
             ignore_unavailable=True,
             search_type='count'
         )
+
+    def test_reconcile_data(self):
+        """Only changed zones are written, and vanished ones deleted"""
+        unchanged = dict(self.zone1, id=ID1)
+        changed = dict(self.zone2, id=ID2)
+        hits = [
+            {'_id': ID1, 'fields': {
+                base.CONTENT_HASH_FIELD: [utils.get_content_hash(unchanged)]}},
+            {'_id': ID2, 'fields': {base.CONTENT_HASH_FIELD: ['stale']}},
+            {'_id': ID3, 'fields': {base.CONTENT_HASH_FIELD: ['gone']}}
+        ]
+        mock_engine = mock.Mock()
+        mock_engine.transport.serializer = JSONSerializer()
+
+        def bulk(body, **kwargs):
+            lines = [json.loads(line) for line in body.splitlines()]
+            return {'items': [{op: {'status': 200}}
+                              for line in lines for op in line
+                              if op in ('index', 'delete')]}
+        mock_engine.bulk.side_effect = bulk
+        self.plugin.engine = mock_engine
+
+        with mock.patch('elasticsearch.helpers.scan',
+                        return_value=iter(hits)) as mock_scan:
+            with mock.patch.object(self.plugin, 'get_objects',
+                                   return_value=[dict(unchanged),
+                                                 dict(changed)]):
+                self.assertEqual((1, 1), self.plugin.reconcile_data())
+
+        query = mock_scan.call_args[1]['query']
+        self.assertFalse(query['_source'])
+        bodies = [[json.loads(line) for line in c[1]['body'].splitlines()]
+                  for c in mock_engine.bulk.call_args_list]
+        self.assertEqual([{'index': {'_id': ID2,
+                                     '_version': utils.get_version(changed),
+                                     '_version_type': 'external_gte'}},
+                          {'delete': {'_id': ID3}}],
+                         [bodies[0][0], bodies[1][0]])
+        self.assertEqual(utils.get_content_hash(changed),
+                         bodies[0][1][base.CONTENT_HASH_FIELD])
+
+    def test_filter_result_hides_content_hash(self):
+        fake_request = unit_test_utils.get_fake_request(
+            USER1, TENANT1, '/v1/search', is_admin=True)
+        hit = {'_source': {'id': ID1, base.CONTENT_HASH_FIELD: 'abc'}}
+        self.plugin.filter_result(hit, fake_request.context)
+        self.assertEqual({'id': ID1}, hit['_source'])
+
+    def test_notification_versioned_write(self):
+        """Zones are indexed with their update time as a version, and
+        rejected out of date writes are ignored.
+        """
+        mock_engine = mock.Mock()
+        mock_engine.index.side_effect = elasticsearch.ConflictError(
+            409, 'version_conflict_engine_exception')
+        handler = self.plugin.get_notification_handler()
+        handler.engine = mock_engine
+
+        handler.create_or_update(dict(self.zone1, id=ID1))
+
+        mock_engine.index.assert_called_once_with(
+            index=self.plugin.get_index_name(),
+            doc_type=self.plugin.get_document_type(),
+            body=mock.ANY,
+            id=ID1,
+            version=utils.get_version({'updated_at': updated_now}),
+            version_type='external_gte')
@@ -21,6 +21,7 @@ import six
 import glanceclient.exc
 from oslo_utils import timeutils
 
+from searchlight.elasticsearch.plugins import base
 from searchlight.elasticsearch.plugins.glance import images as images_plugin
 import searchlight.tests.unit.utils as unit_test_utils
 import searchlight.tests.utils as test_utils
@@ -280,6 +281,31 @@ class TestImageLoaderPlugin(test_utils.BaseTestCase):
             serialized = self.plugin.serialize(self.members_image)
         self.assertEqual(expected, serialized)
 
+    def test_serialize_objects_prefetches_members(self):
+        """Members are retrieved only for private images, and the images
+        stay in order
+        """
+        private_image = _image_fixture(
+            UUID4, owner=TENANT1, checksum=CHECKSUM, name='private',
+            size=256, visibility='private', status='active')
+
+        def list_members(image_id):
+            if image_id == UUID4:
+                return [{'member_id': TENANT2, 'status': 'accepted'}]
+            return self.members_image_members
+
+        with mock.patch('glanceclient.v2.image_members.Controller.list',
+                        side_effect=list_members) as mock_members:
+            serialized = list(self.plugin.serialize_objects(
+                [self.members_image, self.simple_image, private_image]))
+
+        self.assertEqual([UUID3, UUID1, UUID4],
+                         [s['id'] for s in serialized])
+        self.assertEqual([TENANT1, TENANT2, TENANT3], serialized[0]['members'])
+        self.assertEqual([], serialized[1]['members'])
+        self.assertEqual([TENANT2], serialized[2]['members'])
+        self.assertEqual(2, mock_members.call_count)
+
     def test_image_kernel_ramdisk_serialize(self):
         expected = {
             'checksum': '93264c3edf5972c9f1cb309543d38a5c',
@@ -307,6 +333,12 @@ class TestImageLoaderPlugin(test_utils.BaseTestCase):
 
     def test_setup_data(self):
         """Tests initial data load."""
+        saved = []
+
+        def save_documents(documents, index_name=None, checkpoint=None):
+            saved.extend(documents)
+            return len(saved)
+
         image_member_mocks = [
             self.members_image_members
         ]
@@ -318,14 +350,17 @@ class TestImageLoaderPlugin(test_utils.BaseTestCase):
                 # that the documents being indexed are as expected
                 with mock.patch.object(
                         self.plugin,
-                        'save_documents') as mock_save:
+                        'save_documents',
+                        side_effect=save_documents) as mock_save:
                     self.plugin.setup_data()
 
                     mock_list.assert_called_once_with()
                     mock_members.assert_called_once_with(
                         self.members_image['id'])
 
-                    mock_save.assert_called_once_with([
+                    mock_save.assert_called_once_with(
+                        mock.ANY, index_name=None, checkpoint=None)
+                    self.assertEqual([
                         {
                             'kernel_id': None,
                             'tags': [],
@@ -429,7 +464,23 @@ class TestImageLoaderPlugin(test_utils.BaseTestCase):
                             'created_at': '2012-05-16T15:27:36Z',
                             'id': 'KERNEL-eae7-4c0f-b50d-RAMDISK'
                         }
-                    ])
+                    ], saved)
+
+    def test_setup_data_memory_stats(self):
+        """The change in RSS while indexing is logged"""
+        mib = 1024 * 1024
+        with mock.patch('glanceclient.v2.images.Controller.list',
+                        return_value=[]):
+            with mock.patch.object(self.plugin, 'save_documents',
+                                   return_value=0):
+                with mock.patch.object(base, '_get_rss',
+                                       side_effect=[100 * mib, 150 * mib]):
+                    with mock.patch.object(base.LOG, 'info') as mock_info:
+                        self.plugin.setup_data()
+
+        message = mock_info.call_args[0][0]
+        self.assertIn('RSS 150.0 MiB, +50.0 MiB while indexing', message)
+        self.assertIn('process peak RSS', message)
 
     def test_image_rbac(self):
         """Test the image plugin RBAC query terms"""
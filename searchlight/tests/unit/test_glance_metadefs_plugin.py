@@ -346,13 +346,22 @@ class TestMetadefLoaderPlugin(test_utils.BaseTestCase):
         self.assertEqual(expected, serialized)
 
     def test_setup_data(self):
+        saved = []
+
+        def save_documents(documents, index_name=None, checkpoint=None):
+            saved.extend(documents)
+            return len(saved)
+
         with mock.patch.object(self.plugin, 'get_objects',
                                return_value=self.namespaces) as mock_get:
-            with mock.patch.object(self.plugin, 'save_documents') as mock_save:
+            with mock.patch.object(self.plugin, 'save_documents',
+                                   side_effect=save_documents) as mock_save:
                 self.plugin.setup_data()
 
-                mock_get.assert_called_once_with()
-                mock_save.assert_called_once_with([
+                mock_get.assert_called_once_with(since=None, marker=None)
+                mock_save.assert_called_once_with(mock.ANY, index_name=None,
+                                                  checkpoint=None)
+                self.assertEqual([
                     {
                         'created_at': now,
                         'updated_at': now,
@@ -439,7 +448,7 @@ class TestMetadefLoaderPlugin(test_utils.BaseTestCase):
                             {'name': 'Tag3'},
                         ],
                     }
-                ])
+                ], saved)
 
     def test_metadef_rbac(self):
         """Test metadefs RBAC query terms"""
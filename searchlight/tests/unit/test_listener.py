@@ -0,0 +1,243 @@
+# Copyright (c) 2015 Hewlett-Packard Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from elasticsearch import exceptions as es_exceptions
+from elasticsearch import helpers
+from elasticsearch.serializer import JSONSerializer
+import eventlet
+import json
+import mock
+import os
+
+from searchlight.elasticsearch import bulk
+from searchlight.elasticsearch.plugins import base
+from searchlight.elasticsearch.plugins.glance \
+    import images_notification_handler
+from searchlight import listener
+import searchlight.tests.utils as test_utils
+
+
+class FakeHandler(base.NotificationBase):
+    def process(self, ctxt, publisher_id, event_type, payload, metadata):
+        try:
+            if event_type == 'test.update':
+                # Like the handlers that read a document before updating it
+                payload = self.engine.get(index=self.index_name,
+                                          doc_type=self.document_type,
+                                          id=payload['id'])['_source']
+            self.engine.index(index=self.index_name,
+                              doc_type=self.document_type,
+                              body=payload, id=payload['id'])
+        except Exception:
+            pass
+
+
+def _message(event_type, id):
+    return {'ctxt': {}, 'publisher_id': 'test', 'event_type': event_type,
+            'payload': {'id': id}, 'metadata': {}}
+
+
+class TestBatchNotificationEndpoint(test_utils.BaseTestCase):
+    def setUp(self):
+        super(TestBatchNotificationEndpoint, self).setUp()
+        self.engine = mock.Mock()
+        self.engine.transport.serializer = JSONSerializer()
+        self.set_status(201)
+
+        plugin = mock.Mock()
+        plugin.obj.get_notification_supported_events.return_value = [
+            'test.create', 'test.update']
+        plugin.obj.engine = self.engine
+        plugin.obj.get_notification_handler.side_effect = (
+            lambda: FakeHandler(self.engine, 'searchlight', 'OS::Test'))
+        self.endpoint = listener.BatchNotificationEndpoint({'test': plugin})
+
+        patched_sleep = mock.patch('eventlet.sleep')
+        patched_sleep.start()
+        self.addCleanup(patched_sleep.stop)
+
+    def set_status(self, status):
+        self.engine.bulk.side_effect = lambda body, **kwargs: {'items': [
+            {'index': {'status': status}}
+            for i in range(len(body.splitlines()) // 2)]}
+
+    def test_single_bulk_request(self):
+        self.endpoint.info([_message('test.create', '1'),
+                            _message('test.ignored', '2'),
+                            _message('test.create', '3')])
+        self.assertEqual(1, self.engine.bulk.call_count)
+        self.assertFalse(self.engine.index.called)
+        body = self.engine.bulk.call_args[1]['body']
+        self.assertEqual(4, len(body.splitlines()))
+
+    def test_rejected_batch_requeued(self):
+        """The batch is requeued if elasticsearch is overloaded"""
+        self.set_status(429)
+        self.assertRaises(helpers.BulkIndexError, self.endpoint.info,
+                          [_message('test.create', '1')])
+
+    def test_rejected_batch_spooled(self):
+        """With a spool, a rejected batch is kept there rather than being
+        requeued
+        """
+        spool = bulk.Spool(os.path.join(self.test_dir, 'spool.json'))
+        self.endpoint.spool = spool
+        self.set_status(429)
+        self.endpoint.info([_message('test.create', '1')])
+        self.assertTrue(spool.pending)
+
+    def test_unavailable_read_requeues_batch(self):
+        """If elasticsearch can't be read part way through a batch, none
+        of the batch's updates are sent and it's requeued
+        """
+        self.engine.get.side_effect = es_exceptions.ConnectionError(
+            'N/A', 'down', None)
+        self.assertRaises(es_exceptions.ConnectionError, self.endpoint.info,
+                          [_message('test.create', '1'),
+                           _message('test.update', '2'),
+                           _message('test.create', '3')])
+        self.assertEqual(1, self.engine.get.call_count)
+        self.assertFalse(self.engine.bulk.called)
+
+    def test_member_events_for_one_image(self):
+        """Image member changes build on those earlier in the batch"""
+        plugin = mock.Mock()
+        plugin.obj.get_notification_supported_events.return_value = [
+            'image.member.create']
+        plugin.obj.engine = self.engine
+        plugin.obj.get_notification_handler.side_effect = (
+            lambda: images_notification_handler.ImageHandler(
+                self.engine, 'searchlight', 'OS::Glance::Image'))
+        endpoint = listener.BatchNotificationEndpoint({'image': plugin})
+        self.engine.get.return_value = {'_source': {
+            'id': 'image1', 'members': [],
+            'updated_at': '2015-10-21T10:20:30Z'}}
+
+        endpoint.info([
+            dict(_message('image.member.create', None),
+                 payload={'image_id': 'image1', 'member_id': member,
+                          'status': 'accepted', 'deleted': False})
+            for member in ('tenant1', 'tenant2')])
+
+        self.assertEqual(1, self.engine.get.call_count)
+        self.assertEqual(1, self.engine.bulk.call_count)
+        body = self.engine.bulk.call_args[1]['body'].splitlines()
+        self.assertEqual(['tenant1', 'tenant2'],
+                         json.loads(body[-1])['members'])
+
+    def test_failed_notification_requeues_batch(self):
+        """A handler failing on a worker requeues the batch"""
+        self.config(handler_workers=2, group='listener')
+        endpoint = listener.BatchNotificationEndpoint(self.endpoint.plugins)
+        self.addCleanup(endpoint.stop)
+        with mock.patch.object(FakeHandler, 'process',
+                               side_effect=RuntimeError('failed')):
+            self.assertRaises(RuntimeError, endpoint.info,
+                              [_message('test.create', '1'),
+                               _message('test.create', '2')])
+        self.assertFalse(self.engine.bulk.called)
+
+    def test_failed_updates_dropped(self):
+        """Updates that would fail again aren't retried"""
+        self.set_status(400)
+        self.endpoint.info([_message('test.create', '1')])
+        self.assertEqual(1, self.engine.bulk.call_count)
+
+
+class TestPartitionedWorkers(test_utils.BaseTestCase):
+    def test_ordering(self):
+        """Work for a key runs in order; other keys don't wait for it"""
+        workers = listener.PartitionedWorkers(4, 10)
+        self.addCleanup(workers.stop)
+        done = []
+
+        def work(key, i, delay):
+            eventlet.sleep(delay)
+            done.append((key, i))
+
+        # Integers hash to themselves, so each key gets its own worker
+        workers.dispatch(0, work, 'slow', 0, 0.05)
+        workers.dispatch(0, work, 'slow', 1, 0)
+        for i in range(1, 4):
+            workers.dispatch(i, work, 'fast', i, 0)
+        workers.wait()
+
+        self.assertEqual(5, len(done))
+        self.assertEqual([('slow', 0), ('slow', 1)],
+                         [d for d in done if d[0] == 'slow'])
+        # Nothing had to wait for the slow work
+        self.assertEqual(('slow', 0), done[-2])
+
+    def test_endpoint_partitions_by_resource(self):
+        self.config(handler_workers=2, group='listener')
+        handler = mock.Mock()
+        handler.get_resource_id.side_effect = lambda payload: payload['id']
+        plugin = mock.Mock()
+        plugin.obj.get_notification_supported_events.return_value = [
+            'test.create']
+        plugin.obj.get_notification_handler.return_value = handler
+        endpoint = listener.NotificationEndpoint({'test': plugin})
+
+        endpoint.info({}, 'test', 'test.create', {'id': '1'}, {})
+        endpoint.stop()
+
+        handler.get_resource_id.assert_called_once_with({'id': '1'})
+        handler.process.assert_called_once_with(
+            {}, 'test', 'test.create', {'id': '1'}, {})
+
+    def test_endpoint_waits_for_worker(self):
+        """Notifications are only acknowledged once they've been processed,
+        and failures are passed back so that they can be requeued
+        """
+        self.config(handler_workers=2, group='listener')
+        processed = []
+        handler = mock.Mock()
+        handler.get_resource_id.side_effect = lambda payload: payload['id']
+
+        def process(ctxt, publisher_id, event_type, payload, metadata):
+            eventlet.sleep(0.01)
+            if payload.get('fail'):
+                raise RuntimeError('failed')
+            processed.append(payload['id'])
+        handler.process.side_effect = process
+        plugin = mock.Mock()
+        plugin.obj.get_notification_supported_events.return_value = [
+            'test.create']
+        plugin.obj.get_notification_handler.return_value = handler
+        endpoint = listener.NotificationEndpoint({'test': plugin})
+        self.addCleanup(endpoint.stop)
+
+        endpoint.info({}, 'test', 'test.create', {'id': '1'}, {})
+        self.assertEqual(['1'], processed)
+        self.assertRaises(RuntimeError, endpoint.info, {}, 'test',
+                          'test.create', {'id': '2', 'fail': True}, {})
+
+
+class TestListenerService(test_utils.BaseTestCase):
+    def test_stop_flushes_deferred_updates(self):
+        """Updates deferred for notifications that have been acknowledged
+        are applied before the listener stops
+        """
+        plugin = mock.Mock()
+        plugin.obj.get_notification_topics_exchanges.return_value = []
+        with mock.patch('searchlight.common.utils.get_search_plugins',
+                        return_value={'test': plugin}):
+            service = listener.ListenerService()
+        with mock.patch('searchlight.publisher.stop') as mock_stop:
+            mock_stop.side_effect = lambda timeout: self.assertTrue(
+                plugin.obj.flush_deferred_updates.called)
+            service.stop()
+        plugin.obj.flush_deferred_updates.assert_called_once_with()
+        self.assertTrue(mock_stop.called)
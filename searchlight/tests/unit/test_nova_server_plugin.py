@@ -15,12 +15,19 @@
 
 import copy
 import datetime
+import elasticsearch
+import eventlet
 import mock
 import novaclient.exceptions
 import novaclient.v2.servers as novaclient_servers
 
+from searchlight.elasticsearch.plugins import base
+from searchlight.elasticsearch.plugins import nova
+from searchlight.elasticsearch.plugins import utils
 from searchlight.elasticsearch.plugins.nova import\
     servers as servers_plugin
+from searchlight.elasticsearch.plugins.nova import\
+    servers_notification_handler
 import searchlight.tests.unit.utils as unit_test_utils
 import searchlight.tests.utils as test_utils
 
@@ -316,17 +323,354 @@ class TestServerLoaderPlugin(test_utils.BaseTestCase):
         mock_engine = mock.Mock()
         self.plugin.engine = mock_engine
 
+        now = datetime.datetime(2015, 10, 21, 10, 30)
         with mock.patch(nova_server_getter,
                         side_effect=novaclient.exceptions.NotFound('testing')):
-            self.plugin.get_notification_handler().create_or_update(
-                {u'instance_id': u'missing'}
-            )
+            with mock.patch('oslo_utils.timeutils.utcnow', return_value=now):
+                self.plugin.get_notification_handler().create_or_update(
+                    {u'instance_id': u'missing'}
+                )
 
             self.assertTrue(not mock_engine.index.called)
             mock_engine.delete.assert_called_once_with(
                 index=self.plugin.get_index_name(),
                 doc_type=self.plugin.get_document_type(),
-                id=u'missing')
+                id=u'missing',
+                version=utils.get_version({'updated_at': now.isoformat()}),
+                version_type='external_gte')
+
+    def test_coalesce_updates(self):
+        """A burst of notifications for a server results in one update"""
+        mock_engine = mock.Mock()
+        self.plugin.engine = mock_engine
+        self.config(update_coalesce_window=0.01,
+                    group='resource_plugin:os_nova_server')
+        handler = self.plugin.get_notification_handler()
+
+        with mock.patch(nova_server_getter,
+                        return_value=self.instance1) as mock_get:
+            for i in range(3):
+                handler.create_or_update({u'instance_id': ID1})
+            handler.update_from_neutron({u'port': {u'device_id': ID1}})
+            self.assertFalse(mock_get.called)
+
+            eventlet.sleep(0.05)
+
+        mock_get.assert_called_once_with(ID1)
+        self.assertEqual(1, mock_engine.index.call_count)
+
+    def test_coalesce_flush(self):
+        """Deferred updates are applied straight away when flushed"""
+        mock_engine = mock.Mock()
+        self.plugin.engine = mock_engine
+        self.config(update_coalesce_window=60,
+                    group='resource_plugin:os_nova_server')
+        handler = self.plugin.get_notification_handler()
+
+        with mock.patch(nova_server_getter,
+                        return_value=self.instance1) as mock_get:
+            handler.create_or_update({u'instance_id': ID1})
+            self.assertFalse(mock_get.called)
+            self.plugin.flush_deferred_updates()
+
+        mock_get.assert_called_once_with(ID1)
+        self.assertEqual(1, mock_engine.index.call_count)
+
+    def test_coalesce_delete(self):
+        """A delete is applied immediately and cancels pending updates"""
+        mock_engine = mock.Mock()
+        self.plugin.engine = mock_engine
+        self.config(update_coalesce_window=0.01,
+                    group='resource_plugin:os_nova_server')
+        handler = self.plugin.get_notification_handler()
+
+        with mock.patch(nova_server_getter) as mock_get:
+            handler.create_or_update({u'instance_id': ID1})
+            handler.delete({u'instance_id': ID1,
+                            u'deleted_at': u'2015-10-21T10:30:00.000000'})
+            mock_engine.delete.assert_called_once_with(
+                index=self.plugin.get_index_name(),
+                doc_type=self.plugin.get_document_type(),
+                id=ID1,
+                version=utils.get_version(
+                    {'updated_at': u'2015-10-21T10:30:00.000000'}),
+                version_type='external_gte')
+
+            eventlet.sleep(0.05)
+
+        self.assertFalse(mock_get.called)
+        self.assertFalse(mock_engine.index.called)
+
+    def test_exists_unchanged(self):
+        """Audit notifications for unchanged servers are ignored"""
+        mock_engine = mock.Mock()
+        self.plugin.engine = mock_engine
+        handler = self.plugin.get_notification_handler()
+        payload = {u'instance_id': ID1, u'state': u'active',
+                   u'state_description': u''}
+        fingerprint = servers_notification_handler.get_fingerprint(payload)
+
+        with mock.patch(nova_server_getter,
+                        return_value=self.instance1) as mock_get:
+            handler.create_or_update(dict(payload))
+            mock_engine.index.assert_called_once_with(
+                index=self.plugin.get_index_name(),
+                doc_type=self.plugin.get_document_type(),
+                body=mock.ANY,
+                id=ID1,
+                version=utils.get_version({'updated_at': updated_now}),
+                version_type='external_gte')
+            body = mock_engine.index.call_args[1]['body']
+            self.assertEqual(
+                fingerprint,
+                body[servers_notification_handler.FINGERPRINT_FIELD])
+
+            handler.update_if_changed(dict(payload))
+            self.assertEqual(1, mock_get.call_count)
+            self.assertFalse(mock_engine.get.called)
+
+            handler.update_if_changed(dict(payload, state=u'stopped'))
+            self.assertEqual(2, mock_get.call_count)
+
+    def test_exists_fingerprint_from_index(self):
+        """Fingerprints not cached locally are read from the index"""
+        mock_engine = mock.Mock()
+        self.plugin.engine = mock_engine
+        handler = self.plugin.get_notification_handler()
+        payload = {u'instance_id': ID1, u'state': u'active'}
+        mock_engine.get.return_value = {'_source': {
+            servers_notification_handler.FINGERPRINT_FIELD:
+                servers_notification_handler.get_fingerprint(payload)}}
+
+        with mock.patch(nova_server_getter) as mock_get:
+            handler.update_if_changed(dict(payload))
+            handler.update_if_changed(dict(payload))
+
+        self.assertFalse(mock_get.called)
+        self.assertFalse(mock_engine.index.called)
+        mock_engine.get.assert_called_once_with(
+            index=self.plugin.get_index_name(),
+            doc_type=self.plugin.get_document_type(),
+            id=ID1,
+            _source_include=[servers_notification_handler.FINGERPRINT_FIELD])
+
+        # A server that isn't indexed yet is
+        mock_engine.get.side_effect = elasticsearch.NotFoundError
+        with mock.patch(nova_server_getter,
+                        return_value=self.instance2) as mock_get:
+            handler.update_if_changed({u'instance_id': ID2})
+        mock_get.assert_called_once_with(ID2)
+        self.assertTrue(mock_engine.index.called)
+
+    def _notification_payload(self, **kwargs):
+        payload = {
+            u'instance_id': ID1,
+            u'display_name': u'instance1',
+            u'tenant_id': TENANT1,
+            u'user_id': USER1,
+            u'state': u'active',
+            u'state_description': u'rebooting',
+            u'host': u'host1',
+            u'node': u'devstack',
+            u'availability_zone': u'az1',
+            u'created_at': u'2015-10-21 10:20:30+00:00',
+            u'launched_at': u'2015-10-21T10:21:00.000000',
+            u'terminated_at': u'',
+            u'instance_flavor_id': u'1',
+            u'image_ref_url': u'http://localhost:9292/images/a',
+            u'access_ip_v4': None,
+            u'access_ip_v6': None,
+            u'metadata': {u'key': u'value'},
+            u'fixed_ips': [{
+                u'label': u'net4', u'address': u'10.0.0.3',
+                u'version': 4, u'type': u'fixed',
+                u'vif_mac': u'fa:16:3e:1e:37:32',
+                u'floating_ips': [{u'address': u'172.24.4.3',
+                                   u'type': u'floating', u'version': 4}]
+            }]
+        }
+        payload.update(kwargs)
+        return payload
+
+    def test_serialize_notification(self):
+        serialized = nova.serialize_server_notification(
+            self._notification_payload(),
+            updated=u'2015-10-21 10:22:00.123456')
+        ports = [{
+            u'OS-EXT-IPS-MAC:mac_addr': u'fa:16:3e:1e:37:32',
+            u'OS-EXT-IPS:type': u'fixed',
+            u'version': 4
+        }, {
+            u'OS-EXT-IPS-MAC:mac_addr': u'fa:16:3e:1e:37:32',
+            u'OS-EXT-IPS:type': u'floating',
+            u'version': 4
+        }]
+        expected = {
+            u'id': ID1,
+            u'name': u'instance1',
+            u'tenant_id': TENANT1,
+            u'owner': TENANT1,
+            u'user_id': USER1,
+            u'status': u'REBOOT',
+            u'OS-EXT-STS:vm_state': u'active',
+            u'OS-EXT-STS:task_state': u'rebooting',
+            u'OS-EXT-SRV-ATTR:host': u'host1',
+            u'OS-EXT-SRV-ATTR:hypervisor_hostname': u'devstack',
+            u'OS-EXT-AZ:availability_zone': u'az1',
+            u'OS-SRV-USG:launched_at': u'2015-10-21T10:21:00Z',
+            u'OS-SRV-USG:terminated_at': None,
+            u'accessIPv4': u'',
+            u'accessIPv6': u'',
+            u'metadata': {u'key': u'value'},
+            u'flavor': {u'id': u'1'},
+            u'image': {u'id': u'a'},
+            u'addresses': {u'net4': [
+                dict(ports[0], addr=u'10.0.0.3'),
+                dict(ports[1], addr=u'172.24.4.3')
+            ]},
+            u'networks': [
+                dict(ports[0], name=u'net4', ipv4_addr=u'10.0.0.3'),
+                dict(ports[1], name=u'net4', ipv4_addr=u'172.24.4.3')
+            ],
+            u'created': u'2015-10-21T10:20:30Z',
+            u'created_at': u'2015-10-21T10:20:30Z',
+            u'updated': u'2015-10-21T10:22:00Z',
+            u'updated_at': u'2015-10-21T10:22:00Z',
+        }
+        self.assertEqual(expected, serialized)
+
+        serialized = nova.serialize_server_notification(
+            self._notification_payload(state=u'stopped',
+                                       state_description=u''))
+        self.assertEqual(u'SHUTOFF', serialized[u'status'])
+        self.assertIsNone(serialized[u'OS-EXT-STS:task_state'])
+        self.assertNotIn(u'updated', serialized)
+
+    def test_update_from_payload(self):
+        """Servers are updated from notifications without calling nova"""
+        mock_engine = mock.Mock()
+        self.plugin.engine = mock_engine
+        self.config(use_notification_payload=True,
+                    group='resource_plugin:os_nova_server')
+        handler = self.plugin.get_notification_handler()
+        payload = self._notification_payload()
+        mock_engine.get.return_value = {'_source': {
+            u'id': ID1,
+            u'status': u'ACTIVE',
+            u'security_groups': [{u'name': u'default'}],
+            u'updated_at': u'2015-10-21T10:21:00Z'
+        }}
+
+        with mock.patch(nova_server_getter) as mock_get:
+            handler.process(None, 'compute.host1', 'compute.instance.update',
+                            payload, {'timestamp': u'2015-10-21 10:22:00'})
+            self.assertFalse(mock_get.called)
+
+        # Merged into the stored document, which is indexed whole with the
+        # notification's update time as its version
+        fingerprint = servers_notification_handler.get_fingerprint(payload)
+        mock_engine.index.assert_called_once_with(
+            index=self.plugin.get_index_name(),
+            doc_type=self.plugin.get_document_type(),
+            id=ID1,
+            body=mock.ANY,
+            version=utils.get_version(
+                {'updated_at': u'2015-10-21T10:22:00Z'}),
+            version_type='external_gte')
+        doc = mock_engine.index.call_args[1]['body']
+        self.assertEqual(u'REBOOT', doc[u'status'])
+        self.assertEqual([{u'name': u'default'}], doc[u'security_groups'])
+        self.assertEqual(u'2015-10-21T10:22:00Z', doc[u'updated'])
+        self.assertEqual(u'2015-10-21T10:22:00Z', doc[u'updated_at'])
+        self.assertEqual(fingerprint,
+                         doc[servers_notification_handler.FINGERPRINT_FIELD])
+        self.assertIsNone(doc[base.CONTENT_HASH_FIELD])
+        self.assertFalse(mock_engine.update.called)
+
+    def test_update_from_payload_after_delete(self):
+        """An older update processed after a server's deletion doesn't
+        recreate it
+        """
+        mock_engine = mock.Mock()
+        self.plugin.engine = mock_engine
+        self.config(use_notification_payload=True,
+                    group='resource_plugin:os_nova_server')
+        handler = self.plugin.get_notification_handler()
+
+        handler.process(None, 'compute.host1', 'compute.instance.delete.end',
+                        self._notification_payload(
+                            deleted_at=u'2015-10-21T10:30:00.000000'), {})
+        delete_version = mock_engine.delete.call_args[1]['version']
+
+        # Elasticsearch rejects indexing with an older version than the
+        # delete
+        mock_engine.get.side_effect = elasticsearch.NotFoundError
+        mock_engine.index.side_effect = elasticsearch.ConflictError
+        with mock.patch.object(servers_notification_handler.LOG,
+                               'error') as mock_error:
+            handler.process(None, 'compute.host1', 'compute.instance.update',
+                            self._notification_payload(),
+                            {'timestamp': u'2015-10-21 10:22:00'})
+            self.assertFalse(mock_error.called)
+
+        index_version = mock_engine.index.call_args[1]['version']
+        self.assertLess(index_version, delete_version)
+        self.assertFalse(mock_engine.update.called)
+
+    def test_update_from_payload_rejects_stale_index(self):
+        """A full index of older data than a payload update is rejected,
+        since the document's version is the payload's update time
+        """
+        mock_engine = mock.Mock()
+        self.plugin.engine = mock_engine
+        self.config(use_notification_payload=True,
+                    group='resource_plugin:os_nova_server')
+        handler = self.plugin.get_notification_handler()
+        mock_engine.get.return_value = {'_source': {
+            u'id': ID1, u'updated_at': u'2015-10-21T10:20:30Z'}}
+
+        handler.process(None, 'compute.host1', 'compute.instance.update',
+                        self._notification_payload(),
+                        {'timestamp': u'2015-10-21 10:22:00'})
+        payload_version = mock_engine.index.call_args[1]['version']
+
+        stale = _instance_fixture(
+            ID1, u'instance1', tenant_id=TENANT1, flavor=flavor1,
+            image=imagea, addresses=net_ipv4,
+            updated=u'2015-10-21T10:21:00Z')
+        with mock.patch(nova_server_getter, return_value=stale):
+            handler.create_or_update({u'instance_id': ID1})
+        stale_version = mock_engine.index.call_args[1]['version']
+        self.assertEqual(
+            utils.get_version({'updated_at': u'2015-10-21T10:21:00Z'}),
+            stale_version)
+        # Less than (rather than one more than) the stored version, so
+        # elasticsearch refuses it
+        self.assertLess(stale_version, payload_version)
+        self.assertEqual(
+            utils.get_version({'updated_at': u'2015-10-21T10:22:00Z'}),
+            payload_version)
+
+    def test_update_from_payload_backfill(self):
+        """New servers are retrieved from nova for fields payloads lack"""
+        mock_engine = mock.Mock()
+        self.plugin.engine = mock_engine
+        self.config(use_notification_payload=True,
+                    group='resource_plugin:os_nova_server')
+        handler = self.plugin.get_notification_handler()
+
+        with mock.patch(nova_server_getter,
+                        return_value=self.instance1) as mock_get:
+            handler.process(None, 'compute.host1',
+                            'compute.instance.create.end',
+                            self._notification_payload(), {})
+            eventlet.sleep(0)
+            self.assertFalse(mock_get.called)
+            self.plugin.flush_deferred_updates()
+
+        mock_get.assert_called_once_with(ID1)
+        self.assertEqual(1, mock_engine.update.call_count)
+        self.assertEqual(1, mock_engine.index.call_count)
 
     def test_facets_non_admin(self):
         mock_engine = mock.Mock()
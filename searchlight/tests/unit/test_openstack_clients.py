@@ -0,0 +1,74 @@
+# Copyright (c) 2015 Hewlett-Packard Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from glanceclient import exc as glance_exc
+import mock
+
+from searchlight.elasticsearch.plugins import openstack_clients
+import searchlight.tests.utils as test_utils
+
+
+class TestOpenStackClients(test_utils.BaseTestCase):
+    def setUp(self):
+        super(TestOpenStackClients, self).setUp()
+        openstack_clients.reset()
+        self.addCleanup(openstack_clients.reset)
+
+        self.mock_session = mock.Mock()
+        self.mock_session.get_endpoint.return_value = \
+            'http://localhost/glance/v2'
+        self.mock_session.auth.get_token.return_value = 'token1'
+        patched_ses = mock.patch(
+            'searchlight.elasticsearch.plugins.openstack_clients._get_session',
+            return_value=self.mock_session)
+        patched_ses.start()
+        self.addCleanup(patched_ses.stop)
+
+    def test_clients_cached(self):
+        with mock.patch('novaclient.client.Client') as mock_nova:
+            self.assertIs(openstack_clients.get_novaclient(),
+                          openstack_clients.get_novaclient())
+        mock_nova.assert_called_once_with(version=2,
+                                          session=self.mock_session,
+                                          region_name=mock.ANY)
+
+        with mock.patch('designateclient.v2.client.Client') as mock_dns:
+            self.assertIs(openstack_clients.get_designateclient(),
+                          openstack_clients.get_designateclient())
+        self.assertEqual(1, mock_dns.call_count)
+
+    def test_glanceclient_token_refresh(self):
+        """The glance client is rebuilt once the session's token changes"""
+        client1 = openstack_clients.get_glanceclient()
+        self.assertIs(client1, openstack_clients.get_glanceclient())
+
+        self.mock_session.auth.get_token.return_value = 'token2'
+        client2 = openstack_clients.get_glanceclient()
+        self.assertIsNot(client1, client2)
+        self.assertIs(client2, openstack_clients.get_glanceclient())
+
+    def test_reset_on_unauthorized(self):
+        client = openstack_clients.get_glanceclient()
+        calls = []
+
+        @openstack_clients.clear_cached_glanceclient_on_unauthorized
+        def call_glance():
+            calls.append(openstack_clients.get_glanceclient())
+            if len(calls) == 1:
+                raise glance_exc.Unauthorized()
+
+        call_glance()
+        self.assertIs(client, calls[0])
+        self.assertIsNot(client, calls[1])
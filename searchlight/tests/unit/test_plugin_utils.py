@@ -0,0 +1,186 @@
+# Copyright (c) 2015 Hewlett-Packard Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import eventlet
+import mock
+import os
+
+from searchlight.elasticsearch.plugins import utils
+import searchlight.tests.utils as test_utils
+
+
+class TestIndexAliases(test_utils.BaseTestCase):
+    def setUp(self):
+        super(TestIndexAliases, self).setUp()
+        self.engine = mock.Mock()
+
+    def test_versioned_index_name(self):
+        name = utils.get_versioned_index_name('searchlight')
+        self.assertTrue(name.startswith('searchlight-'))
+        self.assertNotEqual(name, utils.get_versioned_index_name('other'))
+
+    def test_alias_indices_missing(self):
+        self.engine.indices.exists.return_value = False
+        self.assertEqual([], utils.get_alias_indices(self.engine,
+                                                     'searchlight'))
+
+    def test_alias_indices_plain_index(self):
+        self.engine.indices.exists.return_value = True
+        self.engine.indices.exists_alias.return_value = False
+        self.assertEqual(['searchlight'],
+                         utils.get_alias_indices(self.engine, 'searchlight'))
+
+    def test_switch_alias(self):
+        self.engine.indices.exists.return_value = True
+        self.engine.indices.exists_alias.return_value = True
+        self.engine.indices.get_alias.return_value = {
+            'searchlight-old': {'aliases': {'searchlight': {}}}
+        }
+
+        old = utils.switch_alias(self.engine, 'searchlight', 'searchlight-new')
+
+        self.assertEqual(['searchlight-old'], old)
+        self.assertFalse(self.engine.indices.delete.called)
+        self.engine.indices.update_aliases.assert_called_once_with(body={
+            'actions': [
+                {'remove': {'index': 'searchlight-old',
+                            'alias': 'searchlight'}},
+                {'add': {'index': 'searchlight-new', 'alias': 'searchlight'}}
+            ]
+        })
+
+    def test_switch_alias_replaces_plain_index(self):
+        self.engine.indices.exists.return_value = True
+        self.engine.indices.exists_alias.return_value = False
+
+        old = utils.switch_alias(self.engine, 'searchlight', 'searchlight-new')
+
+        self.assertEqual([], old)
+        self.engine.indices.delete.assert_called_once_with(
+            index='searchlight')
+        self.engine.indices.update_aliases.assert_called_once_with(body={
+            'actions': [
+                {'add': {'index': 'searchlight-new', 'alias': 'searchlight'}}
+            ]
+        })
+
+    def test_build_settings_to_restore(self):
+        self.engine.indices.get_settings.return_value = {
+            'searchlight-new': {
+                'settings': {'index': {'number_of_replicas': '2',
+                                       'number_of_shards': '5'}}
+            }
+        }
+        self.assertEqual(
+            {'index': {'number_of_replicas': '2', 'refresh_interval': '1s'}},
+            utils.get_build_settings_to_restore(self.engine,
+                                                'searchlight-new'))
+
+
+class TestIncrementalSync(test_utils.BaseTestCase):
+    def test_is_updated_since(self):
+        since = datetime.datetime(2015, 10, 1, 12, 0, 0)
+        self.assertTrue(utils.is_updated_since(
+            {'updated_at': '2015-10-01T12:30:00Z'}, since))
+        self.assertFalse(utils.is_updated_since(
+            {'updated_at': '2015-10-01T11:30:00Z'}, since))
+        # Falls back to created_at, and assumes a change if neither is set
+        self.assertFalse(utils.is_updated_since(
+            {'updated_at': None, 'created_at': '2015-09-01T00:00:00Z'},
+            since))
+        self.assertTrue(utils.is_updated_since({}, since))
+
+    def test_content_hash(self):
+        document = {'id': 'abc', 'name': 'test', 'tags': ['a', 'b']}
+        reordered = {'tags': ['a', 'b'], 'name': 'test', 'id': 'abc'}
+        self.assertEqual(utils.get_content_hash(document),
+                         utils.get_content_hash(reordered))
+        self.assertNotEqual(utils.get_content_hash(document),
+                            utils.get_content_hash(dict(document, name='x')))
+
+    def test_get_version(self):
+        self.assertEqual(1443702600000, utils.get_version(
+            {'updated_at': '2015-10-01T12:30:00Z'}))
+        self.assertEqual(1443702600123, utils.get_version(
+            {'updated_at': '2015-10-01T14:30:00.123456+02:00'}))
+        self.assertIsNone(utils.get_version({'updated_at': None}))
+
+    def test_sync_state(self):
+        path = os.path.join(self.test_dir, 'sync_state.json')
+        state = utils.SyncState(path)
+        self.assertIsNone(state.get('OS::Nova::Server', 'last_sync'))
+
+        state.set('OS::Nova::Server', 'last_sync', '2015-10-01T12:00:00Z')
+        self.assertFalse(os.path.exists(path + '.tmp'))
+
+        reloaded = utils.SyncState(path)
+        self.assertEqual('2015-10-01T12:00:00Z',
+                         reloaded.get('OS::Nova::Server', 'last_sync'))
+        self.assertIsNone(reloaded.get('OS::Glance::Image', 'last_sync'))
+
+    def test_sync_state_path(self):
+        self.config(lock_path=self.test_dir, group='oslo_concurrency')
+        self.assertEqual(
+            os.path.join(self.test_dir, 'searchlight_sync_state.json'),
+            utils.get_sync_state_path())
+
+        path = os.path.join(self.test_dir, 'sync_state.json')
+        self.config(sync_state_file=path, group='resource_plugin')
+        self.assertEqual(path, utils.get_sync_state_path())
+
+
+class TestPrefetchPages(test_utils.BaseTestCase):
+    def setUp(self):
+        super(TestPrefetchPages, self).setUp()
+        self.pages = {None: [1, 2], 2: [3, 4], 4: [5], 5: []}
+        self.list_page = mock.Mock(side_effect=lambda m: self.pages[m])
+
+    def test_prefetch(self):
+        self.assertEqual([1, 2, 3, 4, 5], list(utils.prefetch_pages(
+            self.list_page, lambda item: item)))
+        self.assertEqual([mock.call(None), mock.call(2), mock.call(4),
+                          mock.call(5)], self.list_page.call_args_list)
+
+    def test_no_read_ahead(self):
+        self.assertEqual([3, 4, 5], list(utils.prefetch_pages(
+            self.list_page, lambda item: item, marker=2, depth=0)))
+
+    def test_short_page(self):
+        """A page shorter than page_size is the last"""
+        self.assertEqual([1, 2, 3, 4, 5], list(utils.prefetch_pages(
+            self.list_page, lambda item: item, page_size=2)))
+        self.assertEqual(3, self.list_page.call_count)
+
+    def test_read_ahead(self):
+        """The next page is requested while a page is being consumed"""
+        items = utils.prefetch_pages(self.list_page, lambda item: item)
+        self.assertEqual(1, next(items))
+        eventlet.sleep(0)
+        self.assertEqual([mock.call(None), mock.call(2)],
+                         self.list_page.call_args_list)
+        items.close()
+
+    def test_error(self):
+        self.pages[4] = ValueError('listing failed')
+
+        def list_page(marker):
+            if isinstance(self.pages[marker], Exception):
+                raise self.pages[marker]
+            return self.pages[marker]
+
+        items = utils.prefetch_pages(list_page, lambda item: item)
+        self.assertEqual([1, 2, 3, 4], [next(items) for i in range(4)])
+        self.assertRaises(ValueError, next, items)
@@ -0,0 +1,94 @@
+# Copyright (c) 2015 Hewlett-Packard Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import mock
+import requests
+
+from searchlight.elasticsearch.plugins.glance import \
+    images_notification_handler
+from searchlight import publisher
+import searchlight.tests.utils as test_utils
+
+
+class TestPublisher(test_utils.BaseTestCase):
+    def setUp(self):
+        super(TestPublisher, self).setUp()
+        self.config(batch_size=3, batch_timeout=0,
+                    workers=1, group='publisher')
+        patched_post = mock.patch('requests.Session.post')
+        self.mock_post = patched_post.start()
+        self.addCleanup(patched_post.stop)
+
+    def _publisher(self):
+        pub = publisher.Publisher()
+        self.addCleanup(pub.stop, 0)
+        return pub
+
+    def _posted(self):
+        return [[m['body'] for m in json.loads(call[1]['data'])['messages']]
+                for call in self.mock_post.call_args_list]
+
+    def test_batches(self):
+        """Queued messages are posted in batches without blocking"""
+        pub = self._publisher()
+        for i in range(4):
+            pub.publish({'id': i})
+        self.assertFalse(self.mock_post.called)
+
+        pub.stop()
+        self.assertEqual([[{'id': 0}, {'id': 1}, {'id': 2}], [{'id': 3}]],
+                         self._posted())
+        self.assertEqual(4, pub.stats['published'])
+        self.assertEqual(2, pub.stats['batches'])
+
+    def test_drop_new(self):
+        self.config(queue_size=2, group='publisher')
+        pub = self._publisher()
+        for i in range(3):
+            pub.publish({'id': i})
+        pub.stop()
+        self.assertEqual([[{'id': 0}, {'id': 1}]], self._posted())
+        self.assertEqual(1, pub.stats['dropped'])
+
+    def test_drop_old(self):
+        self.config(queue_size=2, overflow_policy='drop_old',
+                    group='publisher')
+        pub = self._publisher()
+        for i in range(3):
+            pub.publish({'id': i})
+        pub.stop()
+        self.assertEqual([[{'id': 1}, {'id': 2}]], self._posted())
+        self.assertEqual(1, pub.stats['dropped'])
+
+    def test_failed_post(self):
+        self.mock_post.side_effect = requests.ConnectionError('down')
+        pub = self._publisher()
+        pub.publish({'id': 0})
+        pub.stop()
+        self.assertEqual(1, pub.stats['failed'])
+        self.assertEqual(0, pub.stats['published'])
+
+    def test_push_disabled(self):
+        """Handlers only publish if their plugin has enable_push set"""
+        handler = images_notification_handler.ImageHandler(
+            None, 'searchlight', 'OS::Glance::Image')
+        with mock.patch.object(publisher, 'publish') as mock_publish:
+            handler.publish({'id': 0})
+            self.assertFalse(mock_publish.called)
+
+            handler.push = True
+            handler.publish({'id': 0})
+            mock_publish.assert_called_once_with({'id': 0})
@@ -0,0 +1,143 @@
+# Copyright (c) 2015 Hewlett-Packard Development Company, L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+import webob.exc
+
+from searchlight.api.v1 import search
+from searchlight.common import exception
+from searchlight.common import result_cache
+import searchlight.elasticsearch
+from searchlight import listener
+import searchlight.tests.unit.utils as unit_test_utils
+import searchlight.tests.utils as test_utils
+
+
+class TestResultCache(test_utils.BaseTestCase):
+    def setUp(self):
+        super(TestResultCache, self).setUp()
+        self.config(enabled=True, refresh_delay=0, group='result_cache')
+        patched_cache = mock.patch.object(result_cache, '_result_cache',
+                                          (None, None))
+        patched_cache.start()
+        self.addCleanup(patched_cache.stop)
+        self.cache = result_cache.get_result_cache()
+
+    def test_memory_backend(self):
+        self.config(max_entries=2, group='result_cache')
+        backend = result_cache.MemoryBackend()
+        with mock.patch('time.time', return_value=100):
+            backend.set('a', 1, 10)
+            backend.set('b', 2, 20)
+            backend.set('c', 3, 20)
+        with mock.patch('time.time', return_value=115):
+            # 'a' was evicted to make room for 'c'; 'b' has expired
+            self.assertIsNone(backend.get('a'))
+            self.assertEqual(2, backend.get('b'))
+            self.assertEqual(3, backend.get('c'))
+        with mock.patch('time.time', return_value=125):
+            self.assertIsNone(backend.get('b'))
+
+    def test_key(self):
+        """Keys depend on the request, who made it and the generations of
+        the types searched
+        """
+        context = unit_test_utils.get_fake_request(tenant='t1').context
+        other = unit_test_utils.get_fake_request(tenant='t2').context
+        other_user = unit_test_utils.get_fake_request(user='u2',
+                                                      tenant='t1').context
+        request = {'query': {'match_all': {}}}
+        key = self.cache.get_key(context, ['OS::A', 'OS::B'], request)
+
+        self.assertEqual(key, self.cache.get_key(
+            context, ['OS::B', 'OS::A'], dict(request)))
+        self.assertNotEqual(key, self.cache.get_key(
+            other, ['OS::A', 'OS::B'], request))
+        self.assertNotEqual(key, self.cache.get_key(
+            other_user, ['OS::A', 'OS::B'], request))
+        self.assertNotEqual(key, self.cache.get_key(
+            context, ['OS::A', 'OS::B'], {'query': {'term': {'a': 1}}}))
+
+        self.cache.invalidate(['OS::C'])
+        self.assertEqual(key, self.cache.get_key(
+            context, ['OS::A', 'OS::B'], request))
+        self.cache.invalidate(['OS::B'])
+        self.assertNotEqual(key, self.cache.get_key(
+            context, ['OS::A', 'OS::B'], request))
+
+    def test_controller(self):
+        """Repeated searches are answered from the cache until a write"""
+        plugin = mock.Mock()
+        controller = search.SearchController({'OS::Test': plugin},
+                                             es_api=mock.Mock())
+        request = unit_test_utils.get_fake_request()
+        result = {'hits': {'hits': [{'_type': 'OS::Test', '_source': {}}]}}
+
+        with mock.patch.object(searchlight.elasticsearch.CatalogSearchRepo,
+                               'search', return_value=result) as mock_search, \
+                mock.patch.object(searchlight.elasticsearch.CatalogSearchRepo,
+                                  'index', return_value=(1, [])):
+            for i in range(2):
+                self.assertEqual(result, controller.search(
+                    request, {'match_all': {}}, doc_type=['OS::Test']))
+            self.assertEqual(1, mock_search.call_count)
+            self.assertEqual(1, plugin.obj.filter_result.call_count)
+
+            controller.index(unit_test_utils.get_fake_request(is_admin=True),
+                             [{'_op_type': 'delete', '_id': '1',
+                               '_type': 'OS::Test'}])
+            controller.search(request, {'match_all': {}},
+                              doc_type=['OS::Test'])
+            self.assertEqual(2, mock_search.call_count)
+
+    def test_controller_enforces_policy(self):
+        """Cached results aren't returned to a caller denied by policy"""
+        controller = search.SearchController({'OS::Test': mock.Mock()},
+                                             es_api=mock.Mock())
+        request = unit_test_utils.get_fake_request()
+        result = {'hits': {'hits': []}}
+
+        with mock.patch.object(searchlight.elasticsearch.CatalogSearchRepo,
+                               'search', return_value=result) as mock_search:
+            controller.search(request, {'match_all': {}},
+                              doc_type=['OS::Test'])
+            with mock.patch.object(controller.policy, 'enforce',
+                                   side_effect=exception.Forbidden):
+                self.assertRaises(
+                    webob.exc.HTTPForbidden, controller.search, request,
+                    {'match_all': {}}, doc_type=['OS::Test'])
+            self.assertEqual(1, mock_search.call_count)
+
+    def test_listener_invalidates(self):
+        """Notifications invalidate their type and related types"""
+        def plugin(doc_type, parent_type=None):
+            plugin = mock.Mock()
+            plugin.obj.get_document_type.return_value = doc_type
+            plugin.obj.get_mapping.return_value = (
+                {'_parent': {'type': parent_type}} if parent_type else {})
+            plugin.obj.get_notification_supported_events.return_value = [
+                doc_type.lower() + '.create']
+            return plugin
+
+        endpoint = listener.NotificationEndpoint({
+            'OS::Zone': plugin('OS::Zone'),
+            'OS::RecordSet': plugin('OS::RecordSet', 'OS::Zone'),
+            'OS::Server': plugin('OS::Server')})
+
+        with mock.patch.object(self.cache, 'invalidate') as mock_invalidate:
+            endpoint.info({}, 'test', 'os::zone.create', {'id': '1'}, {})
+            mock_invalidate.assert_called_once_with(
+                set(['OS::Zone', 'OS::RecordSet']))
@@ -14,6 +14,7 @@
 #    under the License.
 
 import mock
+import operator
 from oslo_serialization import jsonutils
 import six
 import webob.exc
@@ -55,6 +56,71 @@ def _image_fixture(op_type, _id=None, index='searchlight',
     return _action_fixture(op_type, image_data, index, doc_type, _id, **kwargs)
 
 
+class TestPluginRegistry(test_utils.BaseTestCase):
+    def setUp(self):
+        super(TestPluginRegistry, self).setUp()
+        patched_registry = mock.patch.object(utils, '_plugin_registry',
+                                             (None, None))
+        patched_registry.start()
+        self.addCleanup(patched_registry.stop)
+        self.plugin = mock.Mock()
+        patched_load = mock.patch.object(
+            utils, 'get_search_plugins',
+            return_value={'OS::Test': self.plugin})
+        self.mock_load = patched_load.start()
+        self.addCleanup(patched_load.stop)
+
+    def test_loaded_once(self):
+        """Plugins are loaded once and shared by every search repo"""
+        context = unit_test_utils.get_fake_request().context
+        repos = [searchlight.elasticsearch.CatalogSearchRepo(context, None)
+                 for i in range(3)]
+        search.create_resource()
+
+        self.assertEqual(1, self.mock_load.call_count)
+        self.assertIs(repos[0].plugins, repos[2].plugins)
+        self.assertEqual({'OS::Test': self.plugin}, dict(repos[0].plugins))
+        self.assertRaises(TypeError, operator.setitem, repos[0].plugins,
+                          'OS::Other', mock.Mock())
+
+    def test_reloaded_after_fork(self):
+        registry = utils.get_search_plugin_registry()
+        with mock.patch('os.getpid', return_value=-1):
+            self.assertIsNot(registry, utils.get_search_plugin_registry())
+        self.assertEqual(2, self.mock_load.call_count)
+
+
+class TestElasticsearchClient(test_utils.BaseTestCase):
+    def setUp(self):
+        super(TestElasticsearchClient, self).setUp()
+        patched_api = mock.patch.object(searchlight.elasticsearch, '_api',
+                                        (None, None))
+        patched_api.start()
+        self.addCleanup(patched_api.stop)
+
+    def test_shared_client(self):
+        """One client is created per process, using the configuration"""
+        self.config(timeout=30, connections_per_host=25,
+                    retry_on_timeout=True, http_compress=True,
+                    group='elasticsearch')
+        with mock.patch('elasticsearch.Elasticsearch') as mock_es:
+            es_api = searchlight.elasticsearch.get_api()
+            self.assertIs(es_api, searchlight.elasticsearch.get_api())
+            self.assertIs(es_api, searchlight.gateway.Gateway().es_api)
+            self.assertEqual(1, mock_es.call_count)
+
+            with mock.patch('os.getpid', return_value=-1):
+                searchlight.elasticsearch.get_api()
+            self.assertEqual(2, mock_es.call_count)
+
+        kwargs = mock_es.call_args[1]
+        self.assertEqual(30, kwargs['timeout'])
+        self.assertEqual(25, kwargs['maxsize'])
+        self.assertTrue(kwargs['retry_on_timeout'])
+        connection = kwargs['connection_class'](host='localhost')
+        self.assertEqual('gzip,deflate', connection.headers['accept-encoding'])
+
+
 class TestControllerIndex(test_utils.BaseTestCase):
     def setUp(self):
         super(TestControllerIndex, self).setUp()
@@ -627,19 +693,58 @@ class TestSearchDeserializer(test_utils.BaseTestCase):
 
         expected_query = {
             'query': {
-                'bool': {
-                    'should': [{
-                        'filtered': {
-                            'filter': [nova_rbac_filter],
-                            'query': {u'match_all': {}}
-                        }
-                    }]
+                'filtered': {
+                    'filter': {'or': [nova_rbac_filter]},
+                    'query': {u'match_all': {}}
                 }
             }
         }
 
         self.assertEqual(expected_query, output['query'])
 
+    def test_rbac_multiple_types(self):
+        """The query appears once, with an RBAC filter for each type"""
+        request = unit_test_utils.get_fake_request(is_admin=False)
+        request.body = six.b(jsonutils.dumps({
+            'query': {'match': {'name': 'test'}},
+            'type': ['OS::Nova::Server', 'OS::Glance::Image'],
+        }))
+        output = self.deserializer.search(request)
+
+        filtered = output['query']['query']['filtered']
+        self.assertEqual({'match': {'name': 'test'}}, filtered['query'])
+        type_filters = sorted(
+            f['indices']['filter']['and'][-1]['type']['value']
+            for f in filtered['filter']['or'])
+        self.assertEqual(['OS::Glance::Image', 'OS::Nova::Server'],
+                         type_filters)
+
+    @mock.patch('searchlight.elasticsearch.plugins.nova.servers.' +
+                'ServerIndex.get_rbac_filter')
+    def test_rbac_filters_cached(self, mock_rbac_filter):
+        """RBAC filters are only built once for the same user and types"""
+        mock_rbac_filter.side_effect = lambda context: [
+            {'term': {'tenant_id': context.owner}}]
+
+        def search(tenant):
+            request = unit_test_utils.get_fake_request(tenant=tenant)
+            request.body = six.b(jsonutils.dumps({
+                'query': {'match_all': {}},
+                'type': 'OS::Nova::Server',
+            }))
+            query = self.deserializer.search(request)['query']
+            return query['query']['filtered']['filter']
+
+        self.assertEqual({'or': [{'term': {'tenant_id': 'tenant1'}}]},
+                         search('tenant1'))
+        self.assertEqual({'or': [{'term': {'tenant_id': 'tenant1'}}]},
+                         search('tenant1'))
+        self.assertEqual(1, mock_rbac_filter.call_count)
+
+        self.assertEqual({'or': [{'term': {'tenant_id': 'tenant2'}}]},
+                         search('tenant2'))
+        self.assertEqual(2, mock_rbac_filter.call_count)
+
     def test_rbac_admin(self):
         """Test that admins have RBAC applied unless 'all_projects' is true"""
         request = unit_test_utils.get_fake_request(is_admin=True)
@@ -664,13 +769,9 @@ class TestSearchDeserializer(test_utils.BaseTestCase):
         }
         expected_query = {
             'query': {
-                'bool': {
-                    'should': [{
-                        'filtered': {
-                            'filter': [nova_rbac_filter],
-                            'query': {u'match_all': {}}
-                        }
-                    }]
+                'filtered': {
+                    'filter': {'or': [nova_rbac_filter]},
+                    'query': {u'match_all': {}}
                 }
             }
         }
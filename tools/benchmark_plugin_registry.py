@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Measures the per-request cost of setting up a search repository when
+search plugins are loaded with stevedore for every request, compared with
+sharing the process-wide plugin registry. Uses the plugins enabled in the
+usual searchlight configuration files; Elasticsearch isn't contacted.
+
+    $ python tools/benchmark_plugin_registry.py --iterations 500
+"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+import time
+
+import mock
+
+from searchlight.common import config
+from searchlight.common import utils
+import searchlight.elasticsearch
+
+
+def _percentile(timings, percent):
+    timings = sorted(timings)
+    index = min(int(round(percent / 100.0 * len(timings))),
+                len(timings) - 1)
+    return timings[index]
+
+
+def _measure(iterations):
+    context = mock.Mock()
+    timings = []
+    for i in range(iterations):
+        start = time.time()
+        searchlight.elasticsearch.CatalogSearchRepo(context, None)
+        timings.append((time.time() - start) * 1000)
+    return timings
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    args, remaining = parser.parse_known_args(argv)
+
+    config.parse_args(args=remaining)
+    utils.register_plugin_opts()
+
+    with mock.patch.object(utils, 'get_search_plugin_registry',
+                           utils.get_search_plugins):
+        per_request = _measure(args.iterations)
+    # The first call loads the registry; it's paid once per worker
+    utils.get_search_plugin_registry()
+    shared = _measure(args.iterations)
+
+    print("%-12s %10s %10s" % ('', 'p50 (ms)', 'p99 (ms)'))
+    for name, timings in (('per-request', per_request),
+                          ('registry', shared)):
+        print("%-12s %10.3f %10.3f" % (name, _percentile(timings, 50),
+                                       _percentile(timings, 99)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compares the search query searchlight used to build for non-admin
+requests, with the user's query repeated under each resource type's RBAC
+filter, against the single query filtered by an OR of those filters.
+
+Documents of several types are indexed into a scratch index on the given
+Elasticsearch node, which is deleted afterwards. Both queries are checked to
+return the same hits in the same order before they're timed.
+
+    $ python tools/benchmark_rbac_query.py --host localhost:9200 --types 5
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+import sys
+import time
+
+import elasticsearch
+from elasticsearch import helpers
+
+INDEX = 'searchlight-rbac-benchmark'
+WORDS = ('alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf',
+         'hotel', 'india', 'juliet', 'kilo', 'lima', 'mike', 'november')
+
+
+def _rbac_filter(doc_type, project):
+    # The shape of IndexBase.get_rbac_filter
+    return {
+        'indices': {
+            'index': INDEX,
+            'no_match_filter': 'none',
+            'filter': {
+                'and': [{'term': {'project_id': project}},
+                        {'type': {'value': doc_type}}]
+            }
+        }
+    }
+
+
+def per_type_query(query, doc_types, project):
+    return {
+        'bool': {
+            'should': [{'filtered': {
+                'query': query,
+                'filter': [_rbac_filter(doc_type, project)]
+            }} for doc_type in doc_types]
+        }
+    }
+
+
+def single_query(query, doc_types, project):
+    return {
+        'filtered': {
+            'query': query,
+            'filter': {'or': [_rbac_filter(doc_type, project)
+                              for doc_type in doc_types]}
+        }
+    }
+
+
+def _documents(doc_types, count, projects):
+    for doc_type in doc_types:
+        for i in range(count):
+            yield {
+                '_index': INDEX,
+                '_type': doc_type,
+                '_id': '%s-%d' % (doc_type, i),
+                '_source': {
+                    'project_id': random.choice(projects),
+                    'name': ' '.join(random.sample(WORDS, 3)),
+                    'description': ' '.join(random.choice(WORDS)
+                                            for j in range(20))
+                }
+            }
+
+
+def _percentile(timings, percent):
+    timings = sorted(timings)
+    index = min(int(round(percent / 100.0 * len(timings))),
+                len(timings) - 1)
+    return timings[index]
+
+
+def _search(es, query, size):
+    return es.search(index=INDEX, body={'query': query, 'size': size})
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='localhost:9200')
+    parser.add_argument('--types', type=int, default=5,
+                        help='Number of resource types searched.')
+    parser.add_argument('--documents', type=int, default=20000,
+                        help='Number of documents of each type.')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    es = elasticsearch.Elasticsearch(hosts=[args.host])
+    doc_types = ['OS::Benchmark::Type%d' % i for i in range(args.types)]
+    projects = ['project-%d' % i for i in range(10)]
+    query = {'multi_match': {'query': 'alpha delta kilo',
+                             'fields': ['name', 'description']}}
+
+    es.indices.create(index=INDEX)
+    try:
+        helpers.bulk(es, _documents(doc_types, args.documents, projects))
+        es.indices.refresh(index=INDEX)
+
+        shapes = (('per-type', per_type_query), ('single', single_query))
+        hits = {}
+        for name, build in shapes:
+            result = _search(es, build(query, doc_types, projects[0]), 100)
+            hits[name] = [hit['_id'] for hit in result['hits']['hits']]
+        if hits['per-type'] != hits['single']:
+            print("Queries returned different hits", file=sys.stderr)
+            return 1
+
+        print("%d types, %d documents each" % (args.types, args.documents))
+        print("%-10s %12s %12s %12s %12s" % ('', 'took p50', 'took p99',
+                                             'wall p50', 'wall p99'))
+        for name, build in shapes:
+            took, wall = [], []
+            for i in range(args.iterations):
+                project = random.choice(projects)
+                start = time.time()
+                result = _search(es, build(query, doc_types, project), 10)
+                wall.append((time.time() - start) * 1000)
+                took.append(result['took'])
+            print("%-10s %10dms %10dms %10.1fms %10.1fms" % (
+                name, _percentile(took, 50), _percentile(took, 99),
+                _percentile(wall, 50), _percentile(wall, 99)))
+    finally:
+        es.indices.delete(index=INDEX)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))